@@ -0,0 +1,127 @@
+"""Run the benchmark suite and write one JSON document per measurement
+
+    python -m benchmarks --output results.jsonl ingest read webhook
+
+The database has to be migrated beforehand, see README.md.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+from typing import TextIO
+
+from benchmarks.harness import running_service
+from benchmarks.scenarios import SERVICE_SCENARIOS, STANDALONE_SCENARIOS
+from benchmarks.stubs import StandIns
+from fhir_datasequence import config
+
+QUICK = {
+    "batch_sizes": [1, 100, 1000],
+    "read_sizes": [1000, 100000],
+    "webhook_shapes": [(1, 100), (10, 100)],
+    "concurrency_levels": [1, 4, 16],
+}
+FULL = {
+    "batch_sizes": [1, 10, 100, 500, 1000, 5000, 10000],
+    "read_sizes": [1000, 100000, 1000000, 10000000],
+    "webhook_shapes": [(1, 100), (10, 100), (100, 100), (10, 1000)],
+    "concurrency_levels": [1, 2, 4, 8, 16, 32, 64],
+}
+
+
+def integers(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def shapes(value: str) -> list[tuple[int, int]]:
+    return [
+        (int(users), int(activities))
+        for users, activities in (item.split("x") for item in value.split(","))
+    ]
+
+
+def parse_options(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    scenarios = [*STANDALONE_SCENARIOS, *SERVICE_SCENARIOS]
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help=f"Scenarios to run, all of them by default: {', '.join(scenarios)}",
+    )
+    parser.add_argument("--output", type=argparse.FileType("a"), default=sys.stdout)
+    parser.add_argument("--full", action="store_true", help="Use the full size ranges")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-sizes", type=integers)
+    parser.add_argument("--read-sizes", type=integers)
+    parser.add_argument("--max-stream-rows", type=int, default=1000000)
+    parser.add_argument("--panel-size", type=int, default=50)
+    parser.add_argument("--webhook-shapes", type=shapes, help="e.g. 1x100,10x100")
+    parser.add_argument("--webhook-rounds", type=int, default=5)
+    parser.add_argument("--concurrency-levels", type=integers)
+    parser.add_argument(
+        "--upstream-latency",
+        type=float,
+        default=0.02,
+        help="Seconds added to every stand-in FHIR and Metriport response",
+    )
+    options = parser.parse_args(argv)
+    for name, value in (FULL if options.full else QUICK).items():
+        if getattr(options, name) is None:
+            setattr(options, name, value)
+    unknown = set(options.scenarios) - set(scenarios)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    options.scenarios = options.scenarios or scenarios
+    return options
+
+
+def run_metadata(options: argparse.Namespace):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "started_at": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "full": options.full,
+    }
+
+
+def write(output: TextIO, metadata: dict, benchmark: str, result: dict):
+    output.write(json.dumps({**metadata, "benchmark": benchmark, **result}) + "\n")
+    output.flush()
+
+
+async def run(options: argparse.Namespace):
+    metadata = run_metadata(options)
+    for name in options.scenarios:
+        if name in STANDALONE_SCENARIOS:
+            async for result in STANDALONE_SCENARIOS[name](options):
+                write(options.output, metadata, name, result)
+    service_scenarios = [
+        name for name in options.scenarios if name in SERVICE_SCENARIOS
+    ]
+    if not service_scenarios:
+        return
+    config.METRIPORT_WEBHOOK_AUTH_KEY = config.METRIPORT_WEBHOOK_AUTH_KEY or "bench"
+    async with StandIns(options.upstream_latency) as stand_ins:
+        concurrency = max([options.concurrency, *options.concurrency_levels])
+        async with running_service(concurrency, stand_ins) as service:
+            for name in service_scenarios:
+                logging.info("Running %s benchmarks", name)
+                async for result in SERVICE_SCENARIOS[name](service, options):
+                    write(options.output, metadata, name, result)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(parse_options(sys.argv[1:])))
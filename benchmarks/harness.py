@@ -0,0 +1,247 @@
+import asyncio
+import contextlib
+import datetime
+import gc
+import resource
+import statistics
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+
+import jwt
+from aiohttp import ClientSession, TCPConnector, web
+from aiohttp.test_utils import TestServer
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from benchmarks.stubs import StandIns
+from fhir_datasequence import config
+from fhir_datasequence.db import (
+    RECORDS_TABLE_NAME,
+    RECORDS_UNIQUE_CONSTRAINT,
+    copy_insert,
+    with_rollups,
+)
+from fhir_datasequence.main import application
+from fhir_datasequence.metriport import METRIPORT_RECORDS_TABLE_NAME
+from fhir_datasequence.metriport.db import read_webhook_queue_stats
+
+# NOTE: benchmark users are derived from stable ids to reuse seeded data
+BENCHMARK_NAMESPACE = uuid.UUID("4f0c0a8e-30a5-4b8e-9f59-0e4bdbd1d3f7")
+SEED_BATCH_SIZE = 50000
+EPOCH_END = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+
+def percentile(samples: list[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def latency_summary(samples: list[float]):
+    return {
+        "mean": statistics.fmean(samples),
+        "p50": percentile(samples, 0.5),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+        "max": max(samples),
+    }
+
+
+async def measure(
+    call: Callable[[], Awaitable[object]], requests: int, concurrency: int
+):
+    """Run `requests` calls with at most `concurrency` of them in flight"""
+    samples: list[float] = []
+    pending = iter(range(requests))
+
+    async def worker():
+        for _ in pending:
+            started = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": requests / elapsed,
+        "latency": latency_summary(samples),
+    }
+
+
+def current_rss() -> int:
+    """Resident set size of the process, the service runs in it as well"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # NOTE: without procfs only the lifetime peak (kB on Linux) is known
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@asynccontextmanager
+async def tracking_rss(interval: float = 0.005) -> AsyncIterator[dict[str, int]]:
+    """Sample the RSS while the block runs, `peak` is final on exit"""
+    gc.collect()
+    usage = {"baseline": current_rss(), "peak": 0}
+
+    async def sample():
+        while True:
+            usage["peak"] = max(usage["peak"], current_rss())
+            await asyncio.sleep(interval)
+
+    sampler = asyncio.create_task(sample())
+    try:
+        yield usage
+    finally:
+        sampler.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await sampler
+        usage["peak"] = max(usage["peak"], current_rss())
+
+
+def service_token(uid: str) -> str:
+    return jwt.encode(
+        {
+            "aud": [
+                config.APPLE_OPENID_AUD_MOBILE_CLIENT_ID,
+                config.APPLE_OPENID_AUD_WEB_CLIENT_ID,
+            ],
+            "iss": config.DATA_SEQUENCE_OPENID_ISS_SERVICE,
+            "sub": uid,
+        },
+        config.JWT_TOKEN_ENCODE_SECRET,
+        algorithm="HS256",
+    )
+
+
+def patient_id(name: str) -> str:
+    return str(uuid.uuid5(BENCHMARK_NAMESPACE, name))
+
+
+def synthetic_records(count: int, offset: int = 0, uid: str | None = None):
+    """Records one minute apart going back from EPOCH_END"""
+    records = []
+    for index in range(offset, offset + count):
+        ts = EPOCH_END - datetime.timedelta(minutes=index + 1)
+        record = {
+            "sid": f"bench-{index}",
+            "ts": ts,
+            "code": ("walking", "running", "cycling")[index % 3],
+            "duration": 30 + index % 600,
+            "energy": 5 + index % 300,
+            "start": ts - datetime.timedelta(seconds=30 + index % 600),
+            "finish": ts,
+        }
+        if uid is not None:
+            record["uid"] = uid
+        records.append(record)
+    return records
+
+
+def as_payload(records: list[dict]):
+    return {
+        "records": [
+            {
+                name: value.isoformat()
+                if isinstance(value, datetime.datetime)
+                else value
+                for name, value in record.items()
+            }
+            for record in records
+        ]
+    }
+
+
+@asynccontextmanager
+async def running_service(
+    concurrency: int, stand_ins: StandIns
+) -> AsyncIterator["Service"]:
+    app = await application()
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        async with ClientSession(
+            str(server.make_url("")), connector=TCPConnector(limit=concurrency)
+        ) as session:
+            yield Service(app, session, stand_ins)
+    finally:
+        await server.close()
+
+
+class Service:
+    """Running application with a client session and direct database access"""
+
+    def __init__(
+        self: "Service",
+        app: web.Application,
+        session: ClientSession,
+        stand_ins: StandIns,
+    ) -> None:
+        self.app = app
+        self.session = session
+        self.stand_ins = stand_ins
+
+    @property
+    def engine(self: "Service") -> AsyncEngine:
+        return self.app["dbapi_engine"]
+
+    async def count_records(self: "Service", uid: str) -> int:
+        table = self.app["dbapi_schema"][RECORDS_TABLE_NAME]
+        async with self.engine.connect() as connection:
+            count = await connection.scalar(
+                select(func.count()).select_from(table).where(table.c.uid == uid)
+            )
+        return count or 0
+
+    async def seed_records(self: "Service", uid: str, count: int) -> bool:
+        """Seed `count` records for the user unless they are already there"""
+        if await self.count_records(uid) == count:
+            return False
+        await self.delete_records(RECORDS_TABLE_NAME, uid)
+        table = self.app["dbapi_schema"][RECORDS_TABLE_NAME]
+        for offset in range(0, count, SEED_BATCH_SIZE):
+            batch = synthetic_records(
+                min(SEED_BATCH_SIZE, count - offset), offset=offset, uid=uid
+            )
+            async with self.engine.begin() as connection:
+                await copy_insert(connection, table, batch, RECORDS_UNIQUE_CONSTRAINT)
+        await self.refresh_rollups(RECORDS_TABLE_NAME)
+        return True
+
+    async def refresh_rollups(self: "Service", table_name: str):
+        async with self.engine.connect() as connection:
+            connection = await connection.execution_options(
+                isolation_level="AUTOCOMMIT"
+            )
+            for rollup in with_rollups(table_name)[1:]:
+                await connection.execute(
+                    text(f"CALL refresh_continuous_aggregate('{rollup}', NULL, NULL)")
+                )
+
+    async def delete_records(self: "Service", table_name: str, uid: str):
+        table = self.app["dbapi_schema"][table_name]
+        async with self.engine.begin() as connection:
+            await connection.execute(delete(table).where(table.c.uid == uid))
+
+    async def delete_metriport_records(self: "Service", uid_prefix: str):
+        table = self.app["dbapi_schema"][METRIPORT_RECORDS_TABLE_NAME]
+        async with self.engine.begin() as connection:
+            await connection.execute(
+                delete(table).where(table.c.uid.startswith(uid_prefix))
+            )
+
+    async def wait_for_queue(self: "Service", timeout: float = 600) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = await read_webhook_queue_stats(
+                self.engine, self.app["dbapi_schema"]
+            )
+            if not stats["depth"]:
+                return
+            await asyncio.sleep(0.05)
+        raise TimeoutError("Metriport webhook queue has not been drained")
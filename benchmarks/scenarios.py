@@ -0,0 +1,516 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import functools
+import json
+import sys
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import AbstractAsyncContextManager
+from unittest import mock
+
+import orjson
+from aiohttp import ClientResponse, web
+from fhirpy import AsyncFHIRClient
+from marshmallow import Schema
+
+from benchmarks.harness import (
+    EPOCH_END,
+    Service,
+    as_payload,
+    measure,
+    patient_id,
+    service_token,
+    synthetic_records,
+    tracking_rss,
+)
+from benchmarks.stubs import datasequence_uid
+from fhir_datasequence import config
+from fhir_datasequence.api.codec import dumps
+from fhir_datasequence.api.health_records import RecordsListSchema
+from fhir_datasequence.auth import (
+    create_token_cache,
+    verify_cached_token,
+    verify_user_id_token,
+)
+from fhir_datasequence.db import RECORDS_TABLE_NAME
+from fhir_datasequence.metriport.client import WEBHOOK_KEY_HEADER
+
+Results = AsyncIterator[dict]
+
+
+async def expect_ok(request: AbstractAsyncContextManager[ClientResponse]) -> bytes:
+    async with request as response:
+        body = await response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Unexpected response {response.status}: {body!r}")
+        return body
+
+
+def read_user(size: int) -> tuple[str, str]:
+    patient = patient_id(f"read-{size}")
+    return patient, datasequence_uid(patient)
+
+
+async def ingest(service: Service, options: argparse.Namespace) -> Results:
+    """POST /api/v1/records throughput per batch size and insert path
+
+    Every batch size is written with executemany and with the binary COPY,
+    forced through RECORDS_BULK_INGEST_THRESHOLD.
+    """
+    for batch_size in options.batch_sizes:
+        for insert_path, threshold in (("executemany", sys.maxsize), ("copy", 0)):
+            uid = datasequence_uid(patient_id(f"ingest-{batch_size}"))
+            await service.delete_records(RECORDS_TABLE_NAME, uid)
+            requests = max(options.requests // max(batch_size // 100, 1), 5)
+            bodies = iter(
+                [
+                    orjson.dumps(
+                        as_payload(synthetic_records(batch_size, offset=offset))
+                    )
+                    for offset in range(0, batch_size * requests, batch_size)
+                ]
+            )
+            headers = {
+                "Authorization": f"Bearer {service_token(uid)}",
+                "Content-Type": "application/json",
+            }
+
+            async def call(bodies: Iterator[bytes] = bodies, headers: dict = headers):
+                return await expect_ok(
+                    service.session.post(
+                        "/api/v1/records", data=next(bodies), headers=headers
+                    )
+                )
+
+            with mock.patch.object(config, "RECORDS_BULK_INGEST_THRESHOLD", threshold):
+                result = await measure(call, requests, options.concurrency)
+            yield {
+                "case": "write",
+                "params": {"batch_size": batch_size, "insert_path": insert_path},
+                "records_per_second": result["throughput"] * batch_size,
+                **result,
+            }
+            await service.delete_records(RECORDS_TABLE_NAME, uid)
+
+
+async def read(service: Service, options: argparse.Namespace) -> Results:
+    """Page, range, aggregate and stream reads per user size"""
+    for size in options.read_sizes:
+        _patient, uid = read_user(size)
+        await service.seed_records(uid, size)
+        headers = {"Authorization": f"Bearer {service_token(uid)}"}
+        span_start = EPOCH_END - datetime.timedelta(minutes=size)
+        day_start = EPOCH_END - datetime.timedelta(days=1)
+        cases: dict[str, tuple[str, dict]] = {
+            "first_page": ("/api/v1/records", {"limit": 100}),
+            "last_day": (
+                "/api/v1/records",
+                {
+                    "start": day_start.isoformat(),
+                    "limit": config.RECORDS_PAGE_MAX_LIMIT,
+                },
+            ),
+            "aggregate_rollup": (
+                "/api/v1/records/aggregate",
+                {
+                    "bucket": "day",
+                    "start": span_start.replace(hour=0, minute=0).isoformat(),
+                    "end": EPOCH_END.isoformat(),
+                },
+            ),
+            "aggregate_raw": (
+                "/api/v1/records/aggregate",
+                {
+                    "bucket": "day",
+                    "start": (span_start + datetime.timedelta(minutes=1)).isoformat(),
+                    "end": EPOCH_END.isoformat(),
+                },
+            ),
+        }
+        for case, (path, params) in cases.items():
+
+            async def call(
+                path: str = path, params: dict = params, headers: dict = headers
+            ):
+                return await expect_ok(
+                    service.session.get(path, params=params, headers=headers)
+                )
+
+            yield {
+                "case": case,
+                "params": {"rows": size},
+                **await measure(call, options.requests, options.concurrency),
+            }
+        # NOTE: the JSON page against the stream of the same user, the page is
+        # capped by RECORDS_PAGE_MAX_LIMIT
+        page_rows = min(size, config.RECORDS_PAGE_MAX_LIMIT)
+        yield {
+            "case": "page",
+            "params": {"rows": size, "returned": page_rows},
+            **await measure_stream(
+                service, "/api/v1/records", {"limit": page_rows}, headers, page_rows
+            ),
+        }
+        if size <= options.max_stream_rows:
+            yield {
+                "case": "stream",
+                "params": {"rows": size, "returned": size},
+                **await measure_stream(
+                    service, "/api/v1/records", {"stream": "true"}, headers, size
+                ),
+            }
+
+
+async def measure_stream(
+    service: Service, path: str, params: dict, headers: dict, size: int
+):
+    """Time to first byte, throughput and peak RSS of a single response"""
+    async with tracking_rss() as rss:
+        started = time.perf_counter()
+        first_byte = None
+        received = 0
+        async with service.session.get(
+            path, params=params, headers=headers
+        ) as response:
+            if response.status != 200:
+                raise RuntimeError(f"Unexpected response {response.status}")
+            async for chunk in response.content.iter_any():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                received += len(chunk)
+        elapsed = time.perf_counter() - started
+    return {
+        "elapsed": elapsed,
+        "time_to_first_byte": first_byte,
+        "bytes": received,
+        "records_per_second": size / elapsed,
+        "peak_rss_bytes": rss["peak"],
+        "rss_growth_bytes": rss["peak"] - rss["baseline"],
+    }
+
+
+def unpooled_fhir_client(_app: web.Application, authorization: str):
+    # NOTE: plain fhirpy opens a session, and so connections, for every request
+    return AsyncFHIRClient(config.EMR_FHIR_URL, authorization=authorization)
+
+
+async def shared_read(service: Service, options: argparse.Namespace) -> Results:
+    """Consent guarded reads with warm and cold consent caches
+
+    Cold cache reads are measured with the pooled EMR FHIR session and with
+    a plain fhirpy client as the baseline.
+    """
+    size = min(options.read_sizes)
+    patient, uid = read_user(size)
+    await service.seed_records(uid, size)
+    path = f"/api/v1/{patient}/records"
+    for case, authorization, pooled in (
+        ("consent_cached", lambda: "Bearer bench-practitioner", True),
+        ("consent_uncached", lambda: f"Bearer {uuid.uuid4().hex}", True),
+        ("consent_uncached_unpooled", lambda: f"Bearer {uuid.uuid4().hex}", False),
+    ):
+
+        async def call(authorization: Callable[[], str] = authorization):
+            return await expect_ok(
+                service.session.get(
+                    path,
+                    params={"limit": 100},
+                    headers={"Authorization": authorization()},
+                )
+            )
+
+        with contextlib.ExitStack() as stack:
+            if not pooled:
+                stack.enter_context(
+                    mock.patch(
+                        "fhir_datasequence.auth.fhir.fhir_client", unpooled_fhir_client
+                    )
+                )
+            result = await measure(call, options.requests, options.concurrency)
+        yield {
+            "case": case,
+            "params": {
+                "rows": size,
+                "pooled": pooled,
+                "upstream_latency": options.upstream_latency,
+            },
+            **result,
+        }
+
+
+async def export(service: Service, options: argparse.Namespace) -> Results:
+    """Full history export as Arrow and Parquet against the JSON stream"""
+    # NOTE: compare encoded sizes without the gzip applied to the JSON stream
+    headers = {
+        "Authorization": "Bearer bench-practitioner",
+        "Accept-Encoding": "identity",
+    }
+    for size in options.read_sizes:
+        if size > options.max_stream_rows:
+            continue
+        patient, uid = read_user(size)
+        await service.seed_records(uid, size)
+        for case, path, params in (
+            ("json", f"/api/v1/{patient}/records", {"stream": "true"}),
+            ("arrow", f"/api/v1/{patient}/records/export", {"format": "arrow"}),
+            ("parquet", f"/api/v1/{patient}/records/export", {"format": "parquet"}),
+        ):
+            yield {
+                "case": case,
+                "params": {"rows": size},
+                **await measure_stream(service, path, params, headers, size),
+            }
+
+
+async def panel(service: Service, options: argparse.Namespace) -> Results:
+    """Practitioner panel read, one request per patient against a batch read"""
+    size = min(options.read_sizes)
+    patients = [patient_id(f"panel-{index}") for index in range(options.panel_size)]
+    for patient in patients:
+        await service.seed_records(datasequence_uid(patient), size)
+    params = {
+        "start": (EPOCH_END - datetime.timedelta(days=1)).isoformat(),
+        "end": EPOCH_END.isoformat(),
+        "limit": 100,
+    }
+
+    async def per_patient(authorization: str):
+        await asyncio.gather(
+            *(
+                expect_ok(
+                    service.session.get(
+                        f"/api/v1/{patient}/records",
+                        params=params,
+                        headers={"Authorization": authorization},
+                    )
+                )
+                for patient in patients
+            )
+        )
+
+    async def batch(authorization: str):
+        await expect_ok(
+            service.session.get(
+                "/api/v1/records/shared",
+                params=[*params.items(), *(("patient", item) for item in patients)],
+                headers={"Authorization": authorization},
+            )
+        )
+
+    for case, read_panel in (("per_patient", per_patient), ("batch", batch)):
+
+        async def call(read_panel: Callable[[str], Awaitable[None]] = read_panel):
+            # NOTE: a fresh token per panel keeps the consent cache cold
+            await read_panel(f"Bearer {uuid.uuid4().hex}")
+
+        result = await measure(call, max(options.requests // options.panel_size, 5), 1)
+        yield {
+            "case": case,
+            "params": {
+                "patients": options.panel_size,
+                "rows": size,
+                "upstream_latency": options.upstream_latency,
+            },
+            **result,
+        }
+
+
+async def connect_token(service: Service, options: argparse.Namespace) -> Results:
+    """Connect token latency and the Metriport calls left after coalescing"""
+    for case in ("same_user", "distinct_users"):
+        run = uuid.uuid4().hex
+        users = iter(range(options.requests))
+
+        async def call(case: str = case, run: str = run, users: Iterator = users):
+            user = f"{run}-{next(users) if case == 'distinct_users' else 0}"
+            return await expect_ok(
+                service.session.get(
+                    "/metriport/connect-token",
+                    headers={"Authorization": f"Bearer {service_token(user)}"},
+                )
+            )
+
+        before = service.stand_ins.metriport_calls()
+        result = await measure(call, options.requests, options.concurrency)
+        after = service.stand_ins.metriport_calls()
+        yield {
+            "case": case,
+            "params": {"upstream_latency": options.upstream_latency},
+            "upstream_calls": {
+                name: count - before.get(name, 0) for name, count in after.items()
+            },
+            **result,
+        }
+
+
+def activity_payload(users: int, activities: int, round_index: int):
+    started = EPOCH_END - datetime.timedelta(days=round_index + 1)
+    return {
+        "users": [
+            {
+                "userId": f"bench-webhook-{user}",
+                "activity": [
+                    {
+                        "activity_logs": [
+                            {
+                                "name": "walking",
+                                "start_time": (
+                                    started + datetime.timedelta(minutes=activity)
+                                ).strftime("%Y-%m-%dT%H:%M:%S.%f%z"),
+                                "durations": {"active_seconds": 60},
+                                "energy_expenditure": {"active_kcal": 10},
+                                "metadata": {"source": "bench"},
+                            }
+                            for activity in range(activities)
+                        ]
+                    }
+                ],
+            }
+            for user in range(users)
+        ]
+    }
+
+
+async def webhook(service: Service, options: argparse.Namespace) -> Results:
+    """Time from a Metriport webhook delivery until its job is processed"""
+    headers = {WEBHOOK_KEY_HEADER: config.METRIPORT_WEBHOOK_AUTH_KEY or ""}
+    await service.delete_metriport_records("bench-webhook-")
+    for users, activities in options.webhook_shapes:
+        samples = []
+        for round_index in range(options.webhook_rounds):
+            payload = activity_payload(users, activities, round_index)
+            started = time.perf_counter()
+            await expect_ok(
+                service.session.post(
+                    "/metriport/webhook", json=payload, headers=headers
+                )
+            )
+            acknowledged = time.perf_counter() - started
+            await service.wait_for_queue()
+            samples.append((acknowledged, time.perf_counter() - started))
+        processed = sum(total for _ack, total in samples) / len(samples)
+        yield {
+            "case": "activity",
+            "params": {"users": users, "activities_per_user": activities},
+            "rounds": len(samples),
+            "acknowledged": sum(ack for ack, _total in samples) / len(samples),
+            "processed": processed,
+            "records_per_second": users * activities / processed,
+        }
+    await service.delete_metriport_records("bench-webhook-")
+
+
+async def concurrency(service: Service, options: argparse.Namespace) -> Results:
+    """Page read throughput at growing client concurrency against one pool"""
+    size = min(options.read_sizes)
+    _patient, uid = read_user(size)
+    await service.seed_records(uid, size)
+    headers = {"Authorization": f"Bearer {service_token(uid)}"}
+    for level in options.concurrency_levels:
+        result = await measure(
+            lambda: expect_ok(
+                service.session.get(
+                    "/api/v1/records", params={"limit": 100}, headers=headers
+                )
+            ),
+            max(options.requests, level * 10),
+            level,
+        )
+        yield {
+            "case": "first_page",
+            "params": {
+                "rows": size,
+                "pool_size": config.DBAPI_POOL_SIZE,
+                "max_overflow": config.DBAPI_MAX_OVERFLOW,
+                "pgbouncer": config.DBAPI_PGBOUNCER,
+            },
+            **result,
+        }
+
+
+async def schema(service: Service, options: argparse.Namespace) -> Results:
+    """Reflection cost saved by the schema registry on every request"""
+    registry = service.app["dbapi_schema"]
+    for case, revision in (("reflect", None), ("unchanged", registry.revision)):
+        samples = []
+        for _ in range(options.requests):
+            registry.revision = revision
+            started = time.perf_counter()
+            await registry.refresh(service.engine)
+            samples.append(time.perf_counter() - started)
+        yield {"case": case, "params": {}, "mean": sum(samples) / len(samples)}
+
+
+def dumps_with_json(data: dict) -> str:
+    return json.dumps(as_payload(data["records"]))
+
+
+def timed(call: Callable[[], object], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call()
+    return (time.perf_counter() - started) / repeat
+
+
+async def codec(options: argparse.Namespace) -> Results:
+    """Marshmallow and json against the validation and serialization fast path"""
+    for batch_size in options.batch_sizes:
+        payload = json.loads(orjson.dumps(as_payload(synthetic_records(batch_size))))
+        schema = RecordsListSchema()
+        repeat = max(10000 // batch_size, 3)
+        loaded = schema.load(payload)
+        for case, call in (
+            ("load_marshmallow", functools.partial(Schema.load, schema, payload)),
+            ("load_fast_path", functools.partial(schema.load, payload)),
+            ("dump_json", functools.partial(dumps_with_json, loaded)),
+            ("dump_orjson", functools.partial(dumps, loaded)),
+        ):
+            seconds = timed(call, repeat)
+            yield {
+                "case": case,
+                "params": {"batch_size": batch_size},
+                "mean": seconds,
+                "records_per_second": batch_size / seconds,
+            }
+
+
+async def auth(options: argparse.Namespace) -> Results:
+    """Per request token verification overhead with and without the cache"""
+    token = service_token("bench-auth")
+    cache = create_token_cache()
+    await verify_cached_token(cache, token, verify_user_id_token)
+    for case, call in (
+        ("verify", lambda: verify_user_id_token(token)),
+        (
+            "verify_cached",
+            lambda: verify_cached_token(cache, token, verify_user_id_token),
+        ),
+    ):
+        started = time.perf_counter()
+        for _ in range(options.requests * 100):
+            await call()
+        yield {
+            "case": case,
+            "params": {},
+            "mean": (time.perf_counter() - started) / (options.requests * 100),
+        }
+
+
+SERVICE_SCENARIOS: dict[str, Callable[[Service, argparse.Namespace], Results]] = {
+    "ingest": ingest,
+    "read": read,
+    "shared_read": shared_read,
+    "export": export,
+    "panel": panel,
+    "webhook": webhook,
+    "connect_token": connect_token,
+    "concurrency": concurrency,
+    "schema": schema,
+}
+STANDALONE_SCENARIOS: dict[str, Callable[[argparse.Namespace], Results]] = {
+    "codec": codec,
+    "auth": auth,
+}
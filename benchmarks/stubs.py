@@ -0,0 +1,162 @@
+"""Stand-in EMR FHIR, Metriport and Apple servers
+
+The FHIR server maps every patient id to the `bench-<patient id>` data
+sequence user and grants access to any practitioner, so that consent
+guarded reads can be measured without an Aidbox instance.
+"""
+import asyncio
+import collections
+import json
+import uuid
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiohttp.typedefs import Handler
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from fhir_datasequence import config
+
+PRACTITIONER_ID = "bench-practitioner"
+
+
+def datasequence_uid(patient_id: str) -> str:
+    return f"bench-{patient_id}"
+
+
+def metriport_user_id(patient_id: str) -> str:
+    return f"bench-metriport-{patient_id}"
+
+
+def patient_resource(patient_id: str):
+    return {
+        "resourceType": "Patient",
+        "id": patient_id,
+        "identifier": [
+            {
+                "system": config.DATA_SEQUENCE_OPENID_ISS_SERVICE,
+                "value": datasequence_uid(patient_id),
+            },
+            {
+                "system": config.METRIPORT_IDENTIFIER_SYSTEM_URL,
+                "value": metriport_user_id(patient_id),
+            },
+        ],
+    }
+
+
+def bundle(*resources: dict):
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": len(resources),
+        "entry": [{"resource": resource} for resource in resources],
+    }
+
+
+def delayed(latency: float) -> list:
+    @web.middleware
+    async def delay(request: web.Request, handler: Handler):
+        await asyncio.sleep(latency)
+        return await handler(request)
+
+    return [delay] if latency else []
+
+
+def fhir_application(latency: float) -> web.Application:
+    async def userinfo(request: web.Request):
+        return web.json_response(
+            {"role": [{"links": {"practitioner": {"id": PRACTITIONER_ID}}}]}
+        )
+
+    async def read_patient(request: web.Request):
+        return web.json_response(patient_resource(request.match_info["id"]))
+
+    async def search_patients(request: web.Request):
+        if "_id" in request.query:
+            patient_ids = request.query["_id"].split(",")
+            return web.json_response(bundle(*map(patient_resource, patient_ids)))
+        _system, _separator, value = request.query["identifier"].rpartition("|")
+        return web.json_response(bundle(patient_resource(value)))
+
+    async def search_consents(request: web.Request):
+        return web.json_response(
+            bundle(
+                *(
+                    {
+                        "resourceType": "Consent",
+                        "id": str(uuid.uuid4()),
+                        "status": "active",
+                        "patient": {"reference": f"Patient/{patient_id}"},
+                        "provision": {"type": "permit"},
+                    }
+                    for patient_id in request.query["patient"].split(",")
+                )
+            )
+        )
+
+    app = web.Application(middlewares=delayed(latency))
+    app.router.add_get("/auth/userinfo", userinfo)
+    app.router.add_get("/Patient/{id}", read_patient)
+    app.router.add_get("/Patient", search_patients)
+    app.router.add_get("/Consent", search_consents)
+    return app
+
+
+def metriport_application(latency: float) -> web.Application:
+    calls: collections.Counter = collections.Counter()
+
+    async def get_user(request: web.Request):
+        calls["user"] += 1
+        return web.json_response(
+            {"userId": metriport_user_id(request.query["appUserId"])}
+        )
+
+    async def get_connect_token(request: web.Request):
+        calls["connect_token"] += 1
+        return web.json_response({"token": uuid.uuid4().hex})
+
+    app = web.Application(middlewares=delayed(latency))
+    app["calls"] = calls
+    app.router.add_post("/user", get_user)
+    app.router.add_get("/user/connect/token", get_connect_token)
+    return app
+
+
+def apple_application() -> web.Application:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update(kid="bench", use="sig", alg="RS256")
+
+    async def keys(request: web.Request):
+        return web.json_response(
+            {"keys": [jwk]}, headers={"Cache-Control": "max-age=86400"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/auth/keys", keys)
+    return app
+
+
+class StandIns:
+    """Run the stand-in servers and point the service config to them"""
+
+    def __init__(self: "StandIns", latency: float) -> None:
+        self.fhir = TestServer(fhir_application(latency))
+        self.metriport = TestServer(metriport_application(latency))
+        self.apple = TestServer(apple_application())
+
+    async def __aenter__(self: "StandIns") -> "StandIns":
+        for server in (self.fhir, self.metriport, self.apple):
+            await server.start_server()
+        config.EMR_FHIR_URL = str(self.fhir.make_url("")).rstrip("/")
+        config.METRIPORT_API_BASE_URL = str(self.metriport.make_url(""))
+        config.APPLE_JWKS_API = str(self.apple.make_url("/auth/keys"))
+        return self
+
+    def metriport_calls(self: "StandIns") -> dict[str, int]:
+        return dict(self.metriport.app["calls"])
+
+    async def __aexit__(self: "StandIns", *exc_info: object) -> None:
+        for server in (self.fhir, self.metriport, self.apple):
+            await server.close()
@@ -0,0 +1,85 @@
+"""Fast path for decoding and encoding health records
+
+Decoding covers the canonical shape of `RecordsListSchema` payloads only and
+returns None for anything else, so that marshmallow stays the reference
+implementation and the source of validation errors.
+"""
+import datetime
+import re
+from collections.abc import Mapping
+
+import orjson
+from aiohttp import web
+
+from fhir_datasequence.metrics import stage
+
+ISO_DATETIME = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?(?:Z|[+-]\d{2}:\d{2})?"
+)
+
+RECORD_STR_FIELDS = ("sid", "code")
+RECORD_INT_FIELDS = ("duration", "energy")
+RECORD_DATETIME_FIELDS = ("ts", "start", "finish")
+RECORD_REQUIRED_FIELDS = frozenset(("sid", "ts", "code", "start", "finish"))
+RECORD_FIELDS = frozenset(
+    RECORD_STR_FIELDS + RECORD_INT_FIELDS + RECORD_DATETIME_FIELDS
+)
+
+
+def parse_datetimes(values: list) -> list[datetime.datetime] | None:
+    if not all(
+        isinstance(value, str) and ISO_DATETIME.fullmatch(value) for value in values
+    ):
+        return None
+    try:
+        return list(map(datetime.datetime.fromisoformat, values))
+    except ValueError:
+        return None
+
+
+def load_records(data: Mapping) -> dict | None:
+    records = data.get("records")
+    if not isinstance(records, list) or not records:
+        return None
+    for record in records:
+        if not isinstance(record, dict):
+            return None
+        keys = record.keys()
+        if not RECORD_REQUIRED_FIELDS <= keys or not keys <= RECORD_FIELDS:
+            return None
+        for name in RECORD_STR_FIELDS:
+            if not isinstance(record[name], str):
+                return None
+        for name in RECORD_INT_FIELDS:
+            # NOTE: bool is an int subclass, but marshmallow rejects it as a
+            # strict Integer, so it falls back to marshmallow and its error
+            if name in record and (
+                not isinstance(record[name], int) or isinstance(record[name], bool)
+            ):
+                return None
+    loaded = [dict(record) for record in records]
+    for name in RECORD_DATETIME_FIELDS:
+        parsed = parse_datetimes([record[name] for record in records])
+        if parsed is None:
+            return None
+        for record, value in zip(loaded, parsed, strict=True):
+            record[name] = value
+    return {"records": loaded}
+
+
+def dumps(data: object) -> bytes:
+    return orjson.dumps(data)
+
+
+def dumps_lines(rows: list) -> bytes:
+    return b"".join(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+
+def json_response(
+    data: object, status: int = 200, headers: dict[str, str] | None = None
+) -> web.Response:
+    with stage("serialization").time():
+        body = dumps(data)
+    return web.Response(
+        body=body, status=status, headers=headers, content_type="application/json"
+    )
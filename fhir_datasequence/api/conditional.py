@@ -0,0 +1,105 @@
+"""Conditional and compressed responses of the record listings
+
+Validators are derived from the watermark row of the user, which the writers
+update in the same transaction as the records. Reading it is a single primary
+key lookup, so that polling clients get 304 without any rows being read,
+decompressed or serialized. A transaction committing late changes them once
+its records become visible, whatever their `ts`.
+"""
+import datetime
+import email.utils
+import hashlib
+from collections.abc import Callable
+
+from aiohttp import hdrs, web
+from sqlalchemy import Row, Table, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from fhir_datasequence import config
+from fhir_datasequence.api.codec import json_response
+from fhir_datasequence.api.query import fetch_records_page, select_records
+from fhir_datasequence.api.streaming import stream_records, wants_stream
+from fhir_datasequence.db import RECORDS_WATERMARKS_TABLE_NAME
+
+
+async def read_watermark(
+    connection: AsyncConnection, watermarks: Table, table_name: str, uid: str
+) -> tuple[int | None, datetime.datetime | None]:
+    """Version and modification time of the user records, if ever written"""
+    row = (
+        await connection.execute(
+            select(watermarks.c.version, watermarks.c.modified_at).where(
+                watermarks.c.table_name == table_name, watermarks.c.uid == uid
+            )
+        )
+    ).first()
+    return (row.version, row.modified_at) if row else (None, None)
+
+
+def entity_tag(request: web.Request, version: int | None) -> str:
+    # NOTE: the representation depends on the query and the negotiated format
+    fingerprint = "|".join(
+        [
+            str(version or ""),
+            "ndjson" if wants_stream(request) else "json",
+            *sorted(f"{key}={value}" for key, value in request.query.items()),
+        ]
+    )
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+
+
+def validator_headers(
+    etag: str, last_modified: datetime.datetime | None
+) -> dict[str, str]:
+    headers: dict[str, str] = {
+        hdrs.CACHE_CONTROL: "private, no-cache",
+        hdrs.VARY: "Accept, Accept-Encoding, Authorization",
+        hdrs.ETAG: f'W/"{etag}"',
+    }
+    if last_modified is not None:
+        # NOTE: Last-Modified can not be later than the response itself
+        last_modified = min(last_modified, datetime.datetime.now(datetime.UTC))
+        headers[hdrs.LAST_MODIFIED] = email.utils.format_datetime(
+            last_modified.astimezone(datetime.UTC), usegmt=True
+        )
+    return headers
+
+
+def is_not_modified(
+    request: web.Request, etag: str, last_modified: datetime.datetime | None
+) -> bool:
+    if request.if_none_match is not None:
+        # NOTE: If-None-Match uses the weak comparison
+        return any(tag.value in (etag, "*") for tag in request.if_none_match)
+    if request.if_modified_since is not None and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+async def respond_with_records(
+    request: web.Request,
+    engine: AsyncEngine,
+    table: Table,
+    uid: str,
+    parse_row: Callable[[Row], dict],
+) -> web.StreamResponse:
+    """Respond with a page or a stream of user records unless not modified"""
+    query = request["querystring"]
+    statement = select_records(table, uid, query)
+    watermarks = request.app["dbapi_schema"][RECORDS_WATERMARKS_TABLE_NAME]
+    async with engine.begin() as connection:
+        # NOTE: records are read after the watermark, so they are never older
+        version, last_modified = await read_watermark(
+            connection, watermarks, table.name, uid
+        )
+        etag = entity_tag(request, version)
+        headers = validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return web.Response(status=304, headers=headers)
+        if not wants_stream(request):
+            page = await fetch_records_page(connection, statement, query, parse_row)
+            response = json_response(page, headers=headers)
+            if (response.content_length or 0) >= config.RESPONSE_COMPRESSION_MIN_SIZE:
+                response.enable_compression()
+            return response
+    return await stream_records(request, engine, statement, parse_row, headers)
@@ -1,12 +1,44 @@
+from collections.abc import Iterable, Mapping, Sequence
+from collections.abc import Set as AbstractSet
+
 from aiohttp import web
-from aiohttp_apispec import docs, json_schema, response_schema  # type: ignore
+from aiohttp_apispec import (  # type: ignore
+    docs,
+    json_schema,
+    querystring_schema,
+    response_schema,
+)
 from marshmallow import Schema, fields, validate
-from sqlalchemy import Table, select
+from sqlalchemy import Row
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncEngine
 
+from fhir_datasequence import config
+from fhir_datasequence.api.codec import json_response, load_records
+from fhir_datasequence.api.conditional import respond_with_records
+from fhir_datasequence.api.export import ExportQuerySchema, export_records
+from fhir_datasequence.api.query import (
+    AggregateQuerySchema,
+    ChangesQuerySchema,
+    PatientsRecordsQuerySchema,
+    RecordsQuerySchema,
+    fetch_aggregates,
+    fetch_changes,
+    fetch_users_records,
+    select_aggregates,
+    select_changes,
+    select_users_records,
+)
 from fhir_datasequence.auth import UserInfo, openid_userinfo
-from fhir_datasequence.auth.fhir import requires_consent
+from fhir_datasequence.auth.fhir import requires_consent, requires_patients_consent
+from fhir_datasequence.db import (
+    RECORDS_TABLE_NAME,
+    RECORDS_UNIQUE_CONSTRAINT,
+    RECORDS_WATERMARKS_TABLE_NAME,
+    copy_insert,
+    touch_watermarks,
+)
+from fhir_datasequence.metrics import RECORDS_INGESTED
 
 
 class RecordSchema(Schema):
@@ -24,9 +56,96 @@ class RecordsListSchema(Schema):
         fields.Nested(RecordSchema), required=True, validate=validate.Length(min=1)
     )
 
+    def load(
+        self: "RecordsListSchema",
+        data: Mapping | Iterable[Mapping],
+        *,
+        many: bool | None = None,
+        partial: bool | Sequence[str] | AbstractSet[str] | None = None,
+        unknown: str | None = None,
+    ):
+        """Decode canonical payloads without marshmallow
+
+        The request parser loads the body without options; any option asks for
+        marshmallow semantics and is handled by marshmallow only.
+        """
+        without_options = many is None and partial is None and unknown is None
+        if without_options and isinstance(data, Mapping):
+            loaded = load_records(data)
+            if loaded is not None:
+                return loaded
+        return super().load(data, many=many, partial=partial, unknown=unknown)
+
+
+class RecordsPageSchema(Schema):
+    records = fields.List(fields.Nested(RecordSchema), required=True)
+    next = fields.Str(
+        allow_none=True,
+        description="Cursor of the next page, null when the last page is reached",
+    )
+
+
+class ChangesSchema(Schema):
+    records = fields.List(fields.Nested(RecordSchema), required=True)
+    next = fields.Str(
+        allow_none=True,
+        description="Sync token of the next request, null when there are no records",
+    )
+    more = fields.Boolean(
+        required=True, description="Whether more changes are ready to be fetched"
+    )
+
+
+class AggregateSchema(Schema):
+    bucket = fields.DateTime(format="iso", required=True)
+    code = fields.Str(required=True)
+    count = fields.Integer(required=True)
+    duration_sum = fields.Integer(allow_none=True)
+    duration_avg = fields.Float(allow_none=True)
+    energy_sum = fields.Integer(allow_none=True)
+    energy_avg = fields.Float(allow_none=True)
+    start = fields.DateTime(format="iso", allow_none=True)
+    finish = fields.DateTime(format="iso", allow_none=True)
+
+
+class AggregatesListSchema(Schema):
+    buckets = fields.List(fields.Nested(AggregateSchema), required=True)
+
+
+class PatientRecordsSchema(Schema):
+    patient = fields.Str(required=True)
+    records = fields.List(fields.Nested(RecordSchema), required=True)
+    more = fields.Boolean(
+        required=True, description="Whether records beyond the limit were left out"
+    )
+
+
+class PatientsRecordsSchema(Schema):
+    patients = fields.List(fields.Nested(PatientRecordsSchema), required=True)
+    denied = fields.List(
+        fields.Str(),
+        required=True,
+        description="Patients whose records are not accessible",
+    )
+
 
 class SuccessResponseSchema(Schema):
     status = fields.Constant("OK")
+    inserted = fields.Integer(description="Number of persisted records")
+    duplicates = fields.Integer(description="Number of already existing records")
+
+
+def parse_row(row: Row):
+    return {
+        "uid": row.uid,
+        "sid": row.sid,
+        "ts": row.ts,
+        "code": row.code,
+        "duration": row.duration,
+        "energy": row.energy,
+        "start": row.start,
+        "finish": row.finish,
+    }
 
 
 @docs(summary="Ingest time series data")
@@ -39,102 +158,204 @@ class SuccessResponseSchema(Schema):
 @openid_userinfo(required=False)
 async def write_health_records(request: web.Request, userinfo: UserInfo | None):
     engine: AsyncEngine = request.app["dbapi_engine"]
+    records_table = request.app["dbapi_schema"][RECORDS_TABLE_NAME]
+    records = [
+        {
+            "uid": userinfo.id if userinfo else None,
+            "sid": record["sid"],
+            "ts": record["ts"],
+            "code": record["code"],
+            "duration": record.get("duration"),
+            "energy": record.get("energy"),
+            "start": record.get("start"),
+            "finish": record.get("finish"),
+        }
+        for record in request["json"]["records"]
+    ]
     async with engine.begin() as connection:
-        records_table = await connection.run_sync(
-            lambda conn: Table(
-                "records",
-                request.app["dbapi_metadata"],
-                autoload_with=conn,
+        if len(records) >= config.RECORDS_BULK_INGEST_THRESHOLD:
+            inserted = await copy_insert(
+                connection, records_table, records, RECORDS_UNIQUE_CONSTRAINT
             )
+        else:
+            result = await connection.execute(
+                insert(records_table)
+                .on_conflict_do_nothing(RECORDS_UNIQUE_CONSTRAINT)
+                .returning(records_table.c.ts),
+                records,
+            )
+            inserted = len(result.all())
+        if inserted:
+            await touch_watermarks(
+                connection,
+                request.app["dbapi_schema"][RECORDS_WATERMARKS_TABLE_NAME],
+                RECORDS_TABLE_NAME,
+                [userinfo.id if userinfo else None],
+            )
+    RECORDS_INGESTED.labels(RECORDS_TABLE_NAME).inc(inserted)
+    return json_response(
+        {"status": "OK", "inserted": inserted, "duplicates": len(records) - inserted}
+    )
+
+
+@docs(summary="Access time series data for a given openid user")
+@querystring_schema(RecordsQuerySchema())
+@response_schema(
+    RecordsPageSchema(),
+    code=200,
+    description="Array of records associated with a given openid user",
+)
+@openid_userinfo(required=True)
+async def read_health_records(request: web.Request, userinfo: UserInfo):
+    return await respond_with_records(
+        request,
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"][RECORDS_TABLE_NAME],
+        userinfo.id,
+        parse_row,
+    )
+
+
+@docs(summary="Access time series data shared by patient")
+@querystring_schema(RecordsQuerySchema())
+@response_schema(
+    RecordsPageSchema(),
+    code=200,
+    description="Array of records shared by patient",
+)
+@requires_consent()
+async def share_health_records(request: web.Request, userinfo: UserInfo):
+    return await respond_with_records(
+        request,
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"][RECORDS_TABLE_NAME],
+        userinfo.id,
+        parse_row,
+    )
+
+
+@docs(summary="Access time series data shared by many patients")
+@querystring_schema(PatientsRecordsQuerySchema())
+@response_schema(
+    PatientsRecordsSchema(),
+    code=200,
+    description="Records grouped by patient, omitting denied patients",
+)
+@requires_patients_consent()
+async def share_patients_health_records(
+    request: web.Request, consented: dict[str, str], denied: list[str]
+):
+    query = request["querystring"]
+    users: dict[str, dict] = {}
+    if consented:
+        engine: AsyncEngine = request.app["dbapi_engine"]
+        statement = select_users_records(
+            request.app["dbapi_schema"][RECORDS_TABLE_NAME],
+            list(set(consented.values())),
+            query,
         )
-        await connection.execute(
-            insert(records_table).on_conflict_do_nothing("workout_ts_user_uq"),
-            [
+        async with engine.begin() as connection:
+            users = await fetch_users_records(connection, statement, query, parse_row)
+    return json_response(
+        {
+            "patients": [
                 {
-                    "uid": userinfo.id if userinfo else None,
-                    "sid": record["sid"],
-                    "ts": record["ts"],
-                    "code": record["code"],
-                    "duration": record.get("duration"),
-                    "energy": record.get("energy"),
-                    "start": record.get("start"),
-                    "finish": record.get("finish"),
+                    "patient": patient_id,
+                    **users.get(userid, {"records": [], "more": False}),
                 }
-                for record in request["json"]["records"]
+                for patient_id, userid in consented.items()
             ],
+            "denied": denied,
+        }
+    )
+
+
+@docs(summary="Export time series data for a given openid user")
+@querystring_schema(ExportQuerySchema())
+@openid_userinfo(required=True)
+async def export_health_records(request: web.Request, userinfo: UserInfo):
+    return await export_records(
+        request,
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"][RECORDS_TABLE_NAME],
+        userinfo.id,
+    )
+
+
+@docs(summary="Export time series data shared by patient")
+@querystring_schema(ExportQuerySchema())
+@requires_consent()
+async def export_shared_health_records(request: web.Request, userinfo: UserInfo):
+    return await export_records(
+        request,
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"][RECORDS_TABLE_NAME],
+        userinfo.id,
+    )
+
+
+@docs(summary="Fetch time series data added since the previous sync")
+@querystring_schema(ChangesQuerySchema())
+@response_schema(
+    ChangesSchema(),
+    code=200,
+    description="Records of a given openid user past the sync token",
+)
+@openid_userinfo(required=True)
+async def sync_health_records(request: web.Request, userinfo: UserInfo):
+    engine: AsyncEngine = request.app["dbapi_engine"]
+    records_table = request.app["dbapi_schema"][RECORDS_TABLE_NAME]
+    async with engine.begin() as connection:
+        changes = await fetch_changes(
+            connection,
+            select_changes(records_table, userinfo.id, request["querystring"]),
+            request["querystring"],
+            parse_row,
         )
-    return web.json_response({"status": "OK"})
+    return json_response(changes)
 
 
-@docs(summary="Access time series data for a given openid user")
+@docs(summary="Aggregate time series data for a given openid user")
+@querystring_schema(AggregateQuerySchema())
 @response_schema(
-    RecordsListSchema(),
+    AggregatesListSchema(),
     code=200,
-    description="Array of records associated with a given openid user",
+    description="Time bucket rollups of records associated with a given openid user",
 )
 @openid_userinfo(required=True)
-async def read_health_records(request: web.Request, userinfo: UserInfo):
+async def aggregate_health_records(request: web.Request, userinfo: UserInfo):
     engine: AsyncEngine = request.app["dbapi_engine"]
     async with engine.begin() as connection:
-        records_table = await connection.run_sync(
-            lambda conn: Table(
-                "records",
-                request.app["dbapi_metadata"],
-                autoload_with=conn,
-            )
+        aggregates = await fetch_aggregates(
+            connection,
+            select_aggregates(
+                request.app["dbapi_schema"],
+                RECORDS_TABLE_NAME,
+                userinfo.id,
+                request["querystring"],
+            ),
         )
-        records = [
-            {
-                "uid": row.uid,
-                "sid": row.sid,
-                "ts": row.ts.isoformat(),
-                "code": row.code,
-                "duration": row.duration,
-                "energy": row.energy,
-                "start": row.start.isoformat(),
-                "finish": row.finish.isoformat(),
-            }
-            for row in await connection.execute(
-                select(records_table)
-                .where(records_table.c.uid == userinfo.id)
-                .order_by(records_table.c.ts.desc())
-            )
-        ]
-    return web.json_response({"records": records})
+    return json_response(aggregates)
 
 
-@docs(summary="Access time series data shared by patient")
+@docs(summary="Aggregate time series data shared by patient")
+@querystring_schema(AggregateQuerySchema())
 @response_schema(
-    RecordsListSchema(),
+    AggregatesListSchema(),
     code=200,
-    description="Array of records shared by patient",
+    description="Time bucket rollups of records shared by patient",
 )
 @requires_consent()
-async def share_health_records(request: web.Request, userinfo: UserInfo):
+async def aggregate_shared_health_records(request: web.Request, userinfo: UserInfo):
     engine: AsyncEngine = request.app["dbapi_engine"]
     async with engine.begin() as connection:
-        records_table = await connection.run_sync(
-            lambda conn: Table(
-                "records",
-                request.app["dbapi_metadata"],
-                autoload_with=conn,
-            )
+        aggregates = await fetch_aggregates(
+            connection,
+            select_aggregates(
+                request.app["dbapi_schema"],
+                RECORDS_TABLE_NAME,
+                userinfo.id,
+                request["querystring"],
+            ),
         )
-        records = [
-            {
-                "uid": row.uid,
-                "sid": row.sid,
-                "ts": row.ts.isoformat(),
-                "code": row.code,
-                "duration": row.duration,
-                "energy": row.energy,
-                "start": row.start.isoformat(),
-                "finish": row.finish.isoformat(),
-            }
-            for row in await connection.execute(
-                select(records_table)
-                .where(records_table.c.uid == userinfo.id)
-                .order_by(records_table.c.ts.desc())
-            )
-        ]
-    return web.json_response({"records": records})
+    return json_response(aggregates)
@@ -0,0 +1,44 @@
+import hmac
+import time
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy.exc import SQLAlchemyError
+
+from fhir_datasequence import config
+from fhir_datasequence.metrics import ApplicationCollector, process_registry
+from fhir_datasequence.metriport.db import read_webhook_queue_stats
+
+
+def is_authorized(request: web.Request) -> bool:
+    if not config.METRICS_AUTH_TOKEN:
+        return True
+    return hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(),
+        f"Bearer {config.METRICS_AUTH_TOKEN}".encode(),
+    )
+
+
+async def refresh_queue_stats(app: web.Application):
+    # NOTE: scrapes of every worker share the queue, one read per ttl is enough
+    collector: ApplicationCollector = app["metrics_collector"]
+    now = time.monotonic()
+    if now - collector.queue_stats_read_at < config.METRICS_QUEUE_STATS_TTL:
+        return
+    collector.queue_stats_read_at = now
+    try:
+        collector.queue_stats = await read_webhook_queue_stats(
+            app["dbapi_engine"], app["dbapi_schema"]
+        )
+    except SQLAlchemyError:
+        collector.queue_stats = None
+
+
+async def metrics_handler(request: web.Request):
+    if not is_authorized(request):
+        raise web.HTTPUnauthorized()
+    await refresh_queue_stats(request.app)
+    body = generate_latest(process_registry()) + generate_latest(
+        request.app["metrics_registry"]
+    )
+    return web.Response(body=body, headers={"Content-Type": CONTENT_TYPE_LATEST})
@@ -0,0 +1,398 @@
+import base64
+import binascii
+import datetime
+from collections.abc import Callable
+
+from marshmallow import Schema, ValidationError, fields, validate
+from sqlalchemy import (
+    ARRAY,
+    ColumnElement,
+    Row,
+    Select,
+    Table,
+    any_,
+    bindparam,
+    func,
+    literal_column,
+    select,
+    tuple_,
+)
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from fhir_datasequence import config
+from fhir_datasequence.db import ROLLUP_GRANULARITIES, SchemaRegistry, visible_xid
+
+
+class Cursor(fields.Field):
+    """Opaque keyset cursor over the `(ts, sid)` pair"""
+
+    def _deserialize(self: "Cursor", value: str, *args: object, **kwargs: object):
+        try:
+            return decode_cursor(value)
+        except ValueError as exc:
+            raise ValidationError("Invalid pagination cursor") from exc
+
+
+class SyncToken(fields.Field):
+    """Opaque keyset cursor over the `(ingested_xid, sid)` pair"""
+
+    def _deserialize(self: "SyncToken", value: str, *args: object, **kwargs: object):
+        try:
+            return decode_sync_token(value)
+        except ValueError as exc:
+            raise ValidationError("Invalid sync token") from exc
+
+
+class RecordsQuerySchema(Schema):
+    start = fields.AwareDateTime(
+        format="iso",
+        default_timezone=datetime.UTC,
+        description="Inclusive lower bound of the record timestamp",
+    )
+    end = fields.AwareDateTime(
+        format="iso",
+        default_timezone=datetime.UTC,
+        description="Exclusive upper bound of the record timestamp",
+    )
+    limit = fields.Integer(
+        validate=validate.Range(min=1, max=config.RECORDS_PAGE_MAX_LIMIT),
+        description="Maximum number of records in the page",
+    )
+    cursor = Cursor(description="Value of `next` returned with the previous page")
+    stream = fields.Boolean(
+        description="Stream all matching records as NDJSON instead of a single page",
+    )
+
+
+class SamplesQuerySchema(RecordsQuerySchema):
+    code = fields.Str(description="Sample code, e.g. heart_rate or weight")
+
+
+class ChangesQuerySchema(Schema):
+    since = SyncToken(description="Sync token returned with the previous changes")
+    limit = fields.Integer(
+        validate=validate.Range(min=1, max=config.RECORDS_PAGE_MAX_LIMIT),
+        description="Maximum number of records in the response",
+    )
+
+
+class PatientsRecordsQuerySchema(Schema):
+    patient = fields.List(
+        fields.UUID(),
+        required=True,
+        validate=validate.Length(min=1, max=config.RECORDS_BATCH_MAX_PATIENTS),
+        description="Consent patient identifiers, repeated for every patient",
+    )
+    start = fields.AwareDateTime(
+        format="iso",
+        default_timezone=datetime.UTC,
+        required=True,
+        description="Inclusive lower bound of the record timestamp",
+    )
+    end = fields.AwareDateTime(
+        format="iso",
+        default_timezone=datetime.UTC,
+        required=True,
+        description="Exclusive upper bound of the record timestamp",
+    )
+    limit = fields.Integer(
+        validate=validate.Range(min=1, max=config.RECORDS_PAGE_MAX_LIMIT),
+        description="Maximum number of records per patient",
+    )
+
+
+BUCKET_WIDTHS = {
+    "hour": "1 hour",
+    "day": "1 day",
+    "week": "1 week",
+    "month": "1 month",
+}
+
+# Smallest continuous aggregate granularity every bucket width is a multiple of
+BUCKET_GRANULARITIES = {
+    "hour": datetime.timedelta(hours=1),
+    "day": datetime.timedelta(days=1),
+    "week": datetime.timedelta(days=1),
+    "month": datetime.timedelta(days=1),
+}
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+
+
+class AggregateQuerySchema(Schema):
+    bucket = fields.Str(
+        required=True,
+        validate=validate.OneOf(BUCKET_WIDTHS),
+        description="Width of the time bucket",
+    )
+    start = fields.AwareDateTime(
+        format="iso",
+        default_timezone=datetime.UTC,
+        required=True,
+        description="Inclusive lower bound of the record timestamp",
+    )
+    end = fields.AwareDateTime(
+        format="iso",
+        default_timezone=datetime.UTC,
+        required=True,
+        description="Exclusive upper bound of the record timestamp",
+    )
+    code = fields.Str(description="Record code to aggregate")
+
+
+def encode_cursor(ts: datetime.datetime, sid: str) -> str:
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{sid}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, str]:
+    try:
+        ts, sid = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError(cursor) from exc
+    return datetime.datetime.fromisoformat(ts), sid
+
+
+def encode_sync_token(xid: int, sid: str) -> str:
+    return base64.urlsafe_b64encode(f"{xid}|{sid}".encode()).decode()
+
+
+def decode_sync_token(token: str) -> tuple[int, str]:
+    try:
+        xid, sid = base64.urlsafe_b64decode(token.encode()).decode().split("|", 1)
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError(token) from exc
+    return int(xid), sid
+
+
+def select_records(table: Table, uid: str, query: dict) -> Select:
+    statement = select(table).where(table.c.uid == uid)
+    if "start" in query:
+        statement = statement.where(table.c.ts >= query["start"])
+    if "end" in query:
+        statement = statement.where(table.c.ts < query["end"])
+    if "code" in query:
+        statement = statement.where(table.c.code == query["code"])
+    if "cursor" in query:
+        ts, sid = query["cursor"]
+        # NOTE: the plain ts bound lets the planner use the (uid, ts) index range
+        statement = statement.where(
+            table.c.ts <= ts, tuple_(table.c.ts, table.c.sid) < tuple_(ts, sid)
+        )
+    return statement.order_by(table.c.ts.desc(), table.c.sid.desc())
+
+
+async def fetch_records_page(
+    connection: AsyncConnection,
+    statement: Select,
+    query: dict,
+    parse_row: Callable[[Row], dict],
+):
+    limit = query.get("limit", config.RECORDS_PAGE_DEFAULT_LIMIT)
+    rows = (await connection.execute(statement.limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].ts, rows[-1].sid)
+    return {"records": [parse_row(row) for row in rows], "next": next_cursor}
+
+
+def select_users_records(table: Table, uids: list[str], query: dict) -> Select:
+    """Latest records of every user within the range, `limit` + 1 per user
+
+    The extra record tells whether the records of a user have been truncated.
+    """
+    limit = query.get("limit", config.RECORDS_PAGE_DEFAULT_LIMIT)
+    ranked = (
+        select(
+            table,
+            func.row_number()
+            .over(
+                partition_by=table.c.uid,
+                order_by=(table.c.ts.desc(), table.c.sid.desc()),
+            )
+            .label("rank"),
+        )
+        .where(
+            table.c.uid == any_(bindparam("uids", uids, type_=ARRAY(table.c.uid.type))),
+            table.c.ts >= query["start"],
+            table.c.ts < query["end"],
+        )
+        .subquery()
+    )
+    return (
+        select(*(ranked.c[column.name] for column in table.columns))
+        .where(ranked.c.rank <= limit + 1)
+        .order_by(ranked.c.uid, ranked.c.rank)
+    )
+
+
+async def fetch_users_records(
+    connection: AsyncConnection,
+    statement: Select,
+    query: dict,
+    parse_row: Callable[[Row], dict],
+) -> dict[str, dict]:
+    limit = query.get("limit", config.RECORDS_PAGE_DEFAULT_LIMIT)
+    users: dict[str, dict] = {}
+    for row in await connection.execute(statement):
+        user = users.setdefault(row.uid, {"records": [], "more": False})
+        if len(user["records"]) < limit:
+            user["records"].append(parse_row(row))
+        else:
+            user["more"] = True
+    return users
+
+
+def select_changes(table: Table, uid: str, query: dict) -> Select:
+    """Select records in the order they were stored, whatever their `ts`
+
+    Rows are ordered by the id of their writing transaction and served only
+    below the oldest transaction that may still commit, so a transaction that
+    commits after a later one is not skipped however long it takes. A long
+    running transaction delays the changes of everyone until it ends.
+    """
+    statement = select(table).where(
+        table.c.uid == uid, table.c.ingested_xid < visible_xid()
+    )
+    if "since" in query:
+        ingested_xid, sid = query["since"]
+        statement = statement.where(
+            table.c.ingested_xid >= ingested_xid,
+            tuple_(table.c.ingested_xid, table.c.sid) > tuple_(ingested_xid, sid),
+        )
+    return statement.order_by(table.c.ingested_xid, table.c.sid)
+
+
+async def fetch_changes(
+    connection: AsyncConnection,
+    statement: Select,
+    query: dict,
+    parse_row: Callable[[Row], dict],
+):
+    """Fetch records past the sync token in the watermark order
+
+    The returned token is the ingestion watermark of the last record, or the incoming
+    one when there is nothing new, so it can always be sent back as is.
+    """
+    limit = query.get("limit", config.RECORDS_PAGE_DEFAULT_LIMIT)
+    rows = (await connection.execute(statement.limit(limit + 1))).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        token = encode_sync_token(rows[-1].ingested_xid, rows[-1].sid)
+    elif "since" in query:
+        token = encode_sync_token(*query["since"])
+    else:
+        token = None
+    return {"records": [parse_row(row) for row in rows], "next": token, "more": more}
+
+
+def select_aggregates(
+    schema: SchemaRegistry, table_name: str, uid: str, query: dict
+) -> Select:
+    rollup = choose_rollup(schema, table_name, query)
+    if rollup is None:
+        return select_raw_aggregates(schema[table_name], uid, query)
+    return select_rollup_aggregates(rollup, uid, query)
+
+
+def choose_rollup(schema: SchemaRegistry, table_name: str, query: dict) -> Table | None:
+    """Pick the coarsest continuous aggregate that can answer the query
+
+    A rollup fits when the requested bucket is a multiple of its granularity
+    and the time range is aligned to it. The not yet materialized tail is
+    served by TimescaleDB real-time aggregation.
+    """
+    for suffix, granularity in ROLLUP_GRANULARITIES:
+        if (
+            BUCKET_GRANULARITIES[query["bucket"]] >= granularity
+            and is_aligned(query["start"], granularity)
+            and is_aligned(query["end"], granularity)
+        ):
+            return schema[f"{table_name}_{suffix}"]
+    return None
+
+
+def is_aligned(value: datetime.datetime, granularity: datetime.timedelta) -> bool:
+    return (value - EPOCH) % granularity == datetime.timedelta(0)
+
+
+def bucket_width(query: dict) -> ColumnElement:
+    # NOTE: bucket widths are whitelisted by AggregateQuerySchema
+    return literal_column(f"interval '{BUCKET_WIDTHS[query['bucket']]}'")
+
+
+def select_raw_aggregates(table: Table, uid: str, query: dict) -> Select:
+    bucket = func.time_bucket(bucket_width(query), table.c.ts).label("bucket")
+    statement = select(
+        bucket,
+        table.c.code,
+        func.count().label("record_count"),
+        func.sum(table.c.duration).label("duration_sum"),
+        func.avg(table.c.duration).label("duration_avg"),
+        func.sum(table.c.energy).label("energy_sum"),
+        func.avg(table.c.energy).label("energy_avg"),
+        func.min(table.c.start).label("start"),
+        func.max(table.c.finish).label("finish"),
+    ).where(
+        table.c.uid == uid,
+        table.c.ts >= query["start"],
+        table.c.ts < query["end"],
+    )
+    if "code" in query:
+        statement = statement.where(table.c.code == query["code"])
+    return statement.group_by(bucket, table.c.code).order_by(bucket, table.c.code)
+
+
+def select_rollup_aggregates(rollup: Table, uid: str, query: dict) -> Select:
+    bucket = func.time_bucket(bucket_width(query), rollup.c.bucket).label("bucket")
+    statement = select(
+        bucket,
+        rollup.c.code,
+        func.sum(rollup.c.record_count).label("record_count"),
+        func.sum(rollup.c.duration_sum).label("duration_sum"),
+        (
+            func.sum(rollup.c.duration_sum)
+            / func.nullif(func.sum(rollup.c.duration_count), 0)
+        ).label("duration_avg"),
+        func.sum(rollup.c.energy_sum).label("energy_sum"),
+        (
+            func.sum(rollup.c.energy_sum)
+            / func.nullif(func.sum(rollup.c.energy_count), 0)
+        ).label("energy_avg"),
+        func.min(rollup.c.start).label("start"),
+        func.max(rollup.c.finish).label("finish"),
+    ).where(
+        rollup.c.uid == uid,
+        rollup.c.bucket >= query["start"],
+        rollup.c.bucket < query["end"],
+    )
+    if "code" in query:
+        statement = statement.where(rollup.c.code == query["code"])
+    return statement.group_by(bucket, rollup.c.code).order_by(bucket, rollup.c.code)
+
+
+def optional(value: object, cast: Callable):
+    return cast(value) if value is not None else None
+
+
+def parse_aggregate_row(row: Row):
+    return {
+        "bucket": row.bucket,
+        "code": row.code,
+        "count": int(row.record_count),
+        "duration_sum": optional(row.duration_sum, int),
+        "duration_avg": optional(row.duration_avg, float),
+        "energy_sum": optional(row.energy_sum, int),
+        "energy_avg": optional(row.energy_avg, float),
+        "start": row.start,
+        "finish": row.finish,
+    }
+
+
+async def fetch_aggregates(connection: AsyncConnection, statement: Select):
+    return {
+        "buckets": [
+            parse_aggregate_row(row) for row in await connection.execute(statement)
+        ]
+    }
@@ -0,0 +1,40 @@
+from collections.abc import Callable
+
+from aiohttp import web
+from sqlalchemy import Row, Select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fhir_datasequence import config
+from fhir_datasequence.api.codec import dumps_lines
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def wants_stream(request: web.Request) -> bool:
+    return request["querystring"].get("stream", False) or (
+        NDJSON_CONTENT_TYPE in request.headers.get("Accept", "")
+    )
+
+
+async def stream_records(
+    request: web.Request,
+    engine: AsyncEngine,
+    statement: Select,
+    parse_row: Callable[[Row], dict],
+    headers: dict[str, str] | None = None,
+) -> web.StreamResponse:
+    if "limit" in request["querystring"]:
+        statement = statement.limit(request["querystring"]["limit"])
+    response = web.StreamResponse(
+        headers={**(headers or {}), "Content-Type": NDJSON_CONTENT_TYPE}
+    )
+    response.enable_compression()
+    async with engine.connect() as connection:
+        result = await connection.stream(
+            statement.execution_options(yield_per=config.RECORDS_STREAM_BATCH_SIZE)
+        )
+        await response.prepare(request)
+        async for rows in result.partitions():
+            await response.write(dumps_lines([parse_row(row) for row in rows]))
+    await response.write_eof()
+    return response
@@ -1,8 +1,10 @@
 import functools
+import hashlib
 import logging
-from collections.abc import Callable
+import time
+from collections.abc import Awaitable, Callable
 from dataclasses import dataclass
-from typing import Literal
+from typing import Literal, cast
 
 from aiohttp import web
 from aiohttp_apispec import headers_schema
@@ -10,6 +12,8 @@ from jwt import PyJWTError, decode
 from marshmallow import Schema, fields, validate
 
 from fhir_datasequence import config
+from fhir_datasequence.cache import TTLCache
+from fhir_datasequence.metrics import stage
 
 
 class OpenIDSignatureKeyNotFoundError(Exception):
@@ -69,7 +73,12 @@ def openid_userinfo(required: bool = True):
             if authorization is None:
                 return await api_handler(request, userinfo=None)
             try:
-                verified = await verify_user_id_token(authorization)
+                with stage("token_verification").time():
+                    verified = await verify_cached_token(
+                        request.app["verified_token_cache"],
+                        authorization,
+                        verify_user_id_token,
+                    )
             except OpendIDSignatureValidationError as exc:
                 logging.exception("OpenID token verification has failed")
                 logging.exception("Erorr: %s", exc)
@@ -100,3 +109,30 @@ async def verify_user_id_token(token: str):
         )
     except PyJWTError as exc:
         raise OpendIDSignatureValidationError() from exc
+
+
+def create_token_cache() -> TTLCache:
+    return TTLCache(
+        maxsize=config.VERIFIED_TOKEN_CACHE_SIZE, ttl=config.VERIFIED_TOKEN_CACHE_TTL
+    )
+
+
+async def verify_cached_token(
+    cache: TTLCache, token: str, verify: Callable[[str], Awaitable[dict]]
+) -> dict:
+    """Memoize claims of successfully verified tokens until they expire
+
+    Each verifier needs its own cache, otherwise a token accepted by one of
+    them would be accepted by the others.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    claims = cache.get(key)
+    if claims is not None:
+        return cast(dict, claims)
+    claims = await verify(token)
+    ttl = cache.ttl
+    if isinstance(claims.get("exp"), int | float):
+        ttl = min(ttl, claims["exp"] - time.time())
+    if ttl > 0:
+        cache.set(key, claims, ttl=ttl)
+    return claims
@@ -1,9 +1,12 @@
+import asyncio
+import contextlib
 import functools
 import logging
+import re
+import time
 from collections.abc import Callable
-from typing import cast
 
-from aiohttp import ClientSession, web
+from aiohttp import ClientError, ClientSession, ClientTimeout, hdrs, web
 from jwt import PyJWK, PyJWKSet, PyJWTError, decode, get_unverified_header
 
 from fhir_datasequence import config
@@ -12,7 +15,9 @@ from fhir_datasequence.auth import (
     OpenIDSignatureKeyNotFoundError,
     UserInfo,
     authorization,
+    verify_cached_token,
 )
+from fhir_datasequence.metrics import stage, upstream_trace_config
 
 
 def apple_openid_userinfo(required: bool = True):
@@ -23,8 +28,18 @@ def apple_openid_userinfo(required: bool = True):
             if authorization is None:
                 return await api_handler(request, userinfo=None)
             try:
-                verified = await verify_apple_id_token(authorization)
-            except OpendIDSignatureValidationError as exc:
+                with stage("apple_token_verification").time():
+                    verified = await verify_cached_token(
+                        request.app["apple_token_cache"],
+                        authorization,
+                        functools.partial(
+                            verify_apple_id_token, request.app["apple_jwks"]
+                        ),
+                    )
+            except (
+                OpendIDSignatureValidationError,
+                OpenIDSignatureKeyNotFoundError,
+            ) as exc:
                 logging.exception("OpenID token verification has failed")
                 raise web.HTTPUnauthorized() from exc
             return await api_handler(request, userinfo=UserInfo(id=verified["sub"]))
@@ -34,31 +49,106 @@ def apple_openid_userinfo(required: bool = True):
     return openid_userinfo_provider
 
 
-apple_jwks: PyJWKSet | None = None
+class AppleJWKS:
+    """Apple OpenID signature keys indexed by `kid`
 
+    Keys are refreshed in the background once the Cache-Control max-age of the
+    key set has passed, and on demand when a token is signed with an unknown
+    key. Concurrent refreshes share a single request to Apple.
+    """
 
-async def find_apple_openid_key(token: str) -> PyJWK | None:
-    global apple_jwks
+    def __init__(self: "AppleJWKS", session: ClientSession) -> None:
+        self.session = session
+        self.keys: dict[str, PyJWK] = {}
+        self.expires_at = 0.0
+        self.fetched_at = float("-inf")
+        self.attempted_at = float("-inf")
+        self.fetching: asyncio.Task | None = None
 
-    unverified = get_unverified_header(token)
+    async def find(self: "AppleJWKS", kid: str) -> PyJWK | None:
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+        # NOTE: tokens with made-up kids must not turn into requests to Apple,
+        # failed attempts count as well, so an outage does not either
+        if (
+            time.monotonic() - self.attempted_at
+            < config.APPLE_JWKS_MIN_REFRESH_INTERVAL
+        ):
+            return None
+        try:
+            await self.refresh()
+        except (ClientError, asyncio.TimeoutError, PyJWTError):
+            logging.exception("Apple JWKS refresh has failed")
+        return self.keys.get(kid)
 
-    if not apple_jwks:
-        async with ClientSession() as session:
-            async with session.get(config.APPLE_JWKS_API) as resp:
-                apple_jwks = PyJWKSet.from_dict(await resp.json())
+    async def refresh(self: "AppleJWKS") -> None:
+        if self.fetching is None or self.fetching.done():
+            self.fetching = asyncio.create_task(self.fetch())
+        await asyncio.shield(self.fetching)
 
-    return next(
-        (
-            k
-            for k in cast(PyJWKSet, apple_jwks).keys
-            if k.public_key_use == "sig" and k.key_id == unverified["kid"]
-        ),
-        None,
+    async def fetch(self: "AppleJWKS") -> None:
+        self.attempted_at = time.monotonic()
+        async with self.session.get(config.APPLE_JWKS_API) as resp:
+            resp.raise_for_status()
+            jwks = PyJWKSet.from_dict(await resp.json())
+            max_age = parse_max_age(resp.headers.get(hdrs.CACHE_CONTROL, ""))
+        self.keys = {
+            key.key_id: key
+            for key in jwks.keys
+            if key.key_id and key.public_key_use == "sig"
+        }
+        self.fetched_at = time.monotonic()
+        self.expires_at = self.fetched_at + (
+            max_age if max_age is not None else config.APPLE_JWKS_TTL
+        )
+
+
+def parse_max_age(cache_control: str) -> int | None:
+    match = re.search(r"max-age=(\d+)", cache_control)
+    return int(match.group(1)) if match else None
+
+
+async def attach(app: web.Application):
+    session = ClientSession(
+        timeout=ClientTimeout(total=config.APPLE_JWKS_TIMEOUT),
+        trace_configs=[upstream_trace_config("apple")],
     )
+    app["apple_jwks"] = AppleJWKS(session)
+    try:
+        await app["apple_jwks"].refresh()
+    except (ClientError, asyncio.TimeoutError, PyJWTError):
+        logging.exception("Apple JWKS pre-warming has failed")
+    refresher = asyncio.create_task(refresh_apple_jwks(app["apple_jwks"]))
+
+    yield
 
+    refresher.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await refresher
+    await session.close()
 
-async def verify_apple_id_token(token: str):
-    openid_sig_key = await find_apple_openid_key(token)
+
+async def refresh_apple_jwks(jwks: AppleJWKS):
+    while True:
+        await asyncio.sleep(
+            max(
+                jwks.expires_at - time.monotonic(),
+                config.APPLE_JWKS_MIN_REFRESH_INTERVAL,
+            )
+        )
+        try:
+            await jwks.refresh()
+        except (ClientError, asyncio.TimeoutError, PyJWTError):
+            logging.exception("Apple JWKS refresh has failed")
+
+
+async def verify_apple_id_token(jwks: AppleJWKS, token: str):
+    try:
+        kid = get_unverified_header(token).get("kid")
+    except PyJWTError as exc:
+        raise OpendIDSignatureValidationError() from exc
+    openid_sig_key = await jwks.find(kid) if kid else None
     if not openid_sig_key:
         raise OpenIDSignatureKeyNotFoundError()
     try:
@@ -1,14 +1,21 @@
+import asyncio
 import functools
+import hashlib
 import logging
 from collections.abc import Callable
+from typing import cast
 
 from aiohttp import web
 from aiohttp_apispec import match_info_schema
 from fhirpy import AsyncFHIRClient
+from fhirpy.lib import AsyncFHIRResource  # type: ignore
 from marshmallow import Schema, fields
 
 from fhir_datasequence import config
 from fhir_datasequence.auth import UserInfo, authorization
+from fhir_datasequence.cache import TTLCache
+from fhir_datasequence.emr import fhir_client
+from fhir_datasequence.metrics import stage
 
 
 class UnableToAuthenticateRequestingActorError(Exception):
@@ -27,6 +34,19 @@ class ConsentProvisionDeniedError(Exception):
     pass
 
 
+class PatientNotFoundError(Exception):
+    pass
+
+
+CONSENT_VERIFICATION_ERRORS = (
+    UnableToAuthenticateRequestingActorError,
+    PatientNotFoundError,
+    RequestingActorConsentRoleIsMissingError,
+    NoConsentIssuedError,
+    ConsentProvisionDeniedError,
+)
+
+
 class ConsentPatientMatchInfoSchema(Schema):
     patient = fields.UUID(required=True, description="Consent patient identifier")
 
@@ -38,17 +58,14 @@ def requires_consent():
         @functools.wraps(api_handler)
         async def validate_consent(request: web.Request, authorization: str):
             try:
-                userid = await verify_patient_consent(
-                    patient_id=request.match_info["patient"],
-                    subject=config.EMR_RECORDS_SERVICE_IDENTIFIER,
-                    authorization=authorization,
-                )
-            except (
-                UnableToAuthenticateRequestingActorError,
-                RequestingActorConsentRoleIsMissingError,
-                NoConsentIssuedError,
-                ConsentProvisionDeniedError,
-            ) as exc:
+                with stage("consent_verification").time():
+                    userid = await verify_cached_patient_consent(
+                        request.app["fhir_consent_cache"],
+                        fhir_client(request.app, authorization),
+                        patient_id=request.match_info["patient"],
+                        subject=config.EMR_RECORDS_SERVICE_IDENTIFIER,
+                    )
+            except CONSENT_VERIFICATION_ERRORS as exc:
                 logging.exception("Access Consent verification has failed")
                 raise web.HTTPForbidden() from exc
             return await api_handler(request, userinfo=UserInfo(id=userid))
@@ -58,29 +75,180 @@ def requires_consent():
     return consent_validator
 
 
-async def verify_patient_consent(patient_id: str, subject: str, authorization: str):
-    fhir_api = AsyncFHIRClient(config.EMR_FHIR_URL, authorization=authorization)
-    requesting_actor = await fhir_api.execute("/auth/userinfo", method="GET")
+def requires_patients_consent():
+    """Verify consents of the `patient` query parameters in a batch
+
+    The handler receives the data sequence user ids of consented patients and
+    the identifiers of the denied ones, so that it can answer partially.
+    """
+
+    def consent_validator(api_handler: Callable):
+        @authorization(required=True)
+        @functools.wraps(api_handler)
+        async def validate_consents(request: web.Request, authorization: str):
+            patient_ids = list(
+                dict.fromkeys(map(str, request["querystring"]["patient"]))
+            )
+            try:
+                with stage("consent_verification").time():
+                    decisions = await verify_cached_patients_consent(
+                        request.app["fhir_consent_cache"],
+                        fhir_client(request.app, authorization),
+                        patient_ids=patient_ids,
+                        subject=config.EMR_RECORDS_SERVICE_IDENTIFIER,
+                    )
+            except CONSENT_VERIFICATION_ERRORS as exc:
+                logging.exception("Access Consent verification has failed")
+                raise web.HTTPForbidden() from exc
+            consented = {
+                patient_id: userid
+                for patient_id, userid in decisions.items()
+                if isinstance(userid, str)
+            }
+            denied = [
+                patient_id for patient_id in patient_ids if patient_id not in consented
+            ]
+            return await api_handler(request, consented=consented, denied=denied)
+
+        return validate_consents
+
+    return consent_validator
+
+
+def create_consent_cache() -> TTLCache:
+    return TTLCache(
+        maxsize=config.FHIR_CONSENT_CACHE_SIZE, ttl=config.FHIR_CONSENT_CACHE_TTL
+    )
+
+
+async def verify_cached_patient_consent(
+    cache: TTLCache, fhir_api: AsyncFHIRClient, patient_id: str, subject: str
+):
+    """Memoize consent decisions of `verify_patient_consent`
+
+    Denials are cached as well, for a shorter time, and raised again on a hit.
+    The token is hashed so that the cache never holds credentials.
+    """
+    token_digest = hashlib.sha256(fhir_api.authorization.encode()).digest()
+    key = (token_digest, patient_id, subject)
+    decision = cache.get(key)
+    if isinstance(decision, type) and issubclass(decision, Exception):
+        raise decision()
+    if decision is not None:
+        return decision
+    try:
+        userid = await verify_patient_consent(fhir_api, patient_id, subject)
+    except CONSENT_VERIFICATION_ERRORS as exc:
+        cache.set(key, type(exc), ttl=config.FHIR_CONSENT_CACHE_NEGATIVE_TTL)
+        raise
+    cache.set(key, userid)
+    return userid
+
+
+async def verify_patient_consent(
+    fhir_api: AsyncFHIRClient, patient_id: str, subject: str
+):
+    requesting_actor, patient = await asyncio.gather(
+        fhir_api.execute("/auth/userinfo", method="GET"),
+        fhir_api.reference("Patient", patient_id).to_resource(),
+    )
+    consent = await search_consents(
+        fhir_api, requesting_actor, [patient.id], subject
+    ).first()
+    return consent_decision(consent, patient)
+
+
+async def verify_cached_patients_consent(
+    cache: TTLCache, fhir_api: AsyncFHIRClient, patient_ids: list[str], subject: str
+) -> dict[str, str | type[Exception]]:
+    """Batched counterpart of `verify_cached_patient_consent`
+
+    Every patient is mapped to its data sequence user id or to the class of
+    the error its verification has failed with, so that denied patients can
+    be skipped rather than failing the whole request.
+    """
+    token_digest = hashlib.sha256(fhir_api.authorization.encode()).digest()
+    decisions: dict[str, str | type[Exception]] = {}
+    for patient_id in patient_ids:
+        decision = cache.get((token_digest, patient_id, subject))
+        if decision is not None:
+            decisions[patient_id] = cast(str | type[Exception], decision)
+    missing = [patient_id for patient_id in patient_ids if patient_id not in decisions]
+    if missing:
+        verified = await verify_patients_consent(fhir_api, missing, subject)
+        for patient_id, decision in verified.items():
+            if isinstance(decision, type):
+                ttl = config.FHIR_CONSENT_CACHE_NEGATIVE_TTL
+                cache.set((token_digest, patient_id, subject), decision, ttl=ttl)
+            else:
+                cache.set((token_digest, patient_id, subject), decision)
+        decisions.update(verified)
+    return decisions
+
+
+async def verify_patients_consent(
+    fhir_api: AsyncFHIRClient, patient_ids: list[str], subject: str
+) -> dict[str, str | type[Exception]]:
+    """Verify consents of many patients with a single Patient and Consent search
+
+    Errors of the requesting actor apply to every patient and are raised.
+    """
+    requesting_actor, patients = await asyncio.gather(
+        fhir_api.execute("/auth/userinfo", method="GET"),
+        fhir_api.resources("Patient")
+        .search(_id=",".join(patient_ids))
+        .limit(len(patient_ids))
+        .fetch_all(),
+    )
+    consents = search_consents(
+        fhir_api, requesting_actor, [patient.id for patient in patients], subject
+    )
+    # NOTE: the first consent of a patient decides, as in the single search
+    patient_consents: dict[str, AsyncFHIRResource] = {}
+    for consent in await consents.fetch_all() if patients else []:
+        patient_consents.setdefault(consent["patient"].id, consent)
+    patients_by_id = {patient.id: patient for patient in patients}
+    decisions: dict[str, str | type[Exception]] = {}
+    for patient_id in patient_ids:
+        try:
+            if patient_id not in patients_by_id:
+                raise PatientNotFoundError()
+            decisions[patient_id] = consent_decision(
+                patient_consents.get(patient_id), patients_by_id[patient_id]
+            )
+        except CONSENT_VERIFICATION_ERRORS as exc:
+            decisions[patient_id] = type(exc)
+    return decisions
+
+
+def search_consents(
+    fhir_api: AsyncFHIRClient,
+    requesting_actor: dict | None,
+    patient_ids: list[str],
+    subject: str,
+):
     if requesting_actor is None:
         raise UnableToAuthenticateRequestingActorError()
-    requesting_actor_roles = extract_linked_roles(requesting_actor, role="practitioner")
+    requesting_actor_roles = list(
+        extract_linked_roles(requesting_actor, role="practitioner")
+    )
     if not requesting_actor_roles:
         raise RequestingActorConsentRoleIsMissingError()
-    patient = await fhir_api.reference("Patient", patient_id).to_resource()
-    consent = (
-        await fhir_api.resources("Consent")
-        .search(
-            actor=",".join(requesting_actor_roles),
-            patient=patient.id,
-            status="active",
-            action="access",
-            scope="patient-privacy",
-            category="INFAO",
-            purpose="CAREMGT",
-            data__Endpoint__identifier=subject,
-        )
-        .first()
+    return fhir_api.resources("Consent").search(
+        actor=",".join(requesting_actor_roles),
+        patient=",".join(patient_ids),
+        status="active",
+        action="access",
+        scope="patient-privacy",
+        category="INFAO",
+        purpose="CAREMGT",
+        data__Endpoint__identifier=subject,
     )
+
+
+def consent_decision(
+    consent: AsyncFHIRResource | None, patient: AsyncFHIRResource
+) -> str:
     if consent is None:
         raise NoConsentIssuedError()
     if consent["provision"]["type"] != "permit":
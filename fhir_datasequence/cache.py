@@ -0,0 +1,73 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+class TTLCache:
+    """In-process LRU cache with a per-entry time to live
+
+    Expired entries are dropped when they are looked up and evicted in the
+    least recently used order when the cache is full.
+    """
+
+    def __init__(self: "TTLCache", maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self: "TTLCache") -> int:
+        return len(self.entries)
+
+    def get(self: "TTLCache", key: Hashable, default: object = None) -> object:
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+        self.misses += 1
+        return default
+
+    def set(
+        self: "TTLCache", key: Hashable, value: object, ttl: float | None = None
+    ) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self: "TTLCache", key: Hashable) -> None:
+        self.entries.pop(key, None)
+
+    def stats(self: "TTLCache") -> dict[str, int]:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key
+
+    The call runs as a shielded task, so that a cancelled caller does not
+    cancel it for the others.
+    """
+
+    def __init__(self: "SingleFlight") -> None:
+        self.calls: dict[Hashable, asyncio.Task] = {}
+
+    async def run(
+        self: "SingleFlight", key: Hashable, call: Callable[[], Awaitable[T]]
+    ) -> T:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self.calls[key] = task
+            task.add_done_callback(lambda _task: self.calls.pop(key, None))
+        return await asyncio.shield(task)
@@ -1,8 +1,22 @@
 from os import environ
 
 DBAPI_CONN_URL = f"postgresql+psycopg://{environ['PGUSER']}:{environ['PGPASSWORD']}@{environ['TIMESCALEDB_SERVICE_NAME']}"
+DBAPI_POOL_SIZE = int(environ.get("DBAPI_POOL_SIZE", 5))
+DBAPI_MAX_OVERFLOW = int(environ.get("DBAPI_MAX_OVERFLOW", 10))
+DBAPI_POOL_TIMEOUT = float(environ.get("DBAPI_POOL_TIMEOUT", 30))
+DBAPI_POOL_RECYCLE = int(environ.get("DBAPI_POOL_RECYCLE", 1800))
+DBAPI_POOL_PRE_PING = environ.get("DBAPI_POOL_PRE_PING", "true").lower() == "true"
+# NOTE: milliseconds, 0 leaves the server default
+DBAPI_STATEMENT_TIMEOUT = int(environ.get("DBAPI_STATEMENT_TIMEOUT", 30000))
+DBAPI_PREPARE_THRESHOLD = int(environ.get("DBAPI_PREPARE_THRESHOLD", 2))
+DBAPI_PGBOUNCER = environ.get("DBAPI_PGBOUNCER", "false").lower() == "true"
 
 APPLE_JWKS_API = "https://appleid.apple.com/auth/keys"
+APPLE_JWKS_TTL = int(environ.get("APPLE_JWKS_TTL", 3600))
+APPLE_JWKS_MIN_REFRESH_INTERVAL = int(
+    environ.get("APPLE_JWKS_MIN_REFRESH_INTERVAL", 60)
+)
+APPLE_JWKS_TIMEOUT = float(environ.get("APPLE_JWKS_TIMEOUT", 10))
 APPLE_OPENID_ISS_SERVICE = "https://appleid.apple.com"
 APPLE_OPENID_AUD_WEB_CLIENT_ID = "software.beda.emr"
 APPLE_OPENID_AUD_MOBILE_CLIENT_ID = "software.beda.fhirmhealth.fhirmhealth"
@@ -17,6 +31,10 @@ EMR_RECORDS_SERVICE_IDENTIFIER = environ.get(
 
 EMR_WEB_URL = environ.get("EMR_WEB_URL", "https://emr.beda.software")
 EMR_FHIR_URL = environ.get("EMR_FHIR_URL", "https://aidbox.emr.beda.software")
+EMR_FHIR_POOL_LIMIT = int(environ.get("EMR_FHIR_POOL_LIMIT", 100))
+EMR_FHIR_KEEPALIVE_TIMEOUT = float(environ.get("EMR_FHIR_KEEPALIVE_TIMEOUT", 30))
+EMR_FHIR_TIMEOUT = float(environ.get("EMR_FHIR_TIMEOUT", 30))
+EMR_FHIR_CONNECT_TIMEOUT = float(environ.get("EMR_FHIR_CONNECT_TIMEOUT", 5))
 
 METRIPORT_API_MAIN_URL = environ.get(
     "METRIPORT_API_MAIN_URL", "https://api.metriport.com"
@@ -38,3 +56,67 @@ METRIPORT_IDENTIFIER_SYSTEM_URL = environ.get(
 )
 
 JWT_TOKEN_ENCODE_SECRET = environ.get("JWT_TOKEN_ENCODE_SECRET", "secret")
+VERIFIED_TOKEN_CACHE_SIZE = int(environ.get("VERIFIED_TOKEN_CACHE_SIZE", 4096))
+VERIFIED_TOKEN_CACHE_TTL = float(environ.get("VERIFIED_TOKEN_CACHE_TTL", 300))
+
+SCHEMA_REFRESH_INTERVAL = int(environ.get("SCHEMA_REFRESH_INTERVAL", 60))
+
+RECORDS_PAGE_DEFAULT_LIMIT = int(environ.get("RECORDS_PAGE_DEFAULT_LIMIT", 1000))
+RECORDS_PAGE_MAX_LIMIT = int(environ.get("RECORDS_PAGE_MAX_LIMIT", 10000))
+RECORDS_STREAM_BATCH_SIZE = int(environ.get("RECORDS_STREAM_BATCH_SIZE", 500))
+RECORDS_BATCH_MAX_PATIENTS = int(environ.get("RECORDS_BATCH_MAX_PATIENTS", 100))
+RECORDS_EXPORT_BATCH_SIZE = int(environ.get("RECORDS_EXPORT_BATCH_SIZE", 50000))
+RESPONSE_COMPRESSION_MIN_SIZE = int(environ.get("RESPONSE_COMPRESSION_MIN_SIZE", 1024))
+
+METRIPORT_UPSERT_BATCH_SIZE = int(environ.get("METRIPORT_UPSERT_BATCH_SIZE", 1000))
+
+METRIPORT_WEBHOOK_CONCURRENCY = int(environ.get("METRIPORT_WEBHOOK_CONCURRENCY", 4))
+METRIPORT_QUEUE_WORKERS = int(environ.get("METRIPORT_QUEUE_WORKERS", 4))
+METRIPORT_QUEUE_POLL_INTERVAL = float(environ.get("METRIPORT_QUEUE_POLL_INTERVAL", 5))
+METRIPORT_QUEUE_LEASE = int(environ.get("METRIPORT_QUEUE_LEASE", 300))
+METRIPORT_QUEUE_MAX_ATTEMPTS = int(environ.get("METRIPORT_QUEUE_MAX_ATTEMPTS", 8))
+METRIPORT_QUEUE_BACKOFF_BASE = float(environ.get("METRIPORT_QUEUE_BACKOFF_BASE", 2))
+METRIPORT_QUEUE_BACKOFF_MAX = float(environ.get("METRIPORT_QUEUE_BACKOFF_MAX", 600))
+
+RECORDS_BULK_INGEST_THRESHOLD = int(environ.get("RECORDS_BULK_INGEST_THRESHOLD", 500))
+
+# NOTE: PostgreSQL intervals, an empty value disables the policy
+RECORDS_COMPRESS_AFTER = environ.get("RECORDS_COMPRESS_AFTER", "30 days")
+RECORDS_RETENTION = environ.get("RECORDS_RETENTION", "")
+METRIPORT_RECORDS_COMPRESS_AFTER = environ.get(
+    "METRIPORT_RECORDS_COMPRESS_AFTER", "30 days"
+)
+METRIPORT_RECORDS_RETENTION = environ.get("METRIPORT_RECORDS_RETENTION", "")
+METRIPORT_UNHANDLED_DATA_COMPRESS_AFTER = environ.get(
+    "METRIPORT_UNHANDLED_DATA_COMPRESS_AFTER", "7 days"
+)
+METRIPORT_UNHANDLED_DATA_RETENTION = environ.get(
+    "METRIPORT_UNHANDLED_DATA_RETENTION", "365 days"
+)
+
+FHIR_CONSENT_CACHE_SIZE = int(environ.get("FHIR_CONSENT_CACHE_SIZE", 1024))
+FHIR_CONSENT_CACHE_TTL = float(environ.get("FHIR_CONSENT_CACHE_TTL", 60))
+FHIR_CONSENT_CACHE_NEGATIVE_TTL = float(
+    environ.get("FHIR_CONSENT_CACHE_NEGATIVE_TTL", 10)
+)
+
+# NOTE: bearer token required to scrape /metrics, unset leaves it open
+METRICS_AUTH_TOKEN = environ.get("METRICS_AUTH_TOKEN")
+METRICS_QUEUE_STATS_TTL = float(environ.get("METRICS_QUEUE_STATS_TTL", 15))
+# NOTE: set for gunicorn with several workers, see gunicorn.conf.py
+PROMETHEUS_MULTIPROC_DIR = environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+METRIPORT_IDENTITY_CACHE_SIZE = int(environ.get("METRIPORT_IDENTITY_CACHE_SIZE", 4096))
+METRIPORT_IDENTITY_CACHE_TTL = float(environ.get("METRIPORT_IDENTITY_CACHE_TTL", 3600))
+# NOTE: Metriport connect tokens are valid for 10 minutes
+METRIPORT_CONNECT_TOKEN_CACHE_SIZE = int(
+    environ.get("METRIPORT_CONNECT_TOKEN_CACHE_SIZE", 1024)
+)
+METRIPORT_CONNECT_TOKEN_TTL = float(environ.get("METRIPORT_CONNECT_TOKEN_TTL", 300))
+METRIPORT_API_TIMEOUT = float(environ.get("METRIPORT_API_TIMEOUT", 10))
+METRIPORT_API_RETRIES = int(environ.get("METRIPORT_API_RETRIES", 2))
+METRIPORT_API_RETRY_BACKOFF = float(environ.get("METRIPORT_API_RETRY_BACKOFF", 0.2))
+METRIPORT_CIRCUIT_FAILURES = int(environ.get("METRIPORT_CIRCUIT_FAILURES", 5))
+METRIPORT_CIRCUIT_RESET_TIMEOUT = float(
+    environ.get("METRIPORT_CIRCUIT_RESET_TIMEOUT", 30)
+)
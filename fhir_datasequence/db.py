@@ -0,0 +1,223 @@
+import asyncio
+import datetime
+import logging
+from collections.abc import Iterable
+from typing import cast
+
+import sqlalchemy
+from aiohttp import web
+from psycopg import AsyncConnection as AsyncDriverConnection
+from psycopg import sql
+from sqlalchemy import BIGINT, TEXT, ColumnElement, MetaData, Table, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+from fhir_datasequence import config
+from fhir_datasequence.metrics import InstrumentedPool, instrument_engine, stage
+
+RECORDS_TABLE_NAME = "records"
+RECORDS_UNIQUE_CONSTRAINT = "workout_ts_user_uq"
+RECORDS_WATERMARKS_TABLE_NAME = "records_watermarks"
+
+# Continuous aggregates maintained by migrations, from the coarsest one
+ROLLUP_GRANULARITIES = [
+    ("daily", datetime.timedelta(days=1)),
+    ("hourly", datetime.timedelta(hours=1)),
+]
+
+
+def with_rollups(table_name: str) -> list[str]:
+    return [table_name] + [
+        f"{table_name}_{suffix}" for suffix, _granularity in ROLLUP_GRANULARITIES
+    ]
+
+
+def current_xid() -> ColumnElement[int]:
+    """Id of the writing transaction, stored with the rows it writes"""
+    return sqlalchemy.cast(sqlalchemy.cast(func.pg_current_xact_id(), TEXT), BIGINT)
+
+
+def visible_xid() -> ColumnElement[int]:
+    """Oldest transaction id that may still commit
+
+    Every transaction with a lower id has already committed or rolled back,
+    so no row stored with a lower id can become visible later.
+    """
+    return sqlalchemy.cast(
+        sqlalchemy.cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), TEXT),
+        BIGINT,
+    )
+
+
+def create_engine() -> AsyncEngine:
+    """Create the application engine from the pool settings of the config
+
+    Server-side prepared statements are created by psycopg for queries that
+    are executed `DBAPI_PREPARE_THRESHOLD` times on a connection. PgBouncer in
+    transaction pooling mode can not route them back to the same server
+    connection, and it rejects the `options` startup parameter, so both are
+    disabled there and the statement timeout has to be set on the role.
+    """
+    connect_args: dict[str, object] = {}
+    if config.DBAPI_PGBOUNCER:
+        connect_args["prepare_threshold"] = None
+    else:
+        connect_args["prepare_threshold"] = config.DBAPI_PREPARE_THRESHOLD
+        if config.DBAPI_STATEMENT_TIMEOUT:
+            connect_args[
+                "options"
+            ] = f"-c statement_timeout={config.DBAPI_STATEMENT_TIMEOUT}"
+    engine = create_async_engine(
+        config.DBAPI_CONN_URL,
+        poolclass=InstrumentedPool,
+        pool_size=config.DBAPI_POOL_SIZE,
+        max_overflow=config.DBAPI_MAX_OVERFLOW,
+        pool_timeout=config.DBAPI_POOL_TIMEOUT,
+        pool_recycle=config.DBAPI_POOL_RECYCLE,
+        pool_pre_ping=config.DBAPI_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    instrument_engine(engine)
+    return engine
+
+
+class SchemaRegistry:
+    """Reflected table objects shared by all request handlers
+
+    The registry is filled by a single reflection pass at startup and is
+    reflected again only when the alembic revision of the database changes.
+    """
+
+    def __init__(self: "SchemaRegistry", table_names: list[str]) -> None:
+        self.table_names = table_names
+        self.metadata = MetaData()
+        self.revision: str | None = None
+
+    def __getitem__(self: "SchemaRegistry", table_name: str) -> Table:
+        return self.metadata.tables[table_name]
+
+    async def refresh(self: "SchemaRegistry", engine: AsyncEngine) -> bool:
+        async with engine.connect() as connection:
+            revision = await read_alembic_revision(connection)
+            if self.revision is not None and revision == self.revision:
+                return False
+            metadata = MetaData()
+            with stage("schema_reflection").time():
+                await connection.run_sync(
+                    lambda conn: metadata.reflect(
+                        conn, only=self.table_names, views=True
+                    )
+                )
+        self.metadata = metadata
+        self.revision = revision
+        logging.info("Database schema has been reflected at revision %s", revision)
+        return True
+
+
+async def read_alembic_revision(connection: AsyncConnection) -> str | None:
+    return await connection.scalar(
+        sqlalchemy.text("select version_num from alembic_version")
+    )
+
+
+async def watch_schema(app: web.Application):
+    while True:
+        await asyncio.sleep(config.SCHEMA_REFRESH_INTERVAL)
+        try:
+            await app["dbapi_schema"].refresh(app["dbapi_engine"])
+        except SQLAlchemyError:
+            logging.exception("Database schema refresh has failed")
+
+
+async def copy_insert(
+    connection: AsyncConnection, table: Table, rows: list[dict], constraint: str
+) -> int:
+    """Insert rows with a binary COPY through a temporary staging table
+
+    Returns the number of inserted rows, the rest conflicted with the constraint.
+    Columns missing from the rows are left to their server defaults.
+    """
+    copied = [column for column in table.columns if column.name in rows[0]]
+    columns = [column.name for column in copied]
+    staging = sql.Identifier(f"{table.name}_staging")
+    target = sql.Identifier(table.name)
+    column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = cast(AsyncDriverConnection, raw_connection.driver_connection)
+    async with driver_connection.cursor() as cursor:
+        await cursor.execute(
+            sql.SQL(
+                "CREATE TEMPORARY TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP"
+            ).format(staging, target)
+        )
+        async with cursor.copy(
+            sql.SQL("COPY {} ({}) FROM STDIN (FORMAT BINARY)").format(
+                staging, column_list
+            )
+        ) as copy:
+            copy.set_types(
+                [
+                    column.type.compile(dialect=connection.dialect).lower()
+                    for column in copied
+                ]
+            )
+            for row in rows:
+                await copy.write_row([as_aware(row.get(name)) for name in columns])
+        await cursor.execute(
+            sql.SQL(
+                "INSERT INTO {} ({}) SELECT {} FROM {} "
+                "ON CONFLICT ON CONSTRAINT {} DO NOTHING"
+            ).format(
+                target, column_list, column_list, staging, sql.Identifier(constraint)
+            )
+        )
+        return cursor.rowcount
+
+
+async def touch_watermarks(
+    connection: AsyncConnection,
+    watermarks: Table,
+    table_name: str,
+    uids: Iterable[str | None],
+):
+    """Mark the records of the users as modified by the current transaction
+
+    Writers call it last, so the row locks are held only until the commit and
+    the new versions become visible together with the records. Users are
+    locked in a fixed order, so concurrent writers do not deadlock.
+    """
+    rows = [
+        {
+            "table_name": table_name,
+            "uid": uid,
+            "version": 1,
+            "modified_at": func.clock_timestamp(),
+        }
+        for uid in sorted({uid for uid in uids if uid is not None})
+    ]
+    if not rows:
+        return
+    statement = insert(watermarks).values(rows)
+    await connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[watermarks.c.table_name, watermarks.c.uid],
+            set_={
+                "version": watermarks.c.version + 1,
+                # NOTE: HTTP dates have a resolution of a second, every change
+                # has to move Last-Modified by one at least
+                "modified_at": func.greatest(
+                    watermarks.c.modified_at + datetime.timedelta(seconds=1),
+                    statement.excluded.modified_at,
+                ),
+            },
+        )
+    )
+
+
+def as_aware(value: object) -> object:
+    # NOTE: binary COPY can not defer the time zone of naive datetimes to the
+    # server, so they are treated as UTC like the default server time zone
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.UTC)
+    return value
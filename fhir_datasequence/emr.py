@@ -0,0 +1,82 @@
+import json
+from json import JSONDecodeError
+
+from aiohttp import ClientSession, ClientTimeout, DummyCookieJar, TCPConnector, web
+from fhirpy import AsyncFHIRClient
+from fhirpy.base.exceptions import (  # type: ignore
+    MultipleResourcesFound,
+    OperationOutcome,
+    ResourceNotFound,
+)
+from fhirpy.base.utils import AttrDict  # type: ignore
+
+from fhir_datasequence import config
+from fhir_datasequence.metrics import upstream_trace_config
+
+
+async def attach(app: web.Application):
+    session = ClientSession(
+        connector=TCPConnector(
+            limit=config.EMR_FHIR_POOL_LIMIT,
+            keepalive_timeout=config.EMR_FHIR_KEEPALIVE_TIMEOUT,
+        ),
+        timeout=ClientTimeout(
+            total=config.EMR_FHIR_TIMEOUT, connect=config.EMR_FHIR_CONNECT_TIMEOUT
+        ),
+        # NOTE: the session is shared by all requesting actors
+        cookie_jar=DummyCookieJar(),
+        trace_configs=[upstream_trace_config("emr_fhir")],
+    )
+    app["emr_fhir_session"] = session
+
+    yield
+
+    await app["emr_fhir_session"].close()
+
+
+class PooledFHIRClient(AsyncFHIRClient):
+    """FHIR client sending requests through the application HTTP session
+
+    fhirpy opens a new session, and so new connections, for every request.
+    The authorization is still sent per request, only connections are shared.
+    """
+
+    def __init__(
+        self: "PooledFHIRClient", session: ClientSession, authorization: str
+    ) -> None:
+        super().__init__(config.EMR_FHIR_URL, authorization=authorization)
+        self.session = session
+
+    async def _do_request(
+        self: "PooledFHIRClient",
+        method: str,
+        path: str,
+        data: dict | None = None,
+        params: dict | None = None,
+        returning_status: bool = False,
+    ):
+        async with self.session.request(
+            method,
+            self._build_request_url(path, params),
+            json=data,
+            headers=self._build_request_headers(),
+        ) as response:
+            text = await response.text()
+            if 200 <= response.status < 300:
+                result = json.loads(text, object_hook=AttrDict) if text else None
+                return (result, response.status) if returning_status else result
+            if response.status in (404, 410):
+                raise ResourceNotFound(text)
+            if response.status == 412:
+                raise MultipleResourcesFound(text)
+            try:
+                parsed = json.loads(text)
+                if parsed["resourceType"] == "OperationOutcome":
+                    raise OperationOutcome(resource=parsed)
+            except (KeyError, TypeError, JSONDecodeError):
+                pass
+            raise OperationOutcome(reason=text)
+
+
+def fhir_client(app: web.Application, authorization: str) -> PooledFHIRClient:
+    return PooledFHIRClient(app["emr_fhir_session"], authorization)
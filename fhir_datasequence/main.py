@@ -1,42 +1,123 @@
+import asyncio
+import contextlib
+
 import aiohttp_cors
-import sqlalchemy
 from aiohttp import web
 from aiohttp_apispec import AiohttpApiSpec, validation_middleware  # type: ignore
-from sqlalchemy.ext.asyncio import create_async_engine
 
 from fhir_datasequence import config
 from fhir_datasequence.api.health_records import (
+    aggregate_health_records,
+    aggregate_shared_health_records,
+    export_health_records,
+    export_shared_health_records,
     read_health_records,
     share_health_records,
+    share_patients_health_records,
+    sync_health_records,
     write_health_records,
 )
+from fhir_datasequence.api.metrics import metrics_handler
+from fhir_datasequence.auth import create_token_cache
+from fhir_datasequence.auth.apple import attach as apple_jwks_attach
+from fhir_datasequence.auth.fhir import create_consent_cache
 from fhir_datasequence.auth.handlers import fetch_auth_token_handler
+from fhir_datasequence.db import (
+    RECORDS_TABLE_NAME,
+    RECORDS_WATERMARKS_TABLE_NAME,
+    SchemaRegistry,
+    create_engine,
+    watch_schema,
+    with_rollups,
+)
+from fhir_datasequence.emr import attach as emr_attach
+from fhir_datasequence.metrics import (
+    attach_collector,
+    metrics_middleware,
+)
+from fhir_datasequence.metriport import (
+    METRIPORT_BIOMETRICS_TABLE_NAME,
+    METRIPORT_BODY_TABLE_NAME,
+    METRIPORT_IDENTITIES_TABLE_NAME,
+    METRIPORT_RECORDS_TABLE_NAME,
+    METRIPORT_SLEEP_TABLE_NAME,
+    METRIPORT_UNHANDLED_RECORDS_TABLE_NAME,
+    METRIPORT_WEBHOOK_JOBS_TABLE_NAME,
+)
 from fhir_datasequence.metriport.api import (
+    aggregate_metriport_records,
+    aggregate_shared_metriport_records,
     connect_token_handler,
+    export_metriport_records,
+    export_shared_metriport_records,
+    read_metriport_biometrics,
+    read_metriport_body,
     read_metriport_records,
+    read_metriport_sleep,
+    share_metriport_biometrics,
+    share_metriport_body,
     share_metriport_records,
+    share_metriport_sleep,
+    sync_metriport_records,
 )
 from fhir_datasequence.metriport.client import attach as metriport_attach
-from fhir_datasequence.metriport.webhook import metriport_events_handler
+from fhir_datasequence.metriport.client import create_connect_token_cache
+from fhir_datasequence.metriport.identity import create_identity_cache
+from fhir_datasequence.metriport.queue import attach as metriport_queue_attach
+from fhir_datasequence.metriport.webhook import (
+    metriport_events_handler,
+    metriport_queue_stats_handler,
+)
 
 api_spec: AiohttpApiSpec | None = None
 cors: aiohttp_cors.CorsConfig | None = None
 
 
 async def pg_engine(app: web.Application):
-    app["dbapi_engine"] = create_async_engine(config.DBAPI_CONN_URL)
-    app["dbapi_metadata"] = sqlalchemy.MetaData()
+    app["dbapi_engine"] = create_engine()
+    app["dbapi_schema"] = SchemaRegistry(
+        [
+            *with_rollups(RECORDS_TABLE_NAME),
+            *with_rollups(METRIPORT_RECORDS_TABLE_NAME),
+            METRIPORT_SLEEP_TABLE_NAME,
+            METRIPORT_BIOMETRICS_TABLE_NAME,
+            METRIPORT_BODY_TABLE_NAME,
+            METRIPORT_UNHANDLED_RECORDS_TABLE_NAME,
+            METRIPORT_WEBHOOK_JOBS_TABLE_NAME,
+            METRIPORT_IDENTITIES_TABLE_NAME,
+            RECORDS_WATERMARKS_TABLE_NAME,
+        ]
+    )
+    await app["dbapi_schema"].refresh(app["dbapi_engine"])
+    schema_watcher = asyncio.create_task(watch_schema(app))
 
     yield
 
+    schema_watcher.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await schema_watcher
     await app["dbapi_engine"].dispose()
 
 
 async def application() -> web.Application:
     global api_spec, cors
 
-    app = web.Application(middlewares=[validation_middleware])
-    app.cleanup_ctx.extend([pg_engine, metriport_attach])
+    app = web.Application(middlewares=[metrics_middleware, validation_middleware])
+    app.cleanup_ctx.extend(
+        [
+            pg_engine,
+            apple_jwks_attach,
+            emr_attach,
+            metriport_attach,
+            metriport_queue_attach,
+        ]
+    )
+    app["fhir_consent_cache"] = create_consent_cache()
+    app["metriport_identity_cache"] = create_identity_cache()
+    app["metriport_connect_token_cache"] = create_connect_token_cache()
+    app["verified_token_cache"] = create_token_cache()
+    app["apple_token_cache"] = create_token_cache()
+    attach_collector(app)
     cors = aiohttp_cors.setup(
         app,
         defaults={
@@ -48,14 +129,58 @@ async def application() -> web.Application:
     app.router.add_post("/api/v1/records", write_health_records)
     cors.add(app.router.add_get("/api/v1/records", read_health_records))
     cors.add(app.router.add_get("/api/v1/{patient}/records", share_health_records))
+    cors.add(app.router.add_get("/api/v1/records/aggregate", aggregate_health_records))
+    cors.add(app.router.add_get("/api/v1/records/changes", sync_health_records))
+    cors.add(
+        app.router.add_get("/api/v1/records/shared", share_patients_health_records)
+    )
+    cors.add(app.router.add_get("/api/v1/records/export", export_health_records))
+    cors.add(
+        app.router.add_get(
+            "/api/v1/{patient}/records/export", export_shared_health_records
+        )
+    )
+    cors.add(
+        app.router.add_get(
+            "/api/v1/{patient}/records/aggregate", aggregate_shared_health_records
+        )
+    )
     cors.add(app.router.add_get("/auth/token", fetch_auth_token_handler))
+    app.router.add_get("/metrics", metrics_handler)
     # Metriport routes
     app.router.add_post("/metriport/webhook", metriport_events_handler),
+    app.router.add_get("/metriport/queue", metriport_queue_stats_handler)
     app.router.add_get("/metriport/connect-token", connect_token_handler)
     cors.add(app.router.add_get("/metriport/records", read_metriport_records))
     cors.add(
         app.router.add_get("/metriport/{patient}/records", share_metriport_records)
     )
+    cors.add(
+        app.router.add_get("/metriport/records/aggregate", aggregate_metriport_records)
+    )
+    cors.add(app.router.add_get("/metriport/records/changes", sync_metriport_records))
+    cors.add(app.router.add_get("/metriport/records/export", export_metriport_records))
+    cors.add(
+        app.router.add_get(
+            "/metriport/{patient}/records/export", export_shared_metriport_records
+        )
+    )
+    cors.add(
+        app.router.add_get(
+            "/metriport/{patient}/records/aggregate",
+            aggregate_shared_metriport_records,
+        )
+    )
+    cors.add(app.router.add_get("/metriport/sleep", read_metriport_sleep))
+    cors.add(app.router.add_get("/metriport/{patient}/sleep", share_metriport_sleep))
+    cors.add(app.router.add_get("/metriport/biometrics", read_metriport_biometrics))
+    cors.add(
+        app.router.add_get(
+            "/metriport/{patient}/biometrics", share_metriport_biometrics
+        )
+    )
+    cors.add(app.router.add_get("/metriport/body", read_metriport_body))
+    cors.add(app.router.add_get("/metriport/{patient}/body", share_metriport_body))
 
     api_spec = AiohttpApiSpec(
         app=app,
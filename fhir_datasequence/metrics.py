@@ -0,0 +1,218 @@
+"""Prometheus metrics of the service
+
+Metrics of the request path are module level and cost a dict lookup and a
+bucket increment per observation. Cache and queue metrics are collected
+from the application state when `/metrics` is scraped.
+
+With several gunicorn workers `PROMETHEUS_MULTIPROC_DIR` has to be set, the
+request path metrics of all workers are then summed from the files there.
+Pool and cache metrics still describe the worker serving the scrape.
+"""
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from types import SimpleNamespace
+
+from aiohttp import TraceConfig, TraceRequestEndParams, TraceRequestStartParams, web
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+
+from fhir_datasequence import config
+from fhir_datasequence.cache import TTLCache
+
+NAMESPACE = "datasequence"
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Request handling time per route",
+    ["method", "route", "status"],
+    namespace=NAMESPACE,
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds",
+    "Time spent in a stage of request handling",
+    ["stage"],
+    namespace=NAMESPACE,
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time per statement kind",
+    ["statement"],
+    namespace=NAMESPACE,
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a database connection from the pool",
+    namespace=NAMESPACE,
+)
+UPSTREAM_REQUEST_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "Latency of requests to upstream services",
+    ["upstream", "method", "status"],
+    namespace=NAMESPACE,
+)
+RECORDS_INGESTED = Counter(
+    "records_ingested",
+    "Records written to the database per table",
+    ["table"],
+    namespace=NAMESPACE,
+)
+
+
+def stage(name: str) -> Histogram:
+    return STAGE_DURATION.labels(name)
+
+
+@web.middleware
+async def metrics_middleware(
+    request: web.Request,
+    handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        HTTP_REQUEST_DURATION.labels(
+            request.method,
+            resource.canonical if resource is not None else "unmatched",
+            status,
+        ).observe(time.perf_counter() - started)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Connection pool measuring how long checkouts wait for a connection"""
+
+    def _do_get(self: "InstrumentedPool") -> ConnectionPoolEntry:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_query_timer(
+        conn: object,
+        cursor: object,
+        statement: str,
+        parameters: object,
+        context: SimpleNamespace,
+        executemany: bool,
+    ):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def stop_query_timer(
+        conn: object,
+        cursor: object,
+        statement: str,
+        parameters: object,
+        context: SimpleNamespace,
+        executemany: bool,
+    ):
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        DB_QUERY_DURATION.labels(kind).observe(
+            time.perf_counter() - context.query_started
+        )
+
+
+def upstream_trace_config(upstream: str) -> TraceConfig:
+    async def on_request_start(
+        session: object, context: SimpleNamespace, params: TraceRequestStartParams
+    ):
+        context.started = time.perf_counter()
+
+    async def on_request_end(
+        session: object, context: SimpleNamespace, params: TraceRequestEndParams
+    ):
+        UPSTREAM_REQUEST_DURATION.labels(
+            upstream, params.method, params.response.status
+        ).observe(time.perf_counter() - context.started)
+
+    trace_config = TraceConfig()
+    # NOTE: aiohttp annotates trace signals with the callback protocol itself
+    trace_config.on_request_start.append(on_request_start)  # type: ignore[arg-type]
+    trace_config.on_request_end.append(on_request_end)  # type: ignore[arg-type]
+    return trace_config
+
+
+class ApplicationCollector(Collector):
+    """Collect metrics of the application state at scrape time"""
+
+    def __init__(self: "ApplicationCollector", app: web.Application) -> None:
+        self.app = app
+        self.queue_stats: dict | None = None
+        self.queue_stats_read_at = float("-inf")
+
+    def collect(self: "ApplicationCollector") -> Iterator[Metric]:
+        pool = self.app["dbapi_engine"].pool
+        checked_out = GaugeMetricFamily(
+            f"{NAMESPACE}_db_pool_checked_out",
+            "Database connections currently in use",
+        )
+        checked_out.add_metric([], pool.checkedout())
+        yield checked_out
+        utilization = GaugeMetricFamily(
+            f"{NAMESPACE}_db_pool_utilization",
+            "Share of the pool size, without overflow, currently in use",
+        )
+        utilization.add_metric([], pool.checkedout() / pool.size())
+        yield utilization
+
+        hits = CounterMetricFamily(
+            f"{NAMESPACE}_cache_hits", "Cache lookups served", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            f"{NAMESPACE}_cache_misses", "Cache lookups missed", labels=["cache"]
+        )
+        size = GaugeMetricFamily(
+            f"{NAMESPACE}_cache_size", "Cache entries", labels=["cache"]
+        )
+        for name, value in self.app.items():
+            if isinstance(value, TTLCache):
+                hits.add_metric([str(name)], value.hits)
+                misses.add_metric([str(name)], value.misses)
+                size.add_metric([str(name)], len(value))
+        yield from (hits, misses, size)
+
+        if self.queue_stats is not None:
+            for name, description in (
+                ("depth", "Metriport webhook jobs waiting to be processed"),
+                ("failed", "Metriport webhook jobs that exhausted their attempts"),
+                ("lag", "Age in seconds of the oldest pending Metriport webhook job"),
+            ):
+                gauge = GaugeMetricFamily(
+                    f"{NAMESPACE}_metriport_queue_{name}", description
+                )
+                gauge.add_metric([], self.queue_stats[name])
+                yield gauge
+
+
+def process_registry() -> CollectorRegistry:
+    if not config.PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, path=config.PROMETHEUS_MULTIPROC_DIR)
+    return registry
+
+
+def attach_collector(app: web.Application):
+    registry = CollectorRegistry(auto_describe=False)
+    collector = ApplicationCollector(app)
+    registry.register(collector)
+    app["metrics_registry"] = registry
+    app["metrics_collector"] = collector
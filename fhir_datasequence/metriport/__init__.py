@@ -1,2 +1,7 @@
 METRIPORT_RECORDS_TABLE_NAME = "metriport_records"
+METRIPORT_SLEEP_TABLE_NAME = "metriport_sleep"
+METRIPORT_BIOMETRICS_TABLE_NAME = "metriport_biometrics"
+METRIPORT_BODY_TABLE_NAME = "metriport_body"
 METRIPORT_UNHANDLED_RECORDS_TABLE_NAME = "metriport_unhandled_data"
+METRIPORT_WEBHOOK_JOBS_TABLE_NAME = "metriport_webhook_jobs"
+METRIPORT_IDENTITIES_TABLE_NAME = "metriport_identities"
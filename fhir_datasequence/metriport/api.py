@@ -1,20 +1,67 @@
+import functools
+from collections.abc import Callable
+from typing import cast
+
 from aiohttp import web
-from fhirpy import AsyncFHIRClient  # type: ignore
+from aiohttp_apispec import querystring_schema  # type: ignore
 from fhirpy.base.exceptions import OperationOutcome  # type: ignore
+from sqlalchemy import Row
 
 from fhir_datasequence import config
+from fhir_datasequence.api.codec import json_response
+from fhir_datasequence.api.conditional import respond_with_records
+from fhir_datasequence.api.export import ExportQuerySchema, export_records
+from fhir_datasequence.api.query import (
+    AggregateQuerySchema,
+    ChangesQuerySchema,
+    RecordsQuerySchema,
+    SamplesQuerySchema,
+)
 from fhir_datasequence.auth import UserInfo, openid_userinfo
 from fhir_datasequence.auth.fhir import get_fhir_patient_by_identifier, requires_consent
+from fhir_datasequence.cache import TTLCache
+from fhir_datasequence.emr import fhir_client
+from fhir_datasequence.metriport import (
+    METRIPORT_BIOMETRICS_TABLE_NAME,
+    METRIPORT_BODY_TABLE_NAME,
+    METRIPORT_RECORDS_TABLE_NAME,
+    METRIPORT_SLEEP_TABLE_NAME,
+)
 from fhir_datasequence.metriport.client import get_connect_token, get_user
-from fhir_datasequence.metriport.db import read_records
+from fhir_datasequence.metriport.db import (
+    parse_row,
+    parse_sample_row,
+    parse_sleep_row,
+    read_aggregates,
+    read_changes,
+)
+from fhir_datasequence.metriport.identity import (
+    APPLE_SUBJECT,
+    FHIR_PATIENT,
+    resolve_metriport_user_id,
+)
 
 
 @openid_userinfo(required=True)
 async def connect_token_handler(request: web.Request, userinfo: UserInfo):
-    session = request.app["metriport_client"]
-    metriport_user_id = await get_user(session, userinfo.id)
+    client = request.app["metriport_client"]
+    # NOTE: the appUserId to userId mapping of Metriport never changes
+    metriport_user_id = cast(
+        str,
+        await resolve_metriport_user_id(
+            request.app,
+            APPLE_SUBJECT,
+            userinfo.id,
+            functools.partial(get_user, client, userinfo.id),
+        ),
+    )
 
-    token_data, response_status = await get_connect_token(session, metriport_user_id)
+    connect_tokens: TTLCache = request.app["metriport_connect_token_cache"]
+    cached = cast(tuple[dict, int] | None, connect_tokens.get(metriport_user_id))
+    if cached is None:
+        cached = await get_connect_token(client, metriport_user_id)
+        connect_tokens.set(metriport_user_id, cached)
+    token_data, response_status = cached
 
     return web.json_response(
         {**token_data, "metriportUserId": metriport_user_id}, status=response_status
@@ -34,56 +81,211 @@ def get_metriport_user_id(patient: dict):
     return metriport_user_id
 
 
+async def respond_with_metriport_records(
+    request: web.Request,
+    metriport_user_id: str,
+    table_name: str = METRIPORT_RECORDS_TABLE_NAME,
+    parse_row: Callable[[Row], dict] = parse_row,
+):
+    return await respond_with_records(
+        request,
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"][table_name],
+        metriport_user_id,
+        parse_row,
+    )
+
+
+async def export_metriport_user_records(request: web.Request, metriport_user_id: str):
+    return await export_records(
+        request,
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"][METRIPORT_RECORDS_TABLE_NAME],
+        metriport_user_id,
+    )
+
+
+async def find_own_metriport_user_id(request: web.Request, userinfo: UserInfo):
+    async def lookup():
+        fhir_api_client = fhir_client(request.app, request["headers"]["Authorization"])
+        patient = await get_fhir_patient_by_identifier(
+            fhir_api_client,
+            identifier_system=config.APPLE_IDENTIFIER_SYSTEM_URL,
+            identifier_value=userinfo.id,
+        )
+        return get_metriport_user_id(patient)
+
+    return await resolve_metriport_user_id(
+        request.app, APPLE_SUBJECT, userinfo.id, lookup
+    )
+
+
+async def find_shared_metriport_user_id(request: web.Request):
+    # NOTE: access to the patient is verified by requires_consent beforehand
+    async def lookup():
+        fhir_api_client = fhir_client(request.app, request["headers"]["Authorization"])
+        patient = await fhir_api_client.reference(
+            "Patient", request.match_info["patient"]
+        ).to_resource()
+        return get_metriport_user_id(patient)
+
+    return await resolve_metriport_user_id(
+        request.app, FHIR_PATIENT, str(request.match_info["patient"]), lookup
+    )
+
+
+def missing_metriport_user_id_response():
+    operation_outcome = OperationOutcome(
+        reason="Metriport identifier does not specified for the patient"
+    )
+    return web.json_response(
+        operation_outcome.resource,
+        status=422,
+    )
+
+
+@querystring_schema(RecordsQuerySchema())
 @openid_userinfo(required=True)
 async def read_metriport_records(request: web.Request, userinfo: UserInfo):
-    fhir_api_client = AsyncFHIRClient(
-        config.EMR_FHIR_URL, authorization=request["headers"]["Authorization"]
+    metriport_user_id = await find_own_metriport_user_id(request, userinfo)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(request, metriport_user_id)
+
+
+@querystring_schema(RecordsQuerySchema())
+@requires_consent()
+async def share_metriport_records(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_shared_metriport_user_id(request)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(request, metriport_user_id)
+
+
+@querystring_schema(ExportQuerySchema())
+@openid_userinfo(required=True)
+async def export_metriport_records(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_own_metriport_user_id(request, userinfo)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await export_metriport_user_records(request, metriport_user_id)
+
+
+@querystring_schema(ExportQuerySchema())
+@requires_consent()
+async def export_shared_metriport_records(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_shared_metriport_user_id(request)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await export_metriport_user_records(request, metriport_user_id)
+
+
+@querystring_schema(ChangesQuerySchema())
+@openid_userinfo(required=True)
+async def sync_metriport_records(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_own_metriport_user_id(request, userinfo)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    changes = await read_changes(
+        metriport_user_id,
+        request["querystring"],
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"],
     )
-    patient = await get_fhir_patient_by_identifier(
-        fhir_api_client,
-        identifier_system=config.APPLE_IDENTIFIER_SYSTEM_URL,
-        identifier_value=userinfo.id,
+    return json_response(changes)
+
+
+@querystring_schema(AggregateQuerySchema())
+@openid_userinfo(required=True)
+async def aggregate_metriport_records(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_own_metriport_user_id(request, userinfo)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    aggregates = await read_aggregates(
+        metriport_user_id,
+        request["querystring"],
+        request.app["dbapi_engine"],
+        request.app["dbapi_schema"],
     )
+    return json_response(aggregates)
+
 
-    metriport_user_id = get_metriport_user_id(patient)
+@querystring_schema(AggregateQuerySchema())
+@requires_consent()
+async def aggregate_shared_metriport_records(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_shared_metriport_user_id(request)
     if not metriport_user_id:
-        operation_outcome = OperationOutcome(
-            reason="Metriport identifier does not specified for the patient"
-        )
-        return web.json_response(
-            operation_outcome.resource,
-            status=422,
-        )
-    records = await read_records(
+        return missing_metriport_user_id_response()
+    aggregates = await read_aggregates(
         metriport_user_id,
+        request["querystring"],
         request.app["dbapi_engine"],
-        request.app["dbapi_metadata"],
+        request.app["dbapi_schema"],
     )
+    return json_response(aggregates)
 
-    return web.json_response({"records": records})
+
+@querystring_schema(RecordsQuerySchema())
+@openid_userinfo(required=True)
+async def read_metriport_sleep(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_own_metriport_user_id(request, userinfo)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(
+        request, metriport_user_id, METRIPORT_SLEEP_TABLE_NAME, parse_sleep_row
+    )
 
 
+@querystring_schema(RecordsQuerySchema())
 @requires_consent()
-async def share_metriport_records(request: web.Request, userinfo: UserInfo):
-    fhir_api_client = AsyncFHIRClient(
-        config.EMR_FHIR_URL, authorization=request["headers"]["Authorization"]
+async def share_metriport_sleep(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_shared_metriport_user_id(request)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(
+        request, metriport_user_id, METRIPORT_SLEEP_TABLE_NAME, parse_sleep_row
     )
-    patient = await fhir_api_client.reference(
-        "Patient", request.match_info["patient"]
-    ).to_resource()
-    metriport_user_id = get_metriport_user_id(patient)
+
+
+@querystring_schema(SamplesQuerySchema())
+@openid_userinfo(required=True)
+async def read_metriport_biometrics(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_own_metriport_user_id(request, userinfo)
     if not metriport_user_id:
-        operation_outcome = OperationOutcome(
-            reason="Metriport identifier does not specified for the patient"
-        )
-        return web.json_response(
-            operation_outcome.resource,
-            status=422,
-        )
-    records = await read_records(
-        metriport_user_id,
-        request.app["dbapi_engine"],
-        request.app["dbapi_metadata"],
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(
+        request, metriport_user_id, METRIPORT_BIOMETRICS_TABLE_NAME, parse_sample_row
+    )
+
+
+@querystring_schema(SamplesQuerySchema())
+@requires_consent()
+async def share_metriport_biometrics(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_shared_metriport_user_id(request)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(
+        request, metriport_user_id, METRIPORT_BIOMETRICS_TABLE_NAME, parse_sample_row
+    )
+
+
+@querystring_schema(SamplesQuerySchema())
+@openid_userinfo(required=True)
+async def read_metriport_body(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_own_metriport_user_id(request, userinfo)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(
+        request, metriport_user_id, METRIPORT_BODY_TABLE_NAME, parse_sample_row
     )
 
-    return web.json_response({"records": records})
+
+@querystring_schema(SamplesQuerySchema())
+@requires_consent()
+async def share_metriport_body(request: web.Request, userinfo: UserInfo):
+    metriport_user_id = await find_shared_metriport_user_id(request)
+    if not metriport_user_id:
+        return missing_metriport_user_id_response()
+    return await respond_with_metriport_records(
+        request, metriport_user_id, METRIPORT_BODY_TABLE_NAME, parse_sample_row
+    )
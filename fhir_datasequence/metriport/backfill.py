@@ -0,0 +1,168 @@
+"""Move sleep, biometrics and body entries out of the unhandled data
+
+    python -m fhir_datasequence.metriport.backfill [--window-hours 24] [--dry-run]
+
+Unhandled rows are processed in time windows, each one in its own
+transaction: the rows are deleted, their entries are written to the typed
+hypertables and whatever can not be parsed is kept as unhandled data. An
+interrupted backfill is resumed by running it again, since rows of the
+committed windows are gone and typed rows are upserted by their sid.
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import sys
+from collections import defaultdict
+
+from sqlalchemy import Table, func, insert, select
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from fhir_datasequence.db import (
+    RECORDS_WATERMARKS_TABLE_NAME,
+    SchemaRegistry,
+    create_engine,
+)
+from fhir_datasequence.metriport import METRIPORT_UNHANDLED_RECORDS_TABLE_NAME
+from fhir_datasequence.metriport.db import upsert_series_records
+from fhir_datasequence.metriport.parsers import SERIES_EVENTS, parse_series_event
+
+
+def split_unhandled_row(uid: str, data: dict) -> tuple[dict[str, list[dict]], dict]:
+    """Parse the series entries of a row into typed rows by table name
+
+    The data left unparsed is returned with the other keys of the row.
+    """
+    records: dict[str, list[dict]] = defaultdict(list)
+    remaining: dict = {}
+    for key, value in data.items():
+        if key not in SERIES_EVENTS:
+            remaining[key] = value
+            continue
+        parsed, unparsed = parse_series_event(key, uid, value)
+        records[SERIES_EVENTS[key][0]].extend(parsed)
+        if unparsed:
+            remaining[key] = unparsed
+    return records, remaining
+
+
+def has_entries(data: dict) -> bool:
+    return any(key != "userId" for key in data)
+
+
+async def read_series_range(
+    connection: AsyncConnection, table: Table
+) -> tuple[datetime.datetime | None, datetime.datetime | None]:
+    row = (
+        await connection.execute(
+            select(func.min(table.c.ts), func.max(table.c.ts)).where(
+                table.c.data.has_any(array(list(SERIES_EVENTS)))
+            )
+        )
+    ).one()
+    return row[0], row[1]
+
+
+async def backfill_window(
+    connection: AsyncConnection,
+    schema: SchemaRegistry,
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> tuple[int, dict[str, int], int]:
+    table = schema[METRIPORT_UNHANDLED_RECORDS_TABLE_NAME]
+    rows = (
+        await connection.execute(
+            table.delete()
+            .where(
+                table.c.ts >= start,
+                table.c.ts < end,
+                table.c.data.has_any(array(list(SERIES_EVENTS))),
+            )
+            .returning(table.c.ts, table.c.uid, table.c.data)
+        )
+    ).all()
+    records: dict[str, list[dict]] = defaultdict(list)
+    kept = []
+    for row in rows:
+        row_records, remaining = split_unhandled_row(row.uid, row.data)
+        for table_name, table_records in row_records.items():
+            records[table_name].extend(table_records)
+        if has_entries(remaining):
+            kept.append({"ts": row.ts, "uid": row.uid, "data": remaining})
+    for table_name, table_records in records.items():
+        if table_records:
+            await upsert_series_records(connection, schema, table_name, table_records)
+    if kept:
+        await connection.execute(insert(table), kept)
+    return (
+        len(rows),
+        {
+            table_name: len(table_records)
+            for table_name, table_records in records.items()
+        },
+        len(kept),
+    )
+
+
+async def run(options: argparse.Namespace):
+    engine = create_engine()
+    schema = SchemaRegistry(
+        [
+            METRIPORT_UNHANDLED_RECORDS_TABLE_NAME,
+            *(table_name for table_name, _parse_entry in SERIES_EVENTS.values()),
+            RECORDS_WATERMARKS_TABLE_NAME,
+        ]
+    )
+    window = datetime.timedelta(hours=options.window_hours)
+    try:
+        await schema.refresh(engine)
+        table = schema[METRIPORT_UNHANDLED_RECORDS_TABLE_NAME]
+        async with engine.connect() as connection:
+            first_ts, last_ts = await read_series_range(connection, table)
+        if first_ts is None or last_ts is None:
+            logging.info("There is no unhandled data to backfill")
+            return
+        start = first_ts
+        while start <= last_ts:
+            end = start + window
+            async with engine.connect() as connection, connection.begin() as tx:
+                moved, written, kept = await backfill_window(
+                    connection, schema, start, end
+                )
+                if options.dry_run:
+                    await tx.rollback()
+            logging.info(
+                "%s .. %s: %s unhandled rows, %s typed rows written, %s rows kept",
+                start.isoformat(),
+                end.isoformat(),
+                moved,
+                written,
+                kept,
+            )
+            start = end
+    finally:
+        await engine.dispose()
+
+
+def parse_options(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m fhir_datasequence.metriport.backfill"
+    )
+    parser.add_argument(
+        "--window-hours",
+        type=int,
+        default=24,
+        help="Width of the time window moved in one transaction",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Parse and report every window without committing it",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(parse_options(sys.argv[1:])))
@@ -1,13 +1,25 @@
+import asyncio
 import functools
 import logging
+import random
+import time
 from collections.abc import Callable, Coroutine
 from typing import Any
 
-from aiohttp import ClientResponse, ClientSession, web
+from aiohttp import (
+    ClientError,
+    ClientResponse,
+    ClientSession,
+    ClientTimeout,
+    hdrs,
+    web,
+)
 from aiohttp_apispec import headers_schema  # type: ignore
 from marshmallow import Schema, fields
 
 from fhir_datasequence import config
+from fhir_datasequence.cache import SingleFlight, TTLCache
+from fhir_datasequence.metrics import upstream_trace_config
 
 WEBHOOK_KEY_HEADER = "x-webhook-key"
 
@@ -16,16 +28,105 @@ WebhookAuthorizationSchema = Schema.from_dict(
 )
 
 
+# NOTE: other client errors are answered the same way on a retry
+RETRIABLE_STATUSES = frozenset({408, 429})
+
+
 async def attach(app: web.Application):
     session = ClientSession(
         config.METRIPORT_API_BASE_URL,
         headers={config.METRIPORT_API_KEY_REQUEST_HEADER: config.METRIPORT_API_SECRET},
+        timeout=ClientTimeout(total=config.METRIPORT_API_TIMEOUT),
+        trace_configs=[upstream_trace_config("metriport")],
     )
-    app["metriport_client"] = session
+    app["metriport_client"] = MetriportClient(session)
 
     yield
 
-    await app["metriport_client"].close()
+    await session.close()
+
+
+def create_connect_token_cache() -> TTLCache:
+    return TTLCache(
+        maxsize=config.METRIPORT_CONNECT_TOKEN_CACHE_SIZE,
+        ttl=config.METRIPORT_CONNECT_TOKEN_TTL,
+    )
+
+
+class CircuitBreaker:
+    """Fail fast once `failures` calls in a row have failed
+
+    After `reset_timeout` a single trial call is let through, its success
+    closes the circuit and its failure keeps it open for another period.
+    """
+
+    def __init__(self: "CircuitBreaker", failures: int, reset_timeout: float) -> None:
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def is_open(self: "CircuitBreaker") -> bool:
+        return self.opened_at is not None
+
+    def allow(self: "CircuitBreaker") -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.opened_at = time.monotonic()
+        return True
+
+    def record_success(self: "CircuitBreaker") -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self: "CircuitBreaker") -> None:
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failures:
+            self.opened_at = time.monotonic()
+
+
+class MetriportClient:
+    """Metriport API session with retries, a circuit breaker and coalescing"""
+
+    def __init__(self: "MetriportClient", session: ClientSession) -> None:
+        self.session = session
+        self.circuit = CircuitBreaker(
+            config.METRIPORT_CIRCUIT_FAILURES, config.METRIPORT_CIRCUIT_RESET_TIMEOUT
+        )
+        self.flights = SingleFlight()
+
+    async def request(
+        self: "MetriportClient", method: str, path: str, params: dict[str, str]
+    ) -> tuple[dict, int]:
+        for attempt in range(config.METRIPORT_API_RETRIES + 1):
+            if attempt:
+                # NOTE: full jitter keeps retries of many callers apart
+                await asyncio.sleep(
+                    random.uniform(0, config.METRIPORT_API_RETRY_BACKOFF * 2**attempt)
+                )
+            if not self.circuit.allow():
+                raise web.HTTPServiceUnavailable(
+                    text="Metriport API is unavailable",
+                    headers={hdrs.RETRY_AFTER: str(round(self.circuit.reset_timeout))},
+                )
+            try:
+                async with self.session.request(method, path, params=params) as resp:
+                    if resp.status < 500 and resp.status not in RETRIABLE_STATUSES:
+                        self.circuit.record_success()
+                        return await handle_response(resp)
+                    failure: Exception = upstream_error(resp, await resp.text())
+            except (ClientError, asyncio.TimeoutError) as exc:
+                failure = web.HTTPBadGateway(
+                    text=f"Metriport API request failed: {exc}"
+                )
+            logging.warning(
+                "Metriport API %s %s has failed, attempt %s", method, path, attempt + 1
+            )
+            self.circuit.record_failure()
+        raise failure
 
 
 def authorize_webhook(
@@ -47,20 +148,41 @@ def authorize_webhook(
     return verify_auth_key
 
 
-async def get_user(session: ClientSession, app_user_id: str):
-    async with session.post("/user", params={"appUserId": app_user_id}) as resp:
-        data, _status = await handle_response(resp)
-        return data["userId"]
+async def get_user(client: MetriportClient, app_user_id: str) -> str:
+    # NOTE: Metriport returns the existing user for a known appUserId
+    data, _status = await client.flights.run(
+        ("user", app_user_id),
+        functools.partial(client.request, "POST", "/user", {"appUserId": app_user_id}),
+    )
+    return data["userId"]
+
+
+async def get_connect_token(client: MetriportClient, user_id: str):
+    return await client.flights.run(
+        ("connect_token", user_id),
+        functools.partial(
+            client.request, "GET", "/user/connect/token", {"userId": user_id}
+        ),
+    )
 
 
-async def get_connect_token(session: ClientSession, user_id: str):
-    async with session.get("/user/connect/token", params={"userId": user_id}) as resp:
-        return await handle_response(resp)
+def upstream_error(response: ClientResponse, text: str) -> web.HTTPException:
+    """HTTP error answering with the status of a failed Metriport API response"""
+    headers: dict[str, str] = {}
+    if hdrs.RETRY_AFTER in response.headers:
+        headers[hdrs.RETRY_AFTER] = response.headers[hdrs.RETRY_AFTER]
+    if 400 <= response.status < 500:
+        error: web.HTTPException = web.HTTPClientError(text=text, headers=headers)
+    elif response.status >= 500:
+        error = web.HTTPServerError(text=text, headers=headers)
+    else:
+        return web.HTTPBadGateway(text=text)
+    error.set_status(response.status)
+    return error
 
 
 async def handle_response(response: ClientResponse):
     if 200 <= response.status < 300:
         data = await response.json()
         return (data, response.status)
-    # NOTE: should we handle errors or aiohttp raises appropriate exception itself?
-    raise web.HTTPClientError(text=await response.text())
+    raise upstream_error(response, await response.text())
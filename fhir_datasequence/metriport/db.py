@@ -1,84 +1,343 @@
-import sqlalchemy
-from sqlalchemy import MetaData, Row, and_, insert, select, update
-from sqlalchemy.ext.asyncio import AsyncEngine
+import datetime
 
+from sqlalchemy import (
+    Row,
+    Table,
+    Update,
+    cast,
+    column,
+    delete,
+    func,
+    insert,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from fhir_datasequence import config
+from fhir_datasequence.api.query import (
+    fetch_aggregates,
+    fetch_changes,
+    select_aggregates,
+    select_changes,
+)
+from fhir_datasequence.db import (
+    RECORDS_WATERMARKS_TABLE_NAME,
+    SchemaRegistry,
+    current_xid,
+    touch_watermarks,
+)
+from fhir_datasequence.metrics import RECORDS_INGESTED
 from fhir_datasequence.metriport import (
+    METRIPORT_IDENTITIES_TABLE_NAME,
     METRIPORT_RECORDS_TABLE_NAME,
     METRIPORT_UNHANDLED_RECORDS_TABLE_NAME,
+    METRIPORT_WEBHOOK_JOBS_TABLE_NAME,
 )
 
 
-async def write_activity_record(
-    record: dict, dbapi_engine: AsyncEngine, metadata: MetaData
-):
-    async with dbapi_engine.begin() as connection:
-        table = await connection.run_sync(
-            lambda conn: sqlalchemy.Table(
-                METRIPORT_RECORDS_TABLE_NAME,
-                metadata,
-                autoload_with=conn,
-            )
+def activity_key(record: dict):
+    return (record["uid"], record["start"], record["provider"])
+
+
+def update_activity_records(table: Table, batch: list[dict]) -> Update:
+    """Update the stored activities of the batch matched by the activity key"""
+    columns = [c for c in table.columns if c.name != "ingested_xid"]
+    incoming = values(*[column(c.name, c.type) for c in columns], name="incoming").data(
+        [tuple(record.get(c.name) for c in columns) for record in batch]
+    )
+    # NOTE: VALUES columns are typed by their rows, a column of NULLs only would
+    # be typed as text, so every incoming column is cast to the table type
+    typed = {c.name: cast(incoming.c[c.name], c.type) for c in columns}
+    return (
+        update(table)
+        .where(
+            table.c.uid == typed["uid"],
+            table.c.start == typed["start"],
+            table.c.provider == typed["provider"],
         )
-        exists_record = (
-            await connection.execute(
-                select(table).where(
-                    and_(
-                        table.c.uid == record["uid"],
-                        table.c.start == record["start"],
-                        table.c.provider == record["provider"],
-                    )
-                )
-            )
-        ).first()
+        # NOTE: an updated activity is synced again as a change
+        .values({**typed, "ingested_xid": current_xid()})
+        .returning(table.c.uid, table.c.start, table.c.provider)
+    )
+
 
-        if exists_record:
+async def write_activity_records(
+    records: list[dict], dbapi_engine: AsyncEngine, schema: SchemaRegistry
+):
+    """Upsert activity records by their (uid, start, provider) key
+
+    TimescaleDB unique indexes have to include the `ts` partitioning column,
+    so ON CONFLICT can not target the activity key. Instead every batch is
+    matched with one UPDATE ... FROM (VALUES ...) and the rest is inserted
+    with one multi-row INSERT, under per-user advisory locks.
+    """
+    table = schema[METRIPORT_RECORDS_TABLE_NAME]
+    # NOTE: the latest activity in the payload wins for the same key
+    records = list({activity_key(record): record for record in records}.values())
+    async with dbapi_engine.begin() as connection:
+        for uid in sorted({record["uid"] for record in records}):
             await connection.execute(
-                update(table).where(table.c.ts == exists_record.ts).values(**record)
+                select(func.pg_advisory_xact_lock(func.hashtext(uid)))
             )
-        else:
-            await connection.execute(insert(table), record)
+        for offset in range(0, len(records), config.METRIPORT_UPSERT_BATCH_SIZE):
+            batch = records[offset : offset + config.METRIPORT_UPSERT_BATCH_SIZE]
+            updated = await connection.execute(update_activity_records(table, batch))
+            updated_keys = {tuple(row) for row in updated}
+            inserted = [
+                record for record in batch if activity_key(record) not in updated_keys
+            ]
+            if inserted:
+                await connection.execute(insert(table), inserted)
+        await touch_watermarks(
+            connection,
+            schema[RECORDS_WATERMARKS_TABLE_NAME],
+            METRIPORT_RECORDS_TABLE_NAME,
+            [record["uid"] for record in records],
+        )
+    RECORDS_INGESTED.labels(METRIPORT_RECORDS_TABLE_NAME).inc(len(records))
 
 
 def parse_row(row: Row):
     return {
         "uid": row.uid,
         "sid": row.sid,
-        "ts": row.ts.isoformat(),
+        "ts": row.ts,
         "code": row.code,
         "duration": row.duration,
         "energy": row.energy,
-        "start": row.start.isoformat(),
-        "finish": row.finish.isoformat(),
+        "start": row.start,
+        "finish": row.finish,
         "provider": row.provider,
     }
 
 
+def parse_sleep_row(row: Row):
+    return {
+        "uid": row.uid,
+        "sid": row.sid,
+        "ts": row.ts,
+        "start": row.start,
+        "finish": row.finish,
+        "duration": row.duration,
+        "in_bed": row.in_bed,
+        "awake": row.awake,
+        "light": row.light,
+        "deep": row.deep,
+        "rem": row.rem,
+        "provider": row.provider,
+    }
+
+
+def parse_sample_row(row: Row):
+    return {
+        "uid": row.uid,
+        "sid": row.sid,
+        "ts": row.ts,
+        "code": row.code,
+        "value": row.value,
+        "unit": row.unit,
+        "provider": row.provider,
+    }
+
+
+async def upsert_series_records(
+    connection: AsyncConnection,
+    schema: SchemaRegistry,
+    table_name: str,
+    records: list[dict],
+):
+    """Upsert typed series records by their (ts, uid, sid) key in batches"""
+    table = schema[table_name]
+    # NOTE: a statement can not update the same row twice, the latest one wins
+    records = list(
+        {
+            (record["ts"], record["uid"], record["sid"]): record for record in records
+        }.values()
+    )
+    statement = pg_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.ts, table.c.uid, table.c.sid],
+        set_={c.name: statement.excluded[c.name] for c in table.columns},
+    )
+    for offset in range(0, len(records), config.METRIPORT_UPSERT_BATCH_SIZE):
+        await connection.execute(
+            statement, records[offset : offset + config.METRIPORT_UPSERT_BATCH_SIZE]
+        )
+    await touch_watermarks(
+        connection,
+        schema[RECORDS_WATERMARKS_TABLE_NAME],
+        table_name,
+        [record["uid"] for record in records],
+    )
+    RECORDS_INGESTED.labels(table.name).inc(len(records))
+
+
+async def write_series_records(
+    table_name: str,
+    records: list[dict],
+    dbapi_engine: AsyncEngine,
+    schema: SchemaRegistry,
+):
+    async with dbapi_engine.begin() as connection:
+        await upsert_series_records(connection, schema, table_name, records)
+
+
 async def write_unhandled_data(
-    record: dict, dbapi_engine: AsyncEngine, metadata: MetaData
+    record: dict, dbapi_engine: AsyncEngine, schema: SchemaRegistry
+):
+    table = schema[METRIPORT_UNHANDLED_RECORDS_TABLE_NAME]
+    async with dbapi_engine.begin() as connection:
+        await connection.execute(insert(table), record)
+
+
+async def read_changes(
+    user_id: str, query: dict, dbapi_engine: AsyncEngine, schema: SchemaRegistry
 ):
     async with dbapi_engine.begin() as connection:
-        table = await connection.run_sync(
-            lambda conn: sqlalchemy.Table(
-                METRIPORT_UNHANDLED_RECORDS_TABLE_NAME,
-                metadata,
-                autoload_with=conn,
+        return await fetch_changes(
+            connection,
+            select_changes(schema[METRIPORT_RECORDS_TABLE_NAME], user_id, query),
+            query,
+            parse_row,
+        )
+
+
+async def read_aggregates(
+    user_id: str, query: dict, dbapi_engine: AsyncEngine, schema: SchemaRegistry
+):
+    async with dbapi_engine.begin() as connection:
+        return await fetch_aggregates(
+            connection,
+            select_aggregates(schema, METRIPORT_RECORDS_TABLE_NAME, user_id, query),
+        )
+
+
+async def read_metriport_user_id(
+    kind: str, value: str, dbapi_engine: AsyncEngine, schema: SchemaRegistry
+) -> str | None:
+    table = schema[METRIPORT_IDENTITIES_TABLE_NAME]
+    async with dbapi_engine.begin() as connection:
+        return await connection.scalar(
+            select(table.c.metriport_user_id).where(
+                table.c.kind == kind, table.c.value == value
             )
         )
-        await connection.execute(insert(table), record)
 
 
-async def read_records(user_id: str, dbapi_engine: AsyncEngine, metadata: MetaData):
+async def write_metriport_user_ids(
+    identities: list[dict], dbapi_engine: AsyncEngine, schema: SchemaRegistry
+):
+    """Upsert `kind`, `value` and `metriport_user_id` identity mappings"""
+    table = schema[METRIPORT_IDENTITIES_TABLE_NAME]
+    statement = pg_insert(table)
     async with dbapi_engine.begin() as connection:
-        table = await connection.run_sync(
-            lambda conn: sqlalchemy.Table(
-                METRIPORT_RECORDS_TABLE_NAME,
-                metadata,
-                autoload_with=conn,
+        await connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[table.c.kind, table.c.value],
+                set_={
+                    "metriport_user_id": statement.excluded.metriport_user_id,
+                    "updated_at": func.now(),
+                },
+                where=table.c.metriport_user_id != statement.excluded.metriport_user_id,
+            ),
+            identities,
+        )
+
+
+async def enqueue_webhook_job(
+    payload: dict, dbapi_engine: AsyncEngine, schema: SchemaRegistry
+):
+    table = schema[METRIPORT_WEBHOOK_JOBS_TABLE_NAME]
+    async with dbapi_engine.begin() as connection:
+        await connection.execute(insert(table).values(payload=payload))
+
+
+async def claim_webhook_job(dbapi_engine: AsyncEngine, schema: SchemaRegistry):
+    """Lease the oldest due job
+
+    The job becomes due again when the lease expires, so a job of a crashed
+    or cancelled worker is picked up by another one (at-least-once delivery).
+    """
+    table = schema[METRIPORT_WEBHOOK_JOBS_TABLE_NAME]
+    due_job_id = (
+        select(table.c.id)
+        .where(table.c.failed_at.is_(None), table.c.run_at <= func.now())
+        .order_by(table.c.run_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    async with dbapi_engine.begin() as connection:
+        return (
+            await connection.execute(
+                update(table)
+                .where(table.c.id == due_job_id)
+                .values(
+                    attempts=table.c.attempts + 1,
+                    run_at=func.now()
+                    + datetime.timedelta(seconds=config.METRIPORT_QUEUE_LEASE),
+                )
+                .returning(
+                    table.c.id, table.c.payload, table.c.attempts, table.c.created_at
+                )
             )
+        ).first()
+
+
+async def complete_webhook_job(
+    job_id: int, dbapi_engine: AsyncEngine, schema: SchemaRegistry
+):
+    table = schema[METRIPORT_WEBHOOK_JOBS_TABLE_NAME]
+    async with dbapi_engine.begin() as connection:
+        await connection.execute(delete(table).where(table.c.id == job_id))
+
+
+async def retry_webhook_job(
+    job_id: int,
+    delay: datetime.timedelta | None,
+    error: str,
+    dbapi_engine: AsyncEngine,
+    schema: SchemaRegistry,
+    payload: dict | None = None,
+):
+    """Schedule the job again after the delay or give up on it without one"""
+    table = schema[METRIPORT_WEBHOOK_JOBS_TABLE_NAME]
+    schedule: dict[str, object] = (
+        {"run_at": func.now() + delay}
+        if delay is not None
+        else {"failed_at": func.now()}
+    )
+    if payload is not None:
+        schedule["payload"] = payload
+    async with dbapi_engine.begin() as connection:
+        await connection.execute(
+            update(table)
+            .where(table.c.id == job_id)
+            .values(last_error=error, **schedule)
         )
-        return [
-            parse_row(row)
-            for row in await connection.execute(
-                select(table).where(table.c.uid == user_id).order_by(table.c.ts.desc())
+
+
+async def read_webhook_queue_stats(dbapi_engine: AsyncEngine, schema: SchemaRegistry):
+    table = schema[METRIPORT_WEBHOOK_JOBS_TABLE_NAME]
+    pending = table.c.failed_at.is_(None)
+    async with dbapi_engine.begin() as connection:
+        stats = (
+            await connection.execute(
+                select(
+                    func.count().filter(pending).label("depth"),
+                    func.count().filter(~pending).label("failed"),
+                    func.extract(
+                        "epoch",
+                        func.now() - func.min(table.c.created_at).filter(pending),
+                    ).label("lag"),
+                )
             )
-        ]
+        ).one()
+    return {
+        "depth": stats.depth,
+        "failed": stats.failed,
+        "lag": float(stats.lag) if stats.lag is not None else 0.0,
+    }
@@ -0,0 +1,75 @@
+"""Local mapping of Apple subjects and FHIR patients to Metriport user ids
+
+Mappings are remembered when a connect token is issued, when a webhook
+entry names its app user and after every FHIR lookup, so that reads resolve
+the Metriport user id from memory or with one primary key lookup.
+"""
+import logging
+from collections.abc import Awaitable, Callable
+from typing import cast
+
+from aiohttp import web
+from sqlalchemy.exc import SQLAlchemyError
+
+from fhir_datasequence import config
+from fhir_datasequence.cache import TTLCache
+from fhir_datasequence.metriport.db import (
+    read_metriport_user_id,
+    write_metriport_user_ids,
+)
+
+APPLE_SUBJECT = "apple"
+FHIR_PATIENT = "patient"
+
+
+def create_identity_cache() -> TTLCache:
+    return TTLCache(
+        maxsize=config.METRIPORT_IDENTITY_CACHE_SIZE,
+        ttl=config.METRIPORT_IDENTITY_CACHE_TTL,
+    )
+
+
+async def resolve_metriport_user_id(
+    app: web.Application,
+    kind: str,
+    value: str,
+    lookup: Callable[[], Awaitable[str | None]],
+) -> str | None:
+    """Resolve from the cache, then the identities table, then `lookup`"""
+    cache: TTLCache = app["metriport_identity_cache"]
+    metriport_user_id = cast(str | None, cache.get((kind, value)))
+    if metriport_user_id is not None:
+        return metriport_user_id
+    metriport_user_id = await read_metriport_user_id(
+        kind, value, app["dbapi_engine"], app["dbapi_schema"]
+    )
+    if metriport_user_id is not None:
+        cache.set((kind, value), metriport_user_id)
+        return metriport_user_id
+    metriport_user_id = await lookup()
+    if metriport_user_id is not None:
+        await remember_metriport_user_ids(app, [(kind, value, metriport_user_id)])
+    return metriport_user_id
+
+
+async def remember_metriport_user_ids(
+    app: web.Application, identities: list[tuple[str, str, str]]
+):
+    cache: TTLCache = app["metriport_identity_cache"]
+    changed = [
+        {"kind": kind, "value": value, "metriport_user_id": metriport_user_id}
+        for kind, value, metriport_user_id in identities
+        if cache.get((kind, value)) != metriport_user_id
+    ]
+    if not changed:
+        return
+    try:
+        await write_metriport_user_ids(
+            changed, app["dbapi_engine"], app["dbapi_schema"]
+        )
+    except SQLAlchemyError:
+        # NOTE: the mapping is an optimization, FHIR stays the source of truth
+        logging.exception("Metriport identities can not be stored")
+        return
+    for identity in changed:
+        cache.set((identity["kind"], identity["value"]), identity["metriport_user_id"])
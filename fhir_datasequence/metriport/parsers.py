@@ -0,0 +1,179 @@
+"""Typed rows of Metriport sleep, biometrics and body webhook entries
+
+Every row gets a `sid` derived from its key, so that webhook redeliveries
+and backfills of the same entry update the rows written before instead of
+duplicating them.
+"""
+import datetime
+import uuid
+from collections.abc import Callable
+
+from fhir_datasequence.metriport import (
+    METRIPORT_BIOMETRICS_TABLE_NAME,
+    METRIPORT_BODY_TABLE_NAME,
+    METRIPORT_SLEEP_TABLE_NAME,
+)
+
+SID_NAMESPACE = uuid.UUID("6a1f4f43-7f0e-4c52-9a7b-2e8d7c3b9d10")
+
+Series = list[tuple[str, str, tuple[str, ...]]]
+
+# Code, unit and path of the samples list of an entry
+BIOMETRIC_SAMPLES: Series = [
+    ("heart_rate", "bpm", ("heart_rate", "samples_bpm")),
+    ("hrv_rmssd", "ms", ("hrv", "rmssd", "samples_millis")),
+    ("hrv_sdnn", "ms", ("hrv", "sdnn", "samples_millis")),
+    ("spo2", "%", ("respiration", "spo2", "samples_pct")),
+]
+BODY_SAMPLES: Series = [
+    ("weight", "kg", ("weight_samples_kg",)),
+]
+# Code, unit and path of the daily value of an entry, used unless the entry
+# has samples of the same code
+BIOMETRIC_SUMMARIES: Series = [
+    ("heart_rate_resting", "bpm", ("heart_rate", "resting_bpm")),
+    ("hrv_rmssd", "ms", ("hrv", "rmssd", "avg_millis")),
+    ("hrv_sdnn", "ms", ("hrv", "sdnn", "avg_millis")),
+    ("spo2", "%", ("respiration", "spo2", "avg_pct")),
+]
+BODY_SUMMARIES: Series = [
+    ("weight", "kg", ("weight_kg",)),
+    ("height", "cm", ("height_cm",)),
+    ("body_fat", "%", ("body_fat_pct",)),
+    ("bone_mass", "kg", ("bone_mass_kg",)),
+    ("muscle_mass", "kg", ("muscle_mass_kg",)),
+    ("lean_mass", "kg", ("lean_mass_kg",)),
+]
+
+SLEEP_DURATIONS = {
+    "duration": "total_seconds",
+    "in_bed": "in_bed_seconds",
+    "awake": "awake_seconds",
+    "light": "light_seconds",
+    "deep": "deep_seconds",
+    "rem": "rem_seconds",
+}
+
+
+def record_sid(uid: str, ts: datetime.datetime, code: str, provider: str | None):
+    return str(uuid.uuid5(SID_NAMESPACE, f"{uid}|{ts.isoformat()}|{code}|{provider}"))
+
+
+def parse_timestamp(value: object) -> datetime.datetime | None:
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # NOTE: dates of daily values are taken as UTC midnight
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.UTC)
+
+
+def parse_number(value: object) -> float | None:
+    if isinstance(value, bool) or not isinstance(value, int | float):
+        return None
+    return float(value)
+
+
+def dig(data: object, path: tuple[str, ...]) -> object:
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def entry_provider(entry: dict) -> str | None:
+    provider = dig(entry, ("metadata", "source"))
+    return provider if isinstance(provider, str) and provider else None
+
+
+def parse_sleep(uid: str, entry: dict) -> list[dict]:
+    start = parse_timestamp(entry.get("start_time"))
+    if start is None:
+        return []
+    provider = entry_provider(entry)
+    durations = entry.get("durations") or {}
+    record = {
+        "uid": uid,
+        "sid": record_sid(uid, start, "sleep", provider),
+        "ts": start,
+        "start": start,
+        "finish": parse_timestamp(entry.get("end_time")),
+        "provider": provider,
+    }
+    for name, key in SLEEP_DURATIONS.items():
+        seconds = parse_number(durations.get(key))
+        record[name] = None if seconds is None else round(seconds)
+    return [record]
+
+
+def parse_samples(
+    uid: str,
+    entry: dict,
+    samples: Series,
+    summaries: Series,
+) -> list[dict]:
+    provider = entry_provider(entry)
+    values: list[tuple[datetime.datetime, str, str, float]] = []
+    for code, unit, path in samples:
+        entry_samples = dig(entry, path)
+        if not isinstance(entry_samples, list):
+            continue
+        for sample in entry_samples:
+            ts = parse_timestamp(dig(sample, ("time",)))
+            value = parse_number(dig(sample, ("value",)))
+            if ts is not None and value is not None:
+                values.append((ts, code, unit, value))
+    sampled_codes = {code for _ts, code, _unit, _value in values}
+    date = parse_timestamp(dig(entry, ("metadata", "date")))
+    if date is not None:
+        for code, unit, path in summaries:
+            value = parse_number(dig(entry, path))
+            if code not in sampled_codes and value is not None:
+                values.append((date, code, unit, value))
+    return [
+        {
+            "uid": uid,
+            "sid": record_sid(uid, ts, code, provider),
+            "ts": ts,
+            "code": code,
+            "value": value,
+            "unit": unit,
+            "provider": provider,
+        }
+        for ts, code, unit, value in values
+    ]
+
+
+def parse_biometrics(uid: str, entry: dict) -> list[dict]:
+    return parse_samples(uid, entry, BIOMETRIC_SAMPLES, BIOMETRIC_SUMMARIES)
+
+
+def parse_body(uid: str, entry: dict) -> list[dict]:
+    return parse_samples(uid, entry, BODY_SAMPLES, BODY_SUMMARIES)
+
+
+# Webhook event name to its table and entry parser
+SERIES_EVENTS: dict[str, tuple[str, Callable[[str, dict], list[dict]]]] = {
+    "sleep": (METRIPORT_SLEEP_TABLE_NAME, parse_sleep),
+    "biometrics": (METRIPORT_BIOMETRICS_TABLE_NAME, parse_biometrics),
+    "body": (METRIPORT_BODY_TABLE_NAME, parse_body),
+}
+
+
+def parse_series_event(
+    event_name: str, uid: str, entries: object
+) -> tuple[list[dict], list]:
+    """Parse the entries of an event into rows and the entries left unparsed"""
+    _table_name, parse_entry = SERIES_EVENTS[event_name]
+    records: list[dict] = []
+    unparsed = []
+    for entry in entries if isinstance(entries, list) else [entries]:
+        rows = parse_entry(uid, entry) if isinstance(entry, dict) else []
+        if rows:
+            records.extend(rows)
+        else:
+            unparsed.append(entry)
+    return records, unparsed
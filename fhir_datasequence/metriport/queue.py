@@ -0,0 +1,98 @@
+import asyncio
+import contextlib
+import datetime
+import logging
+import random
+import weakref
+
+from aiohttp import web
+from sqlalchemy import Row
+from sqlalchemy.exc import SQLAlchemyError
+
+from fhir_datasequence import config
+from fhir_datasequence.metriport.db import (
+    claim_webhook_job,
+    complete_webhook_job,
+    retry_webhook_job,
+)
+from fhir_datasequence.metriport.webhook import handle_users_data
+
+
+async def attach(app: web.Application):
+    app["metriport_queue_wakeup"] = asyncio.Event()
+    # NOTE: leave the pool overflow to request handlers
+    app["metriport_webhook_semaphore"] = asyncio.Semaphore(
+        min(config.METRIPORT_WEBHOOK_CONCURRENCY, config.DBAPI_POOL_SIZE)
+    )
+    app["metriport_user_locks"] = weakref.WeakValueDictionary()
+    workers = [
+        asyncio.create_task(work(app)) for _ in range(config.METRIPORT_QUEUE_WORKERS)
+    ]
+
+    yield
+
+    for worker in workers:
+        worker.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await asyncio.gather(*workers)
+
+
+async def work(app: web.Application):
+    engine = app["dbapi_engine"]
+    while True:
+        try:
+            job = await claim_webhook_job(engine, app["dbapi_schema"])
+        except SQLAlchemyError:
+            logging.exception("Metriport webhook job can not be claimed")
+            job = None
+        if job is None:
+            await wait_for_jobs(app["metriport_queue_wakeup"])
+            continue
+        try:
+            await process_job(job, app)
+        except SQLAlchemyError:
+            # NOTE: the job is delivered again once its lease expires
+            logging.exception("Metriport webhook job %s can not be settled", job.id)
+
+
+async def process_job(job: Row, app: web.Application):
+    try:
+        failed_users = await handle_users_data(job.payload, app)
+    except Exception as exc:
+        logging.exception("Metriport webhook job %s has failed", job.id)
+        await retry_webhook_job(
+            job.id,
+            backoff(job.attempts),
+            repr(exc),
+            app["dbapi_engine"],
+            app["dbapi_schema"],
+        )
+        return
+    if failed_users:
+        # NOTE: only the failed users are delivered again
+        await retry_webhook_job(
+            job.id,
+            backoff(job.attempts),
+            f"Events of {len(failed_users)} users have failed",
+            app["dbapi_engine"],
+            app["dbapi_schema"],
+            payload={**job.payload, "users": failed_users},
+        )
+    else:
+        await complete_webhook_job(job.id, app["dbapi_engine"], app["dbapi_schema"])
+
+
+async def wait_for_jobs(wakeup: asyncio.Event):
+    with contextlib.suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(wakeup.wait(), config.METRIPORT_QUEUE_POLL_INTERVAL)
+    wakeup.clear()
+
+
+def backoff(attempts: int) -> datetime.timedelta | None:
+    if attempts >= config.METRIPORT_QUEUE_MAX_ATTEMPTS:
+        return None
+    delay = min(
+        config.METRIPORT_QUEUE_BACKOFF_BASE**attempts,
+        config.METRIPORT_QUEUE_BACKOFF_MAX,
+    )
+    return datetime.timedelta(seconds=random.uniform(delay / 2, delay))
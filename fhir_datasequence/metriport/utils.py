@@ -4,7 +4,12 @@ from uuid import uuid4
 
 from aiohttp import web
 
-from fhir_datasequence.metriport.db import write_activity_record, write_unhandled_data
+from fhir_datasequence.metriport.db import (
+    write_activity_records,
+    write_series_records,
+    write_unhandled_data,
+)
+from fhir_datasequence.metriport.parsers import SERIES_EVENTS, parse_series_event
 
 DATETIME_MASK_WITH_MS = "%Y-%m-%dT%H:%M:%S.%f%z"
 DATETIME_MASK = "%Y-%m-%dT%H:%M:%S%z"
@@ -77,12 +82,30 @@ def prepare_db_record(activity_item: dict):
 
 
 async def handle_activity_data(data: dict, app: web.Application):
-    for activity_item in data["activity"]:
-        for activity_log in activity_item.get("activity_logs", []):
-            record = prepare_db_record({**activity_log, "userId": data["userId"]})
-            await write_activity_record(
-                record, app["dbapi_engine"], app["dbapi_metadata"]
-            )
+    records = [
+        record
+        for activity_item in data["activity"]
+        for activity_log in activity_item.get("activity_logs", [])
+        if (record := prepare_db_record({**activity_log, "userId": data["userId"]}))
+    ]
+    if records:
+        await write_activity_records(records, app["dbapi_engine"], app["dbapi_schema"])
+
+
+async def handle_series_data(data: dict, app: web.Application):
+    """Write sleep, biometrics and body entries to their own hypertables
+
+    Entries that have no typed values are kept as unhandled data.
+    """
+    event_name = next(name for name in data if name in SERIES_EVENTS)
+    table_name, _parse_entry = SERIES_EVENTS[event_name]
+    records, unparsed = parse_series_event(event_name, data["userId"], data[event_name])
+    if records:
+        await write_series_records(
+            table_name, records, app["dbapi_engine"], app["dbapi_schema"]
+        )
+    if unparsed:
+        await default_handler({event_name: unparsed, "userId": data["userId"]}, app)
 
 
 async def default_handler(data: dict, app: web.Application):
@@ -91,4 +114,4 @@ async def default_handler(data: dict, app: web.Application):
     )
 
     record = {"ts": ts, "uid": data["userId"], "data": data}
-    await write_unhandled_data(record, app["dbapi_engine"], app["dbapi_metadata"])
+    await write_unhandled_data(record, app["dbapi_engine"], app["dbapi_schema"])
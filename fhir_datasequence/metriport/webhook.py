@@ -1,18 +1,80 @@
+import asyncio
+import logging
+import weakref
+
 from aiohttp import web
 
 from fhir_datasequence.metriport.client import authorize_webhook
-from fhir_datasequence.metriport.utils import default_handler, handle_activity_data
+from fhir_datasequence.metriport.db import enqueue_webhook_job, read_webhook_queue_stats
+from fhir_datasequence.metriport.identity import (
+    APPLE_SUBJECT,
+    remember_metriport_user_ids,
+)
+from fhir_datasequence.metriport.utils import (
+    default_handler,
+    handle_activity_data,
+    handle_series_data,
+)
 
 event_handler_map = {
     "activity": handle_activity_data,
-    "sleep": default_handler,
-    "biometrics": default_handler,
-    "body": default_handler,
+    "sleep": handle_series_data,
+    "biometrics": handle_series_data,
+    "body": handle_series_data,
     "nutrition": default_handler,
     "user": default_handler,
 }
 
 
+async def handle_users_data(data: dict, app: web.Application) -> list[dict]:
+    """Handle users concurrently and return the entries of the failed ones
+
+    Events of the same user are handled one after another in payload order,
+    and handler calls are bounded by the app-wide webhook semaphore.
+    """
+    users: dict[str, list[dict]] = {}
+    for user in data.get("users", []):
+        users.setdefault(user["userId"], []).append(user)
+    await remember_metriport_user_ids(
+        app,
+        [
+            (APPLE_SUBJECT, user["appUserId"], user["userId"])
+            for user in data.get("users", [])
+            if user.get("appUserId")
+        ],
+    )
+    results = await asyncio.gather(
+        *(
+            handle_user_data(user_id, entries, app)
+            for user_id, entries in users.items()
+        ),
+        return_exceptions=True,
+    )
+    failed_users = []
+    for (user_id, entries), result in zip(users.items(), results, strict=True):
+        if isinstance(result, Exception):
+            logging.error(
+                "Metriport webhook events of user %s have failed",
+                user_id,
+                exc_info=result,
+            )
+            failed_users.extend(entries)
+    return failed_users
+
+
+async def handle_user_data(user_id: str, entries: list[dict], app: web.Application):
+    user_locks: weakref.WeakValueDictionary = app["metriport_user_locks"]
+    user_lock = user_locks.get(user_id)
+    if user_lock is None:
+        user_lock = user_locks[user_id] = asyncio.Lock()
+    async with user_lock:
+        for user in entries:
+            for event_name, event_data in user.items():
+                handler = event_handler_map.get(event_name, default_handler)
+                async with app["metriport_webhook_semaphore"]:
+                    await handler({event_name: event_data, "userId": user_id}, app)
+
+
 @authorize_webhook
 async def metriport_events_handler(request: web.Request):
     data = await request.json()
@@ -21,11 +83,19 @@ async def metriport_events_handler(request: web.Request):
     if "ping" in data:
         return web.json_response({"pong": data["ping"]})
 
-    for user in data.get("users", []):
-        for event_name, event_data in user.items():
-            handler = event_handler_map.get(event_name, default_handler)
-            await handler(
-                {event_name: event_data, "userId": user["userId"]}, request.app
-            )
+    # NOTE: the payload is processed by metriport.queue workers
+    await enqueue_webhook_job(
+        data, request.app["dbapi_engine"], request.app["dbapi_schema"]
+    )
+    request.app["metriport_queue_wakeup"].set()
 
     return web.HTTPOk()
+
+
+@authorize_webhook
+async def metriport_queue_stats_handler(request: web.Request):
+    return web.json_response(
+        await read_webhook_queue_stats(
+            request.app["dbapi_engine"], request.app["dbapi_schema"]
+        )
+    )
@@ -0,0 +1,236 @@
+"""TimescaleDB compression and retention of the hypertables
+
+    python -m fhir_datasequence.storage report [--chunks] [--json]
+    python -m fhir_datasequence.storage apply
+
+Chunks are compressed segmented by `uid` and ordered by `ts`, so a read of
+a user time range decompresses only the segments of that user. Migrations
+set up the policies with the default intervals, `apply` sets them from the
+config.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from dataclasses import dataclass
+
+from sqlalchemy import TextClause, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from fhir_datasequence import config
+from fhir_datasequence.db import RECORDS_TABLE_NAME, create_engine
+from fhir_datasequence.metriport import (
+    METRIPORT_BIOMETRICS_TABLE_NAME,
+    METRIPORT_BODY_TABLE_NAME,
+    METRIPORT_RECORDS_TABLE_NAME,
+    METRIPORT_SLEEP_TABLE_NAME,
+    METRIPORT_UNHANDLED_RECORDS_TABLE_NAME,
+)
+
+
+@dataclass
+class HypertablePolicy:
+    compress_after: str
+    retention: str
+
+
+def hypertable_policies() -> dict[str, HypertablePolicy]:
+    return {
+        RECORDS_TABLE_NAME: HypertablePolicy(
+            config.RECORDS_COMPRESS_AFTER, config.RECORDS_RETENTION
+        ),
+        METRIPORT_RECORDS_TABLE_NAME: HypertablePolicy(
+            config.METRIPORT_RECORDS_COMPRESS_AFTER,
+            config.METRIPORT_RECORDS_RETENTION,
+        ),
+        **{
+            table_name: HypertablePolicy(
+                config.METRIPORT_RECORDS_COMPRESS_AFTER,
+                config.METRIPORT_RECORDS_RETENTION,
+            )
+            for table_name in (
+                METRIPORT_SLEEP_TABLE_NAME,
+                METRIPORT_BIOMETRICS_TABLE_NAME,
+                METRIPORT_BODY_TABLE_NAME,
+            )
+        },
+        METRIPORT_UNHANDLED_RECORDS_TABLE_NAME: HypertablePolicy(
+            config.METRIPORT_UNHANDLED_DATA_COMPRESS_AFTER,
+            config.METRIPORT_UNHANDLED_DATA_RETENTION,
+        ),
+    }
+
+
+def policy_statements(table_name: str, policy: HypertablePolicy) -> list[TextClause]:
+    statements = [
+        text(
+            "SELECT remove_compression_policy("
+            "CAST(:table_name AS regclass), if_exists => true)"
+        ),
+        text(
+            "SELECT remove_retention_policy("
+            "CAST(:table_name AS regclass), if_exists => true)"
+        ),
+    ]
+    if policy.compress_after:
+        statements.append(
+            text(
+                "SELECT add_compression_policy(CAST(:table_name AS regclass), "
+                "compress_after => CAST(:compress_after AS INTERVAL))"
+            ).bindparams(compress_after=policy.compress_after)
+        )
+    if policy.retention:
+        statements.append(
+            text(
+                "SELECT add_retention_policy(CAST(:table_name AS regclass), "
+                "drop_after => CAST(:retention AS INTERVAL))"
+            ).bindparams(retention=policy.retention)
+        )
+    return [statement.bindparams(table_name=table_name) for statement in statements]
+
+
+async def apply_policies(connection: AsyncConnection):
+    for table_name, policy in hypertable_policies().items():
+        for statement in policy_statements(table_name, policy):
+            await connection.execute(statement)
+
+
+async def read_hypertable_report(connection: AsyncConnection, table_name: str):
+    summary = (
+        await connection.execute(
+            text(
+                """
+                SELECT
+                    hypertable_size(CAST(:table_name AS regclass)) AS total_bytes,
+                    s.total_chunks,
+                    s.number_compressed_chunks AS compressed_chunks,
+                    s.before_compression_total_bytes,
+                    s.after_compression_total_bytes
+                FROM hypertable_compression_stats(CAST(:table_name AS regclass)) s
+                """
+            ),
+            {"table_name": table_name},
+        )
+    ).one()
+    chunks = await connection.execute(
+        text(
+            """
+            SELECT
+                c.chunk_name,
+                c.range_start,
+                c.range_end,
+                d.total_bytes,
+                s.compression_status,
+                s.before_compression_total_bytes,
+                s.after_compression_total_bytes
+            FROM timescaledb_information.chunks c
+            JOIN chunks_detailed_size(CAST(:table_name AS regclass)) d
+                USING (chunk_schema, chunk_name)
+            JOIN chunk_compression_stats(CAST(:table_name AS regclass)) s
+                USING (chunk_schema, chunk_name)
+            WHERE c.hypertable_name = :table_name
+            ORDER BY c.range_start
+            """
+        ),
+        {"table_name": table_name},
+    )
+    return {
+        "hypertable": table_name,
+        **summary._asdict(),
+        "compression_ratio": compression_ratio(
+            summary.before_compression_total_bytes,
+            summary.after_compression_total_bytes,
+        ),
+        "chunks": [
+            {
+                **chunk._asdict(),
+                "range_start": chunk.range_start.isoformat(),
+                "range_end": chunk.range_end.isoformat(),
+                "compression_ratio": compression_ratio(
+                    chunk.before_compression_total_bytes,
+                    chunk.after_compression_total_bytes,
+                ),
+            }
+            for chunk in chunks
+        ],
+    }
+
+
+def compression_ratio(before: int | None, after: int | None) -> float | None:
+    if not before or not after:
+        return None
+    return round(before / after, 2)
+
+
+def format_bytes(value: int | None) -> str:
+    if value is None:
+        return "-"
+    size = float(value)
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_ratio(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}x"
+
+
+def print_report(reports: list[dict], with_chunks: bool):
+    for report in reports:
+        print(
+            f"{report['hypertable']}: {format_bytes(report['total_bytes'])} in "
+            f"{report['total_chunks'] or 0} chunks, "
+            f"{report['compressed_chunks'] or 0} compressed "
+            f"({format_bytes(report['before_compression_total_bytes'])} -> "
+            f"{format_bytes(report['after_compression_total_bytes'])}, "
+            f"{format_ratio(report['compression_ratio'])})"
+        )
+        if not with_chunks:
+            continue
+        for chunk in report["chunks"]:
+            print(
+                f"  {chunk['chunk_name']} {chunk['range_start']} .. "
+                f"{chunk['range_end']} {format_bytes(chunk['total_bytes'])} "
+                f"{chunk['compression_status'].lower()} "
+                f"{format_ratio(chunk['compression_ratio'])}"
+            )
+
+
+async def run(options: argparse.Namespace):
+    engine = create_engine()
+    try:
+        async with engine.begin() as connection:
+            if options.command == "apply":
+                await apply_policies(connection)
+                return
+            reports = [
+                await read_hypertable_report(connection, table_name)
+                for table_name in hypertable_policies()
+            ]
+    finally:
+        await engine.dispose()
+    if options.json:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(reports, options.chunks)
+
+
+def parse_options(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m fhir_datasequence.storage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser(
+        "report", help="Show chunk sizes and compression ratios of the hypertables"
+    )
+    report.add_argument("--chunks", action="store_true", help="List every chunk")
+    report.add_argument("--json", action="store_true", help="Print JSON")
+    commands.add_parser(
+        "apply", help="Set compression and retention policies from the config"
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_options(sys.argv[1:])))
@@ -0,0 +1,23 @@
+"""Gunicorn settings, loaded from the working directory by default
+
+Metrics of every worker are written to `PROMETHEUS_MULTIPROC_DIR` when it is
+set, the files of the previous run and of exited workers are cleaned here.
+"""
+import glob
+import os
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server: object):
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(path)
+
+
+def child_exit(server: object, worker: object):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)  # type: ignore[attr-defined]
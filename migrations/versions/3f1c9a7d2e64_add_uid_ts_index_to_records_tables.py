@@ -0,0 +1,29 @@
+"""add uid, ts index to records tables
+
+Revision ID: 3f1c9a7d2e64
+Revises: b48df1f110f3
+Create Date: 2026-10-18 09:12:37.514203
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f1c9a7d2e64"
+down_revision = "b48df1f110f3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("records_uid_ts_idx", "records", ["uid", sa.text("ts DESC")])
+    op.create_index(
+        "metriport_records_uid_ts_idx",
+        "metriport_records",
+        ["uid", sa.text("ts DESC")],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("metriport_records_uid_ts_idx", "metriport_records")
+    op.drop_index("records_uid_ts_idx", "records")
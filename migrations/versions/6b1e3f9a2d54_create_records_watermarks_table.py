@@ -0,0 +1,31 @@
+"""create records watermarks table
+
+Revision ID: 6b1e3f9a2d54
+Revises: f3a8c0d95e21
+Create Date: 2026-10-18 21:14:36.508127
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6b1e3f9a2d54"
+down_revision = "f3a8c0d95e21"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # NOTE: users without a row have not been written to since, their
+    # validators change with the first write
+    op.create_table(
+        "records_watermarks",
+        sa.Column("table_name", sa.TEXT, primary_key=True),
+        sa.Column("uid", sa.TEXT, primary_key=True),
+        sa.Column("version", sa.BIGINT, nullable=False),
+        sa.Column("modified_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("records_watermarks")
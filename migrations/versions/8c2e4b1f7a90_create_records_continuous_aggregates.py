@@ -0,0 +1,68 @@
+"""create records continuous aggregates
+
+Revision ID: 8c2e4b1f7a90
+Revises: 3f1c9a7d2e64
+Create Date: 2026-10-18 11:02:51.377420
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8c2e4b1f7a90"
+down_revision = "3f1c9a7d2e64"
+branch_labels = None
+depends_on = None
+
+ROLLUPS = [
+    ("records", "hourly", "1 hour", "1 hour", "30 minutes"),
+    ("records", "daily", "1 day", "1 day", "1 hour"),
+    ("metriport_records", "hourly", "1 hour", "1 hour", "30 minutes"),
+    ("metriport_records", "daily", "1 day", "1 day", "1 hour"),
+]
+
+
+def upgrade() -> None:
+    for table, suffix, width, end_offset, schedule_interval in ROLLUPS:
+        view = f"{table}_{suffix}"
+        op.execute(
+            sa.text(
+                f"""
+                CREATE MATERIALIZED VIEW {view}
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false)
+                AS SELECT
+                    time_bucket(INTERVAL '{width}', ts) AS bucket,
+                    uid,
+                    code,
+                    count(*) AS record_count,
+                    sum(duration) AS duration_sum,
+                    count(duration) AS duration_count,
+                    sum(energy) AS energy_sum,
+                    count(energy) AS energy_count,
+                    min(start) AS start,
+                    max(finish) AS finish
+                FROM {table}
+                GROUP BY bucket, uid, code
+                WITH NO DATA
+                """
+            )
+        )
+        # NOTE: records are backfilled by mobile clients, so the refresh window
+        # is unbounded and the invalidation log limits the actual work
+        op.execute(
+            sa.text(
+                f"""
+                SELECT add_continuous_aggregate_policy(
+                    '{view}',
+                    start_offset => NULL,
+                    end_offset => INTERVAL '{end_offset}',
+                    schedule_interval => INTERVAL '{schedule_interval}'
+                )
+                """
+            )
+        )
+
+
+def downgrade() -> None:
+    for table, suffix, *_ in reversed(ROLLUPS):
+        op.execute(sa.text(f"DROP MATERIALIZED VIEW {table}_{suffix}"))
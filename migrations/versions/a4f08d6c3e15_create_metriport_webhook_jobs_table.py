@@ -0,0 +1,49 @@
+"""create metriport webhook jobs table
+
+Revision ID: a4f08d6c3e15
+Revises: d7a3e5c91b28
+Create Date: 2026-10-18 14:05:44.120938
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import JSONB
+
+# revision identifiers, used by Alembic.
+revision = "a4f08d6c3e15"
+down_revision = "d7a3e5c91b28"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "metriport_webhook_jobs",
+        sa.Column("id", sa.BIGINT, primary_key=True, autoincrement=True),
+        sa.Column("payload", JSONB, nullable=False),
+        sa.Column("attempts", sa.INTEGER, nullable=False, server_default="0"),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+        sa.Column(
+            "run_at",
+            sa.TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+        sa.Column("failed_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("last_error", sa.TEXT),
+    )
+    op.create_index(
+        "metriport_webhook_jobs_due_idx",
+        "metriport_webhook_jobs",
+        ["run_at"],
+        postgresql_where=sa.text("failed_at IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("metriport_webhook_jobs")
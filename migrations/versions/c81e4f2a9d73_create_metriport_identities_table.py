@@ -0,0 +1,34 @@
+"""create metriport identities table
+
+Revision ID: c81e4f2a9d73
+Revises: a4f08d6c3e15
+Create Date: 2026-10-18 15:21:07.482913
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c81e4f2a9d73"
+down_revision = "a4f08d6c3e15"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "metriport_identities",
+        sa.Column("kind", sa.TEXT, primary_key=True),
+        sa.Column("value", sa.TEXT, primary_key=True),
+        sa.Column("metriport_user_id", sa.TEXT, nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("metriport_identities")
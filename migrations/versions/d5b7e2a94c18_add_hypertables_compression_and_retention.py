@@ -0,0 +1,68 @@
+"""add hypertables compression and retention
+
+Revision ID: d5b7e2a94c18
+Revises: c81e4f2a9d73
+Create Date: 2026-10-18 16:02:39.915204
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d5b7e2a94c18"
+down_revision = "c81e4f2a9d73"
+branch_labels = None
+depends_on = None
+
+# NOTE: table, compress after and retention interval, later changes of the
+# config are applied with `python -m fhir_datasequence.storage apply`
+HYPERTABLES = [
+    ("records", "30 days", None),
+    ("metriport_records", "30 days", None),
+    ("metriport_unhandled_data", "7 days", "365 days"),
+]
+
+
+def upgrade() -> None:
+    for table, compress_after, retention in HYPERTABLES:
+        op.execute(
+            sa.text(
+                f"""
+                ALTER TABLE {table} SET (
+                    timescaledb.compress,
+                    timescaledb.compress_segmentby = 'uid',
+                    timescaledb.compress_orderby = 'ts DESC'
+                )
+                """
+            )
+        )
+        op.execute(
+            sa.text(
+                f"SELECT add_compression_policy('{table}', "
+                f"compress_after => INTERVAL '{compress_after}')"
+            )
+        )
+        if retention:
+            op.execute(
+                sa.text(
+                    f"SELECT add_retention_policy('{table}', "
+                    f"drop_after => INTERVAL '{retention}')"
+                )
+            )
+
+
+def downgrade() -> None:
+    for table, _compress_after, _retention in reversed(HYPERTABLES):
+        op.execute(
+            sa.text(f"SELECT remove_retention_policy('{table}', if_exists => true)")
+        )
+        op.execute(
+            sa.text(f"SELECT remove_compression_policy('{table}', if_exists => true)")
+        )
+        op.execute(
+            sa.text(
+                "SELECT decompress_chunk(chunk, if_compressed => true) "
+                f"FROM show_chunks('{table}') chunk"
+            )
+        )
+        op.execute(sa.text(f"ALTER TABLE {table} SET (timescaledb.compress = false)"))
@@ -0,0 +1,28 @@
+"""add activity key index to metriport records
+
+Revision ID: d7a3e5c91b28
+Revises: 8c2e4b1f7a90
+Create Date: 2026-10-18 12:40:06.918345
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d7a3e5c91b28"
+down_revision = "8c2e4b1f7a90"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # NOTE: unique indexes on hypertables must include the ts partitioning column,
+    # so the (uid, start, provider) activity key can only be indexed for lookups
+    op.create_index(
+        "metriport_records_activity_key_idx",
+        "metriport_records",
+        ["uid", "start", "provider"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("metriport_records_activity_key_idx", "metriport_records")
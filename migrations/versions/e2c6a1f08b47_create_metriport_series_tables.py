@@ -0,0 +1,74 @@
+"""create metriport sleep, biometrics and body tables
+
+Revision ID: e2c6a1f08b47
+Revises: d5b7e2a94c18
+Create Date: 2026-10-18 17:12:48.306115
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e2c6a1f08b47"
+down_revision = "d5b7e2a94c18"
+branch_labels = None
+depends_on = None
+
+SAMPLES_TABLES = ["metriport_biometrics", "metriport_body"]
+
+
+def create_series_table(table: str, *columns: sa.Column) -> None:
+    op.create_table(
+        table,
+        sa.Column("uid", sa.TEXT, nullable=False),
+        sa.Column("sid", sa.TEXT, nullable=False),
+        sa.Column("ts", sa.TIMESTAMP(timezone=True), nullable=False),
+        *columns,
+        sa.Column("provider", sa.TEXT),
+        sa.UniqueConstraint("ts", "uid", "sid", name=f"{table}_ts_uid_sid_uq"),
+    )
+    op.execute(sa.text(f"select create_hypertable('{table}', 'ts')"))
+    op.create_index(f"{table}_uid_ts_idx", table, ["uid", sa.text("ts DESC")])
+    op.execute(
+        sa.text(
+            f"""
+            ALTER TABLE {table} SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'uid',
+                timescaledb.compress_orderby = 'ts DESC, sid'
+            )
+            """
+        )
+    )
+    op.execute(
+        sa.text(
+            f"SELECT add_compression_policy('{table}', "
+            "compress_after => INTERVAL '30 days')"
+        )
+    )
+
+
+def upgrade() -> None:
+    create_series_table(
+        "metriport_sleep",
+        sa.Column("start", sa.TIMESTAMP(timezone=True)),
+        sa.Column("finish", sa.TIMESTAMP(timezone=True)),
+        sa.Column("duration", sa.INTEGER),
+        sa.Column("in_bed", sa.INTEGER),
+        sa.Column("awake", sa.INTEGER),
+        sa.Column("light", sa.INTEGER),
+        sa.Column("deep", sa.INTEGER),
+        sa.Column("rem", sa.INTEGER),
+    )
+    for table in SAMPLES_TABLES:
+        create_series_table(
+            table,
+            sa.Column("code", sa.TEXT, nullable=False),
+            sa.Column("value", sa.DOUBLE_PRECISION, nullable=False),
+            sa.Column("unit", sa.TEXT),
+        )
+
+
+def downgrade() -> None:
+    for table in ["metriport_sleep", *SAMPLES_TABLES]:
+        op.drop_table(table)
@@ -0,0 +1,96 @@
+"""add ingested_xid to records tables
+
+Revision ID: f3a8c0d95e21
+Revises: e2c6a1f08b47
+Create Date: 2026-10-18 19:40:11.203584
+
+"""
+from collections.abc import Callable
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f3a8c0d95e21"
+down_revision = "e2c6a1f08b47"
+branch_labels = None
+depends_on = None
+
+# NOTE: TimescaleDB restricts column changes of hypertables with compression
+# enabled, so it is disabled around them and all chunks are decompressed.
+# The compression policy in place is restored and compresses them again.
+TABLES = ["records", "metriport_records"]
+
+
+def without_compression(table: str, alter: Callable[[str], None]) -> None:
+    op.execute(
+        sa.text(
+            f"""
+            CREATE TEMPORARY TABLE {table}_compression_policy AS
+            SELECT CAST(config ->> 'compress_after' AS INTERVAL) AS compress_after
+            FROM timescaledb_information.jobs
+            WHERE proc_name = 'policy_compression' AND hypertable_name = '{table}'
+            """
+        )
+    )
+    op.execute(
+        sa.text(f"SELECT remove_compression_policy('{table}', if_exists => true)")
+    )
+    op.execute(
+        sa.text(
+            "SELECT decompress_chunk(chunk, if_compressed => true) "
+            f"FROM show_chunks('{table}') chunk"
+        )
+    )
+    op.execute(sa.text(f"ALTER TABLE {table} SET (timescaledb.compress = false)"))
+    alter(table)
+    op.execute(
+        sa.text(
+            f"""
+            ALTER TABLE {table} SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'uid',
+                timescaledb.compress_orderby = 'ts DESC'
+            )
+            """
+        )
+    )
+    op.execute(
+        sa.text(
+            f"SELECT add_compression_policy('{table}', "
+            f"compress_after => compress_after) FROM {table}_compression_policy"
+        )
+    )
+    op.execute(sa.text(f"DROP TABLE {table}_compression_policy"))
+
+
+def add_ingested_xid(table: str) -> None:
+    # NOTE: rows stored before sort before any later transaction, the constant
+    # default does not rewrite the chunks
+    op.add_column(
+        table,
+        sa.Column("ingested_xid", sa.BIGINT, nullable=False, server_default="0"),
+    )
+    op.alter_column(
+        table,
+        "ingested_xid",
+        server_default=sa.text("CAST(CAST(pg_current_xact_id() AS TEXT) AS BIGINT)"),
+    )
+    op.create_index(
+        f"{table}_uid_ingested_xid_idx", table, ["uid", "ingested_xid", "sid"]
+    )
+
+
+def drop_ingested_xid(table: str) -> None:
+    op.drop_index(f"{table}_uid_ingested_xid_idx", table)
+    op.drop_column(table, "ingested_xid")
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        without_compression(table, add_ingested_xid)
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        without_compression(table, drop_ingested_xid)
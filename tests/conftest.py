@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+# NOTE: the config builds the database url on import, tests do not connect
+os.environ.setdefault("PGUSER", "postgres")
+os.environ.setdefault("PGPASSWORD", "postgres")
+os.environ.setdefault("TIMESCALEDB_SERVICE_NAME", "localhost")
+
+
+@pytest.fixture()
+def database_url() -> str:
+    """Url of a scratch database, tests using it are skipped without one"""
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return url
@@ -0,0 +1,58 @@
+import asyncio
+
+import jwt
+import pytest
+from aiohttp import ClientConnectionError, web
+from aiohttp.test_utils import make_mocked_request
+
+from fhir_datasequence.auth import create_token_cache
+from fhir_datasequence.auth.apple import AppleJWKS, apple_openid_userinfo
+
+
+class UnknownKeysJWKS(AppleJWKS):
+    def __init__(self: "UnknownKeysJWKS") -> None:
+        super().__init__(session=None)  # type: ignore[arg-type]
+        self.refreshes = 0
+
+    async def fetch(self: "UnknownKeysJWKS") -> None:
+        self.refreshes += 1
+
+
+class UnavailableApple:
+    def __init__(self: "UnavailableApple") -> None:
+        self.requests = 0
+
+    def get(self: "UnavailableApple", url: str):
+        self.requests += 1
+        raise ClientConnectionError(url)
+
+
+@apple_openid_userinfo(required=True)
+async def userinfo_handler(request: web.Request, userinfo: object):
+    return web.json_response({})
+
+
+def test_token_with_unknown_kid_is_unauthorized():
+    jwks = UnknownKeysJWKS()
+    app = web.Application()
+    app["apple_jwks"] = jwks
+    app["apple_token_cache"] = create_token_cache()
+    token = jwt.encode({"sub": "user"}, "secret", headers={"kid": "unknown"})
+    request = make_mocked_request(
+        "GET", "/", headers={"Authorization": f"Bearer {token}"}, app=app
+    )
+
+    with pytest.raises(web.HTTPUnauthorized):
+        asyncio.run(userinfo_handler(request))
+    assert jwks.refreshes == 1
+
+
+def test_failed_refresh_limits_later_attempts():
+    apple = UnavailableApple()
+    jwks = AppleJWKS(session=apple)  # type: ignore[arg-type]
+
+    async def find_unknown_kids():
+        return [await jwks.find(kid) for kid in ("made-up", "other", "another")]
+
+    assert asyncio.run(find_unknown_kids()) == [None, None, None]
+    assert apple.requests == 1
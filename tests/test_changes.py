@@ -0,0 +1,78 @@
+import asyncio
+
+from sqlalchemy import BIGINT, TEXT, Column, MetaData, Row, Table, insert
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from fhir_datasequence.api.query import (
+    decode_sync_token,
+    fetch_changes,
+    select_changes,
+)
+from fhir_datasequence.db import current_xid
+
+metadata = MetaData()
+records = Table(
+    "records",
+    metadata,
+    Column("uid", TEXT),
+    Column("sid", TEXT),
+    Column("ingested_xid", BIGINT, nullable=False, server_default=current_xid()),
+)
+
+
+async def create_records(database_url: str) -> AsyncEngine:
+    engine = create_async_engine(database_url)
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.drop_all)
+        await connection.run_sync(metadata.create_all)
+    return engine
+
+
+def parse_row(row: Row) -> dict:
+    return {"sid": row.sid}
+
+
+async def sync(engine: AsyncEngine, query: dict) -> dict:
+    async with engine.connect() as connection:
+        return await fetch_changes(
+            connection, select_changes(records, "user", query), query, parse_row
+        )
+
+
+def test_late_commit_is_not_skipped(database_url: str):
+    async def scenario():
+        engine = await create_records(database_url)
+        async with engine.connect() as writer:
+            late = await writer.begin()
+            await writer.execute(insert(records), {"uid": "user", "sid": "late"})
+            async with engine.begin() as connection:
+                await connection.execute(
+                    insert(records), {"uid": "user", "sid": "early"}
+                )
+            # NOTE: the committed record waits for the older transaction
+            pending = await sync(engine, {})
+            await late.commit()
+        changes = await sync(engine, {})
+        await engine.dispose()
+        return pending, changes
+
+    pending, changes = asyncio.run(scenario())
+    assert pending == {"records": [], "next": None, "more": False}
+    assert [record["sid"] for record in changes["records"]] == ["late", "early"]
+
+
+def test_sync_token_resumes_after_last_change(database_url: str):
+    async def scenario():
+        engine = await create_records(database_url)
+        async with engine.begin() as connection:
+            await connection.execute(insert(records), {"uid": "user", "sid": "first"})
+        first = await sync(engine, {"limit": 1})
+        async with engine.begin() as connection:
+            await connection.execute(insert(records), {"uid": "user", "sid": "second"})
+        second = await sync(engine, {"since": decode_sync_token(first["next"])})
+        await engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert [record["sid"] for record in first["records"]] == ["first"]
+    assert [record["sid"] for record in second["records"]] == ["second"]
@@ -0,0 +1,46 @@
+import datetime
+import email.utils
+
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+from fhir_datasequence.api.conditional import (
+    entity_tag,
+    is_not_modified,
+    validator_headers,
+)
+
+LAST_MODIFIED = datetime.datetime(2024, 1, 2, 10, 30, 15, 500, tzinfo=datetime.UTC)
+
+
+def records_request(path: str, headers: dict | None = None) -> web.Request:
+    request = make_mocked_request("GET", path, headers=headers)
+    # NOTE: set by the validation middleware of aiohttp-apispec
+    request["querystring"] = {}
+    return request
+
+
+def test_entity_tag_follows_watermark_version():
+    request = records_request("/api/v1/records?limit=10")
+
+    assert entity_tag(request, 1) == entity_tag(request, 1)
+    assert entity_tag(request, 1) != entity_tag(request, 2)
+    assert entity_tag(request, None) != entity_tag(request, 1)
+
+
+def test_last_modified_is_not_later_than_response():
+    future = datetime.datetime.now(datetime.UTC) + datetime.timedelta(hours=1)
+    headers = validator_headers("etag", future)
+
+    assert email.utils.parsedate_to_datetime(headers[hdrs.LAST_MODIFIED]) < future
+    assert hdrs.LAST_MODIFIED not in validator_headers("etag", None)
+
+
+def test_not_modified_by_entity_tag():
+    etag = entity_tag(records_request("/api/v1/records"), 1)
+    request = records_request(
+        "/api/v1/records", headers={hdrs.IF_NONE_MATCH: f'W/"{etag}"'}
+    )
+
+    assert is_not_modified(request, etag, LAST_MODIFIED)
+    assert not is_not_modified(request, "other", LAST_MODIFIED)
@@ -0,0 +1,41 @@
+import datetime
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from fhir_datasequence.api.export import (
+    COLUMN_TYPES,
+    ChunkSink,
+    close_writer,
+    encode_batch,
+    open_writer,
+)
+
+TS = datetime.datetime(2024, 1, 2, 10, tzinfo=datetime.UTC)
+
+
+def read_table(export_format: str, data: bytes) -> pa.Table:
+    if export_format == "parquet":
+        return pq.read_table(io.BytesIO(data))
+    return pa.ipc.open_stream(data).read_all()
+
+
+@pytest.mark.parametrize("export_format", ["arrow", "parquet"])
+def test_encoded_batches_round_trip(export_format: str):
+    schema = pa.schema([(name, COLUMN_TYPES[name]) for name in ("sid", "ts", "energy")])
+    sink = ChunkSink()
+    writer = open_writer(export_format, sink, schema)
+    data = b"".join(
+        [
+            encode_batch(writer, sink, schema, [("a", TS, 1), ("b", TS, None)]),
+            encode_batch(writer, sink, schema, [("c", TS, 3)]),
+            close_writer(writer, sink),
+        ]
+    )
+
+    table = read_table(export_format, data)
+    assert table.column("sid").to_pylist() == ["a", "b", "c"]
+    assert table.column("energy").to_pylist() == [1, None, 3]
+    assert table.column("ts").to_pylist() == [TS, TS, TS]
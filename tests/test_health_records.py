@@ -0,0 +1,34 @@
+import datetime
+
+import pytest
+from marshmallow import Schema, ValidationError
+
+from fhir_datasequence.api.health_records import RecordsListSchema
+
+RECORD = {
+    "sid": "1",
+    "ts": "2024-01-01T00:00:00Z",
+    "code": "steps",
+    "duration": 60,
+    "start": "2024-01-01T00:00:00Z",
+    "finish": "2024-01-01T00:01:00Z",
+}
+
+
+def test_canonical_records_load_like_marshmallow():
+    payload = {"records": [RECORD]}
+
+    loaded = RecordsListSchema().load(payload)
+
+    assert loaded == Schema.load(RecordsListSchema(), payload)
+    assert loaded["records"][0]["ts"] == datetime.datetime(
+        2024, 1, 1, tzinfo=datetime.UTC
+    )
+
+
+def test_load_options_are_handled_by_marshmallow():
+    partial = RecordsListSchema().load({"records": [{"sid": "1"}]}, partial=True)
+
+    assert partial == {"records": [{"sid": "1"}]}
+    with pytest.raises(ValidationError):
+        RecordsListSchema().load({"records": [{**RECORD, "duration": True}]})
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from fhir_datasequence import config
+from fhir_datasequence.api import metrics
+from fhir_datasequence.metrics import ApplicationCollector
+
+
+def test_metrics_are_open_without_token(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "METRICS_AUTH_TOKEN", None)
+
+    assert metrics.is_authorized(make_mocked_request("GET", "/metrics"))
+
+
+def test_metrics_require_configured_token(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "METRICS_AUTH_TOKEN", "scraper")
+
+    assert not metrics.is_authorized(make_mocked_request("GET", "/metrics"))
+    assert not metrics.is_authorized(
+        make_mocked_request("GET", "/metrics", headers={"Authorization": "Bearer x"})
+    )
+    assert metrics.is_authorized(
+        make_mocked_request(
+            "GET", "/metrics", headers={"Authorization": "Bearer scraper"}
+        )
+    )
+
+
+def test_queue_stats_are_read_once_per_ttl(monkeypatch: pytest.MonkeyPatch):
+    reads = []
+
+    async def read_webhook_queue_stats(engine: object, schema: object):
+        reads.append(engine)
+        return {"depth": len(reads), "failed": 0, "lag": 0}
+
+    monkeypatch.setattr(metrics, "read_webhook_queue_stats", read_webhook_queue_stats)
+    monkeypatch.setattr(config, "METRICS_QUEUE_STATS_TTL", 60)
+    app = web.Application()
+    app["dbapi_engine"] = app["dbapi_schema"] = None
+    app["metrics_collector"] = collector = ApplicationCollector(app)
+
+    async def scrape_twice():
+        await metrics.refresh_queue_stats(app)
+        await metrics.refresh_queue_stats(app)
+
+    asyncio.run(scrape_twice())
+
+    assert len(reads) == 1
+    assert collector.queue_stats == {"depth": 1, "failed": 0, "lag": 0}
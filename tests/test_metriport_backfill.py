@@ -0,0 +1,38 @@
+from fhir_datasequence.metriport import (
+    METRIPORT_BIOMETRICS_TABLE_NAME,
+    METRIPORT_SLEEP_TABLE_NAME,
+)
+from fhir_datasequence.metriport.backfill import has_entries, split_unhandled_row
+
+
+def test_split_unhandled_row_keeps_unparsed_data():
+    data = {
+        "userId": "user",
+        "sleep": [
+            {"start_time": "2024-01-01T22:00:00+00:00"},
+            {"end_time": "2024-01-02T06:00:00+00:00"},
+        ],
+        "biometrics": [{"metadata": {"date": "2024-01-02"}, "heart_rate": {}}],
+        "nutrition": [{"calories": 2000}],
+    }
+
+    records, remaining = split_unhandled_row("user", data)
+
+    assert [record["uid"] for record in records[METRIPORT_SLEEP_TABLE_NAME]] == ["user"]
+    assert records[METRIPORT_BIOMETRICS_TABLE_NAME] == []
+    assert remaining == {
+        "userId": "user",
+        "sleep": [{"end_time": "2024-01-02T06:00:00+00:00"}],
+        "biometrics": data["biometrics"],
+        "nutrition": data["nutrition"],
+    }
+    assert has_entries(remaining)
+
+
+def test_fully_parsed_row_is_not_kept():
+    data = {"userId": "user", "sleep": [{"start_time": "2024-01-01T22:00:00"}]}
+
+    records, remaining = split_unhandled_row("user", data)
+
+    assert len(records[METRIPORT_SLEEP_TABLE_NAME]) == 1
+    assert not has_entries(remaining)
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from fhir_datasequence import config
+from fhir_datasequence.metriport.client import MetriportClient
+
+
+async def metriport_token(request: web.Request) -> web.Response:
+    status = int(request.query["userId"])
+    if status == 200:
+        return web.json_response({"token": "connect"})
+    return web.Response(status=status, text="upstream", headers={"Retry-After": "7"})
+
+
+async def request_connect_token(user_id: str, failures: int = 5) -> web.HTTPException:
+    app = web.Application()
+    app.router.add_get("/user/connect/token", metriport_token)
+    async with TestServer(app) as server, ClientSession(server.make_url("")) as session:
+        client = MetriportClient(session)
+        client.circuit.failures = failures
+        with pytest.raises(web.HTTPException) as exc_info:
+            await client.request("GET", "/user/connect/token", {"userId": user_id})
+        return exc_info.value
+
+
+@pytest.fixture(autouse=True)
+def _no_retries(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "METRIPORT_API_RETRIES", 0)
+
+
+def test_upstream_client_error_status_is_kept():
+    error = asyncio.run(request_connect_token("404"))
+
+    assert error.status == 404
+    assert error.text == "upstream"
+
+
+def test_upstream_server_error_status_is_kept():
+    error = asyncio.run(request_connect_token("503"))
+
+    assert error.status == 503
+    assert error.headers["Retry-After"] == "7"
+
+
+def test_open_circuit_is_service_unavailable(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "METRIPORT_API_RETRIES", 1)
+
+    error = asyncio.run(request_connect_token("500", failures=1))
+
+    assert isinstance(error, web.HTTPServiceUnavailable)
+    assert "Retry-After" in error.headers
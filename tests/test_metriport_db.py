@@ -0,0 +1,56 @@
+import datetime
+
+from sqlalchemy import BIGINT, INTEGER, TEXT, TIMESTAMP, Column, MetaData, Table
+from sqlalchemy.dialects import postgresql
+
+from fhir_datasequence.metriport.db import update_activity_records
+
+
+def metriport_records_table() -> Table:
+    return Table(
+        "metriport_records",
+        MetaData(),
+        Column("uid", TEXT),
+        Column("sid", TEXT),
+        Column("ts", TIMESTAMP(timezone=True)),
+        Column("code", TEXT),
+        Column("duration", INTEGER),
+        Column("energy", INTEGER),
+        Column("start", TIMESTAMP(timezone=True)),
+        Column("finish", TIMESTAMP(timezone=True)),
+        Column("provider", TEXT),
+        Column("ingested_xid", BIGINT),
+    )
+
+
+def test_update_activity_records_casts_null_only_columns():
+    start = datetime.datetime(2024, 1, 2, 10, tzinfo=datetime.UTC)
+    batch = [
+        {
+            "uid": "user",
+            "sid": "activity",
+            "ts": start,
+            "code": "walking",
+            "duration": None,
+            "energy": None,
+            "start": start,
+            "finish": None,
+            "provider": "garmin",
+        }
+    ]
+    sql = str(
+        update_activity_records(metriport_records_table(), batch).compile(
+            dialect=postgresql.dialect(),
+            compile_kwargs={"literal_binds": True},
+        )
+    )
+
+    # NOTE: without the casts Postgres types the NULL only VALUES columns as text
+    assert "duration=CAST(incoming.duration AS INTEGER)" in sql
+    assert "energy=CAST(incoming.energy AS INTEGER)" in sql
+    assert "finish=CAST(incoming.finish AS TIMESTAMP WITH TIME ZONE)" in sql
+    assert (
+        "metriport_records.start = CAST(incoming.start AS TIMESTAMP WITH TIME ZONE)"
+        in sql
+    )
+    assert "ingested_xid=CAST(CAST(pg_current_xact_id() AS TEXT) AS BIGINT)" in sql
@@ -0,0 +1,99 @@
+import datetime
+
+from fhir_datasequence.metriport.parsers import (
+    parse_biometrics,
+    parse_body,
+    parse_series_event,
+    parse_sleep,
+    record_sid,
+)
+
+DAY = datetime.datetime(2024, 1, 2, tzinfo=datetime.UTC)
+
+
+def test_parse_sleep():
+    entry = {
+        "start_time": "2024-01-01T22:00:00+00:00",
+        "end_time": "2024-01-02T06:00:00+00:00",
+        "durations": {
+            "total_seconds": 28800.4,
+            "deep_seconds": True,
+            "rem_seconds": "1",
+        },
+        "metadata": {"source": "oura"},
+    }
+    start = datetime.datetime(2024, 1, 1, 22, tzinfo=datetime.UTC)
+
+    [record] = parse_sleep("user", entry)
+
+    # NOTE: redeliveries of the entry update the same row
+    assert record["sid"] == record_sid("user", start, "sleep", "oura")
+    assert parse_sleep("user", entry) == [record]
+    assert record["ts"] == record["start"] == start
+    assert record["duration"] == 28800
+    # NOTE: bools and strings are not numbers of seconds
+    assert record["deep"] is None
+    assert record["rem"] is None
+
+
+def test_parse_sleep_without_start_time():
+    assert parse_sleep("user", {"end_time": "2024-01-02T06:00:00+00:00"}) == []
+    assert parse_sleep("user", {"start_time": 1704146400}) == []
+
+
+def test_samples_take_precedence_over_summaries():
+    entry = {
+        "metadata": {"date": "2024-01-02", "source": "withings"},
+        "heart_rate": {"resting_bpm": 55},
+        "hrv": {
+            "rmssd": {
+                "avg_millis": 40,
+                "samples_millis": [
+                    {"time": "2024-01-02T08:00:00Z", "value": 42},
+                    {"time": "2024-01-02T09:00:00Z", "value": "43"},
+                ],
+            },
+            "sdnn": {"avg_millis": 50},
+        },
+    }
+
+    records = parse_biometrics("user", entry)
+
+    assert sorted((r["code"], r["ts"].hour, r["value"]) for r in records) == [
+        ("heart_rate_resting", 0, 55.0),
+        ("hrv_rmssd", 8, 42.0),
+        ("hrv_sdnn", 0, 50.0),
+    ]
+    assert {r["provider"] for r in records} == {"withings"}
+
+
+def test_parse_samples_skips_bools_and_strings():
+    entry = {
+        "metadata": {"date": "2024-01-02"},
+        "weight_kg": True,
+        "height_cm": "180",
+        "body_fat_pct": 21.5,
+    }
+
+    [record] = parse_body("user", entry)
+
+    assert (record["code"], record["ts"], record["value"]) == ("body_fat", DAY, 21.5)
+    assert record["sid"] == record_sid("user", DAY, "body_fat", None)
+
+
+def test_summaries_need_the_entry_date():
+    assert parse_body("user", {"weight_kg": 70}) == []
+
+
+def test_parse_series_event_keeps_unparsed_entries():
+    parsed = {"metadata": {"date": "2024-01-02"}, "weight_kg": 70}
+    unparsed = {"metadata": {"date": "2024-01-02"}, "weight_kg": "70"}
+
+    records, left = parse_series_event("body", "user", [parsed, unparsed, "text"])
+
+    assert [record["code"] for record in records] == ["weight"]
+    assert left == [unparsed, "text"]
+    assert parse_series_event("sleep", "user", {"start_time": None}) == (
+        [],
+        [{"start_time": None}],
+    )
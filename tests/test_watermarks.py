@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+
+from sqlalchemy import BIGINT, TEXT, TIMESTAMP, Column, MetaData, Table
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from fhir_datasequence.api.conditional import read_watermark
+from fhir_datasequence.db import RECORDS_WATERMARKS_TABLE_NAME, touch_watermarks
+
+metadata = MetaData()
+watermarks = Table(
+    RECORDS_WATERMARKS_TABLE_NAME,
+    metadata,
+    Column("table_name", TEXT, primary_key=True),
+    Column("uid", TEXT, primary_key=True),
+    Column("version", BIGINT, nullable=False),
+    Column("modified_at", TIMESTAMP(timezone=True), nullable=False),
+)
+
+
+async def create_watermarks(database_url: str) -> AsyncEngine:
+    engine = create_async_engine(database_url)
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.drop_all)
+        await connection.run_sync(metadata.create_all)
+    return engine
+
+
+async def touch(engine: AsyncEngine, *uids: str | None):
+    async with engine.begin() as connection:
+        await touch_watermarks(connection, watermarks, "records", uids)
+
+
+async def read(engine: AsyncEngine, uid: str):
+    async with engine.connect() as connection:
+        return await read_watermark(connection, watermarks, "records", uid)
+
+
+def test_late_commit_moves_watermark(database_url: str):
+    async def scenario():
+        engine = await create_watermarks(database_url)
+        await touch(engine, "user")
+        async with engine.connect() as writer:
+            late = await writer.begin()
+            await touch_watermarks(writer, watermarks, "records", ["user"])
+            # NOTE: a reader served in the meantime keeps the committed state
+            before, _modified_at = await read(engine, "user")
+            await touch(engine, "other")
+            await late.commit()
+        after, _modified_at = await read(engine, "user")
+        await engine.dispose()
+        return before, after
+
+    assert asyncio.run(scenario()) == (1, 2)
+
+
+def test_every_change_moves_last_modified_by_a_second(database_url: str):
+    async def scenario():
+        engine = await create_watermarks(database_url)
+        await touch(engine, "user", None)
+        _version, first = await read(engine, "user")
+        await touch(engine, "user")
+        _version, second = await read(engine, "user")
+        await engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert second - first >= datetime.timedelta(seconds=1)